@@ -0,0 +1,95 @@
+# Real-time search benchmark of pymsreact
+#
+# Builds the fragment index of a random proteome with utils/fragment_index.py,
+# then measures the time to search synthetic MS2 scans, made of part of the b
+# and y ions of an indexed peptide among random noise peaks, and how many of
+# them are identified as their peptide.
+#
+# Usage (from the client/pymsreact folder):
+#   python benchmarks/fragment_index.py [-p proteins] [-s scans] [-n noise]
+#                                       [-b budget_ms]
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+import numpy as np
+from utils.fragment_index import (build_fragment_index, FragmentIndex,
+                                  AMINO_ACID_MASSES, PROTON_MASS)
+
+# Default budget of the search time per scan in milliseconds
+DEFAULT_BUDGET = 5
+# Length of the random proteins
+PROTEIN_LENGTH = 400
+# Fraction of the fragments of the peptide observed in a scan
+OBSERVED_FRACTION = 0.6
+# m/z range of the noise peaks
+MZ_RANGE = (100.0, 2000.0)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Real-time search ' +
+                                     'benchmark of pymsreact.')
+    parser.add_argument('-p', type = int, default = 5000, dest = 'proteins',
+                        help = 'number of proteins of the random proteome')
+    parser.add_argument('-s', type = int, default = 200, dest = 'scans',
+                        help = 'number of searched scans')
+    parser.add_argument('-n', type = int, default = 300, dest = 'noise',
+                        help = 'number of noise peaks per scan')
+    parser.add_argument('-b', type = float, default = DEFAULT_BUDGET,
+                        dest = 'budget',
+                        help = 'budget of the search time in ms')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    residues = list(AMINO_ACID_MASSES.keys())
+    with tempfile.TemporaryDirectory() as folder:
+        fasta = os.path.join(folder, 'proteome.fasta')
+        with open(fasta, 'w') as f:
+            for protein in range(args.proteins):
+                f.write(f'>protein_{protein}\n' +
+                        ''.join(rng.choice(residues, PROTEIN_LENGTH)) + '\n')
+        start = time.perf_counter()
+        peptides, fragments = build_fragment_index(fasta, folder)
+        build_time = time.perf_counter() - start
+
+        index = FragmentIndex(folder)
+        fragment_peptides = np.asarray(index.fragment_peptides)
+        times = []
+        identified = 0
+        for _ in range(args.scans):
+            peptide = int(rng.integers(len(index.peptides)))
+            ions = np.asarray(index.fragment_mzs[fragment_peptides == peptide],
+                              dtype = np.float64)
+            ions = ions[rng.random(len(ions)) < OBSERVED_FRACTION]
+            mzs = np.concatenate((ions, rng.uniform(*MZ_RANGE, args.noise)))
+            intensities = rng.lognormal(10, 1, len(mzs))
+            intensities[:len(ions)] *= 3
+            order = np.argsort(mzs)
+            precursor_mz = index.peptide_masses[peptide] / 2 + PROTON_MASS
+            start = time.perf_counter()
+            result = index.search(mzs[order], intensities[order], precursor_mz)
+            times.append(time.perf_counter() - start)
+            if ((result is not None) and
+                (result.peptide == index.peptides[peptide].decode('ascii'))):
+                identified += 1
+    search_time = statistics.median(times) * 1e3
+
+    print(f'{peptides} peptides, {fragments} fragments, ' +
+          f'median of {args.scans} scans:')
+    print(f'  {"index build time":<30} {build_time:8.2f} s')
+    print(f'  {"search time":<30} {search_time:8.2f} ms')
+    print(f'  {"scans identified":<30} {100 * identified / args.scans:8.1f} %')
+
+    if search_time > args.budget:
+        sys.exit(f'Search time {search_time:.2f} ms exceeds the ' +
+                 f'budget of {args.budget:.1f} ms.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Isotope envelope detection benchmark of pymsreact
+#
+# Measures the time utils/isotopes.py takes to detect the isotope envelopes of
+# a synthetic survey scan, made of peptide envelopes with averagine-like
+# intensities among random noise centroids, and how many of the envelopes get
+# their charge and monoisotopic peak right.
+#
+# Usage (from the client/pymsreact folder):
+#   python benchmarks/isotopes.py [-c centroids] [-p peptides] [-r repeats]
+#                                 [-b budget_ms]
+
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+import numpy as np
+from utils.isotopes import (detect_envelopes, precursor_candidates,
+                            ISOTOPE_RATIO_PER_DA, ISOTOPE_SPACING, PROTON_MASS)
+
+# Default budget of the detection time per scan in milliseconds
+DEFAULT_BUDGET = 5
+# m/z range of the noise centroids
+MZ_RANGE = (300.0, 2000.0)
+# Relative intensity below which the isotope peaks are not observed
+MIN_RELATIVE_INTENSITY = 0.05
+
+def synthetic_scan(centroid_count, peptide_count, seed):
+    # Returns the sorted m/z values and intensities, and for each centroid
+    # its (charge, isotope) or None for noise.
+    rng = np.random.default_rng(seed)
+    mzs, intensities, truth = [], [], []
+    for _ in range(peptide_count):
+        charge = int(rng.integers(1, 5))
+        mass = rng.uniform(600, 4000)
+        expected_ratio = mass * ISOTOPE_RATIO_PER_DA
+        monoisotopic_mz = mass / charge + PROTON_MASS
+        intensity = rng.lognormal(12, 1.5)
+        for isotope in range(5):
+            # Poisson approximation of the isotope distribution
+            relative = expected_ratio ** isotope / math.factorial(isotope)
+            if relative < MIN_RELATIVE_INTENSITY:
+                break
+            mz = monoisotopic_mz + isotope * ISOTOPE_SPACING / charge
+            mzs.append(mz + rng.normal(0, mz * 1e-6))
+            intensities.append(intensity * relative)
+            truth.append((charge, isotope))
+    noise_count = max(centroid_count - len(mzs), 0)
+    mzs.extend(rng.uniform(*MZ_RANGE, noise_count))
+    intensities.extend(rng.lognormal(8, 1, noise_count))
+    truth.extend([None] * noise_count)
+    order = np.argsort(mzs)
+    return (np.asarray(mzs)[order], np.asarray(intensities)[order],
+            [truth[i] for i in order])
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Isotope envelope ' +
+                                     'detection benchmark of pymsreact.')
+    parser.add_argument('-c', type = int, default = 20000, dest = 'centroids',
+                        help = 'number of centroids of the survey scan')
+    parser.add_argument('-p', type = int, default = 3000, dest = 'peptides',
+                        help = 'number of peptide envelopes')
+    parser.add_argument('-r', type = int, default = 50, dest = 'repeats',
+                        help = 'number of repeats')
+    parser.add_argument('-b', type = float, default = DEFAULT_BUDGET,
+                        dest = 'budget',
+                        help = 'budget of the detection time in ms')
+    args = parser.parse_args()
+
+    mzs, intensities, truth = synthetic_scan(args.centroids, args.peptides, 0)
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        envelopes = detect_envelopes(mzs, intensities)
+        times.append(time.perf_counter() - start)
+    detection_time = statistics.median(times) * 1e3
+
+    candidates = set(precursor_candidates(envelopes).tolist())
+    monoisotopic = [i for i, t in enumerate(truth) if t and 0 == t[1]]
+    isotopes = [i for i, t in enumerate(truth) if t and t[1] > 0]
+    right_charge = sum(envelopes.charges[i] == truth[i][0] for i in monoisotopic)
+    print(f'{len(mzs)} centroids, {args.peptides} peptide envelopes, ' +
+          f'median of {args.repeats} runs:')
+    print(f'  {"detection time":<40} {detection_time:8.2f} ms')
+    print(f'  {"charges of monoisotopic peaks right":<40} ' +
+          f'{100 * right_charge / len(monoisotopic):8.1f} %')
+    print(f'  {"monoisotopic peaks kept as candidates":<40} ' +
+          f'{100 * len(candidates.intersection(monoisotopic)) / len(monoisotopic):8.1f} %')
+    print(f'  {"isotope peaks left out of candidates":<40} ' +
+          f'{100 * len(set(isotopes) - candidates) / len(isotopes):8.1f} %')
+
+    if detection_time > args.budget:
+        sys.exit(f'Detection time {detection_time:.2f} ms exceeds the ' +
+                 f'budget of {args.budget:.1f} ms.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Precursor selection benchmark of pymsreact
+#
+# Compares the vectorized top N precursor selection of
+# utils/precursor_selection.py with the loop the top N acquisition used before:
+# sorting all centroids of the survey scan by intensity, then checking the
+# candidates one by one against each entry of the exclusion list. Both select
+# the same precursors from synthetic survey scans.
+#
+# Usage (from the client/pymsreact folder):
+#   python benchmarks/precursor_selection.py [-c centroids] [-e excluded]
+#                                            [-k top_n] [-r repeats]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+import numpy as np
+from algorithms.manager.acquisition import CentroidFields
+from utils.precursor_selection import centroid_arrays, select_top_n, tolerance_mask
+
+# Tolerance for the exclusion, as in the top N acquisition
+MZ_TOLERANCE = 0.0001
+# m/z range of the synthetic centroids
+MZ_RANGE = (300.0, 2000.0)
+
+def synthetic_scan(centroid_count, excluded_count, seed):
+    # Centroids in the format they are received in, and an exclusion list
+    # that contains the m/z of some of the most intense ones.
+    rng = random.Random(seed)
+    centroids = []
+    for _ in range(centroid_count):
+        centroid = [0] * len(CentroidFields)
+        centroid[CentroidFields.MZ] = rng.uniform(*MZ_RANGE)
+        centroid[CentroidFields.INTENSITY] = rng.lognormvariate(10, 2)
+        centroids.append(centroid)
+    by_intensity = sorted(centroids, key = lambda c: c[CentroidFields.INTENSITY],
+                          reverse = True)
+    excluded = [c[CentroidFields.MZ] for c in by_intensity[:excluded_count // 2]]
+    excluded += [rng.uniform(*MZ_RANGE) for _ in range(excluded_count - len(excluded))]
+    rng.shuffle(excluded)
+    return centroids, excluded
+
+def loop_selection(centroids, exclusion_list, n):
+    # The selection of the top N acquisition before the vectorized one
+    mzs = [centroid[CentroidFields.MZ] for centroid in centroids]
+    intensities = [centroid[CentroidFields.INTENSITY] for centroid in centroids]
+    centroids = [{CentroidFields.MZ : mzs[i],
+                  CentroidFields.INTENSITY: intensities[i] }
+                 for i in range(len(mzs))]
+    centroids.sort(key=lambda i: i[CentroidFields.INTENSITY], reverse=True)
+    i = 0
+    selected = []
+    while ((i < len(centroids)) and (len(selected) != n)):
+        not_excluded = True
+        for centroid_excl in exclusion_list:
+            if MZ_TOLERANCE > abs(centroids[i][CentroidFields.MZ] - centroid_excl[CentroidFields.MZ]):
+                not_excluded = False
+                break
+        if not_excluded:
+            selected.append(centroids[i][CentroidFields.MZ])
+        i = i + 1
+    return selected
+
+def vectorized_selection(mzs, intensities, sorted_excluded, n):
+    selected = select_top_n(mzs, intensities, n,
+                            excluded = lambda candidates: tolerance_mask(
+                                candidates, sorted_excluded, MZ_TOLERANCE))
+    return mzs[selected].tolist()
+
+def timed(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Precursor selection ' +
+                                     'benchmark of pymsreact.')
+    parser.add_argument('-c', type = int, default = 20000, dest = 'centroids',
+                        help = 'number of centroids of the survey scan')
+    parser.add_argument('-e', type = int, default = 3000, dest = 'excluded',
+                        help = 'number of entries of the exclusion list')
+    parser.add_argument('-k', type = int, default = 15, dest = 'top_n',
+                        help = 'number of precursors to select')
+    parser.add_argument('-r', type = int, default = 20, dest = 'repeats',
+                        help = 'number of repeats')
+    args = parser.parse_args()
+
+    centroids, excluded = synthetic_scan(args.centroids, args.excluded, 0)
+    exclusion_list = [{CentroidFields.MZ : mz} for mz in excluded]
+
+    loop_result, loop_time = timed(
+        lambda: loop_selection(centroids, exclusion_list, args.top_n),
+        args.repeats)
+    (mzs, intensities), conversion_time = timed(
+        lambda: centroid_arrays(centroids), args.repeats)
+    sorted_excluded, sort_time = timed(lambda: np.sort(excluded), args.repeats)
+    vectorized_result, selection_time = timed(
+        lambda: vectorized_selection(mzs, intensities, sorted_excluded, args.top_n),
+        args.repeats)
+
+    if loop_result != vectorized_result:
+        sys.exit('The selections differ.')
+
+    print(f'Top {args.top_n} of {args.centroids} centroids, ' +
+          f'{args.excluded} excluded m/z, median of {args.repeats} runs:')
+    print(f'  {"loop":<32} {loop_time * 1e3:10.3f} ms')
+    print(f'  {"centroids to arrays":<32} {conversion_time * 1e3:10.3f} ms')
+    print(f'  {"exclusion list sorting":<32} {sort_time * 1e3:10.3f} ms')
+    print(f'  {"vectorized selection":<32} {selection_time * 1e3:10.3f} ms')
+    total = conversion_time + sort_time + selection_time
+    print(f'Speedup including the conversion: {loop_time / total:.0f}x, ' +
+          f'of the selection alone: {loop_time / selection_time:.0f}x')
+
+if __name__ == '__main__':
+    main()
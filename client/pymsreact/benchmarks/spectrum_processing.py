@@ -0,0 +1,103 @@
+# MS2 spectrum preprocessing benchmark of pymsreact
+#
+# Measures the cost per spectrum of each preprocessing step of
+# utils/spectrum_processing.py, and of a whole pipeline, on synthetic MS2
+# spectra made of fragment isotope envelopes among noise peaks. The pipeline
+# is applied once to a batch of all spectra, and once to each spectrum.
+#
+# Usage (from the client/pymsreact folder):
+#   python benchmarks/spectrum_processing.py [-s spectra] [-p peaks]
+#                                            [-r repeats]
+
+import argparse
+import functools
+import os
+import statistics
+import sys
+import time
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+import numpy as np
+from utils.isotopes import ISOTOPE_SPACING
+from utils.spectrum_processing import (spectra_from_arrays, remove_noise,
+                                       filter_relative_intensity,
+                                       top_k_per_window, deisotope,
+                                       reduce_charges, normalize_intensities,
+                                       SpectrumPipeline)
+
+# Fraction of the peaks of a spectrum that are fragment envelopes
+FRAGMENT_FRACTION = 0.5
+
+def synthetic_spectra(spectrum_count, peak_count, seed):
+    # Returns the (mzs, intensities) arrays of the spectra.
+    rng = np.random.default_rng(seed)
+    spectra = []
+    for _ in range(spectrum_count):
+        envelope_count = int(peak_count * FRAGMENT_FRACTION / 3)
+        charges = rng.integers(1, 3, envelope_count)
+        monoisotopic = rng.uniform(150, 1800, envelope_count)
+        intensities = rng.lognormal(10, 1, envelope_count)
+        mzs = np.concatenate([monoisotopic + isotope * ISOTOPE_SPACING / charges
+                              for isotope in range(3)] +
+                             [rng.uniform(100, 2000, peak_count - 3 * envelope_count)])
+        intensities = np.concatenate([intensities * ratio for ratio in (1, 0.6, 0.2)] +
+                                     [rng.lognormal(8, 1, peak_count - 3 * envelope_count)])
+        order = np.argsort(mzs)
+        spectra.append((mzs[order], intensities[order]))
+    return spectra
+
+def cost(function, argument, repeats, spectrum_count):
+    # Returns the median cost of a call per spectrum in microseconds.
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6 / spectrum_count
+
+def main():
+    parser = argparse.ArgumentParser(description = 'MS2 spectrum ' +
+                                     'preprocessing benchmark of pymsreact.')
+    parser.add_argument('-s', type = int, default = 1000, dest = 'spectra',
+                        help = 'number of spectra of the batch')
+    parser.add_argument('-p', type = int, default = 300, dest = 'peaks',
+                        help = 'number of peaks per spectrum')
+    parser.add_argument('-r', type = int, default = 20, dest = 'repeats',
+                        help = 'number of repeats')
+    args = parser.parse_args()
+
+    arrays = synthetic_spectra(args.spectra, args.peaks, 0)
+    batch = spectra_from_arrays(arrays)
+    steps = [('remove_noise', functools.partial(remove_noise, signal_to_noise = 2)),
+             ('filter_relative_intensity', filter_relative_intensity),
+             ('deisotope', deisotope),
+             ('reduce_charges', reduce_charges),
+             ('top_k_per_window', top_k_per_window),
+             ('normalize_intensities', functools.partial(normalize_intensities,
+                                                         transform = 'sqrt'))]
+    pipeline = SpectrumPipeline([step for _, step in steps])
+
+    print(f'{args.spectra} spectra of {args.peaks} peaks, ' +
+          f'median of {args.repeats} runs, per spectrum:')
+    print(f'  {"batch creation":<40} ' +
+          f'{cost(spectra_from_arrays, arrays, args.repeats, args.spectra):8.2f} us')
+    # Each step is measured on the output of the previous ones.
+    spectra = batch
+    for name, step in steps:
+        print(f'  {name:<40} ' +
+              f'{cost(step, spectra, args.repeats, args.spectra):8.2f} us')
+        spectra = step(spectra)
+    print(f'  {"pipeline, batch":<40} ' +
+          f'{cost(pipeline, batch, args.repeats, args.spectra):8.2f} us')
+    single = lambda arrays: [pipeline.process(mzs, intensities)
+                             for mzs, intensities in arrays]
+    print(f'  {"pipeline, one spectrum at a time":<40} ' +
+          f'{cost(single, arrays, max(args.repeats // 10, 1), args.spectra):8.2f} us')
+    print(f'  {"peaks kept":<40} ' +
+          f'{100 * len(spectra.mzs) / len(batch.mzs):8.1f} %')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Startup benchmark of pymsreact
+#
+# Measures, in a fresh interpreter each time, how long the client takes from
+# the start of the interpreter to the first connection with a server: importing
+# the client, constructing it and connecting to a local WebSocket server that
+# stands in for the MSReact server. The import time of the heaviest modules is
+# listed with -X importtime.
+#
+# Usage (from the client/pymsreact folder):
+#   python benchmarks/startup.py [-n runs] [-b budget_ms] [-t top_modules]
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+
+# Default budget of the time to first connect in milliseconds
+DEFAULT_BUDGET = 1000
+
+# Code run in the fresh interpreter. Reports the time of each phase in
+# milliseconds, measured from the start of the interpreter.
+CHILD_CODE = '''
+import time
+start = time.perf_counter()
+import asyncio, json, os, sys
+sys.path.insert(0, {package_dir!r})
+os.makedirs(os.path.join('output', 'log'), exist_ok=True)
+phases = {{}}
+def mark(phase):
+    phases[phase] = (time.perf_counter() - start) * 1000
+import msreact_client
+mark('import')
+client = msreact_client.MSReactClient()
+mark('construct')
+import com.protocol.msrp as msrp
+import com.transport.websocket as wst
+protocol = msrp.MSReactProtocol(wst.WebSocketTransport())
+mark('protocol')
+connected = client.loop.run_until_complete(protocol.connect('127.0.0.1'))
+mark('connect')
+client.loop.run_until_complete(protocol.disconnect())
+phases['connected'] = connected
+print(json.dumps(phases))
+'''
+
+PHASES = ['import', 'construct', 'protocol', 'connect']
+
+def serve(ready, stop):
+    # Minimal WebSocket server accepting the connection of the client, at the
+    # port the WebSocket transport connects to.
+    import websockets
+
+    async def handler(websocket, path = None):
+        await websocket.wait_closed()
+
+    async def run():
+        async with websockets.serve(handler, '127.0.0.1', 4649):
+            ready.set()
+            while not stop.is_set():
+                await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+def run_child(work_dir, extra_args = ()):
+    code = CHILD_CODE.format(package_dir = PACKAGE_DIR)
+    result = subprocess.run([sys.executable, *extra_args, '-c', code],
+                            cwd = work_dir,
+                            capture_output = True,
+                            text = True,
+                            check = True)
+    return result
+
+def import_profile(work_dir, top):
+    # -X importtime reports the cumulative import time of each module in
+    # microseconds on stderr.
+    result = run_child(work_dir, ['-X', 'importtime'])
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [x.strip() for x in line[12:].split('|')]
+        if not name.startswith(' '):
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse = True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Startup benchmark of ' +
+                                     'pymsreact.')
+    parser.add_argument('-n', type = int, default = 5, dest = 'runs',
+                        help = 'number of runs')
+    parser.add_argument('-b', type = float, default = DEFAULT_BUDGET,
+                        dest = 'budget',
+                        help = 'budget of the time to first connect in ms')
+    parser.add_argument('-t', type = int, default = 10, dest = 'top',
+                        help = 'number of top level imports to list')
+    args = parser.parse_args()
+
+    ready = threading.Event()
+    stop = threading.Event()
+    server = threading.Thread(target = serve, args = (ready, stop), daemon = True)
+    server.start()
+    ready.wait()
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            runs = []
+            for _ in range(args.runs):
+                phases = json.loads(run_child(work_dir).stdout.splitlines()[-1])
+                if not phases.pop('connected'):
+                    sys.exit('The client could not connect to the server.')
+                runs.append(phases)
+            top_imports = import_profile(work_dir, args.top)
+    finally:
+        stop.set()
+        server.join()
+
+    print(f'Median of {args.runs} runs, from interpreter start:')
+    for phase in PHASES:
+        print(f'  {phase:<10} {statistics.median(r[phase] for r in runs):8.1f} ms')
+    print(f'Top {args.top} imports by cumulative time:')
+    for cumulative, name in top_imports:
+        print(f'  {name:<40} {cumulative / 1000:8.1f} ms')
+
+    time_to_connect = statistics.median(r['connect'] for r in runs)
+    if time_to_connect > args.budget:
+        sys.exit(f'Time to first connect {time_to_connect:.1f} ms exceeds ' +
+                 f'the budget of {args.budget:.0f} ms.')
+
+if __name__ == '__main__':
+    main()
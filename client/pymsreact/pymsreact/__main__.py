@@ -34,6 +34,20 @@ def main():
             client.logger.error(f'Exception occured:')
             traceback.print_exc()
             loop.stop()
+    elif ('multi' == args.command):
+        try:
+            loop.run_until_complete(client.run_multi(loop, args))
+        except Exception as e:
+            client.logger.error(f'Exception occured:')
+            traceback.print_exc()
+            loop.stop()
+    elif ('broker' == args.command):
+        try:
+            loop.run_until_complete(client.run_broker(loop, args))
+        except Exception as e:
+            client.logger.error(f'Exception occured:')
+            traceback.print_exc()
+            loop.stop()
     elif ('test' == args.command):
         try:
             loop.run_until_complete(client.test_app(loop, args))
@@ -2,14 +2,17 @@ import traceback
 from .ms_instruments.ms_instrument import MassSpectrometerInstrument
 from . import acquisition_workflow as aw
 from . import acquisition_settings as acqs
+from . import config_cache
+from .transfer_register import TransferRegister
+from .request_tracker import RequestTracker
 import threading
 import multiprocessing
 import logging
 import logging.config
 import importlib
 import inspect
+import itertools
 import time
-import json
 import queue
 from enum import Enum, IntEnum
 from abc import abstractmethod
@@ -17,8 +20,6 @@ from concurrent.futures import ProcessPoolExecutor
 import asyncio
 from pprint import pformat
 
-from pyhocon import ConfigFactory
-
 class AcqMsgIDs(Enum):
     """
     Enum of acquisition message ids
@@ -43,6 +44,8 @@ class AcqMsgIDs(Enum):
     RECEIVED_RAW_FILE_NAMES = 18
     SUBSCRIBE_FOR_SCANS = 19
     UNSUBSCRIBE_FROM_SCANS = 20
+    REQUEST_DROPPED = 21
+    REGISTER_SCAN_TEMPLATE = 22
     
 class AcqStatIDs(Enum):
     """
@@ -100,7 +103,6 @@ class Acquisition:
     
     """
     
-    TRANSFER_REGISTER_NAME = '.\\transfer_register.json'
     instruments = [MassSpectrometerInstrument]
 
     def __init__(self, queue_in, queue_out):
@@ -124,7 +126,6 @@ class Acquisition:
         self.status_lock = threading.Lock()
         self.raw_file_names_lock = threading.Lock()
         self.raw_file_lock = threading.Lock()
-        self.transfer_register_lock = threading.Lock()
         self.acquisition_started = threading.Event()
         self.stop_listening = threading.Event()
         self.thread_exited_dirty = threading.Event()
@@ -134,8 +135,11 @@ class Acquisition:
         self.recent_raw_file_names = []
         self.last_raw_file = ''
         
-        self.transfer_register = {}
-        self.transfer_register_file = ''
+        self.transfer_register = None
+        self.possible_params = None
+        # Outstanding custom scan requests, matched to the received scans
+        self.request_tracker = RequestTracker()
+        self.repeating_scan_ids = itertools.count(1)
         
         # Since the acquisition objects are instantiated in separate processes,
         # logging needs to be initialized. The log messages from the acquisition
@@ -156,25 +160,27 @@ class Acquisition:
             
         self.logger = logging.getLogger(__name__)
         
-    def configure(self, raw_file_name, configs, transfer_register):
+    def configure(self,
+                  raw_file_name,
+                  configs,
+                  transfer_register,
+                  possible_params = None):
         self.raw_file_name = raw_file_name
+        self.possible_params = possible_params
         
         # Load configurations. The workflow configurations are overwritten by 
-        # acquisition task specific configurations.
-        self.config = {}
-        for config in configs:
-            if config is not None:
-                configtree = ConfigFactory.parse_file(config)
-                self.config.update(json.loads(json.dumps(configtree.as_plain_ordered_dict())))
+        # acquisition task specific configurations. The configurations are
+        # usually already parsed and cached by the algorithm runner.
+        self.config = config_cache.load_configs(configs)
             
-        self.transfer_register_file = transfer_register
-        with open(transfer_register, 'r') as f:
-            self.transfer_register = json.load(f)
+        # The values of the transfer register are read on demand, only the
+        # keys are loaded here.
+        self.transfer_register = TransferRegister(transfer_register)
             
         self.logger.info('Acquisition was configured with the following ' +
                          f'configuration:\n\t{pformat(self.config)}')
         self.logger.info('The transfer register contains the following ' +
-                         f'information:\n\t{pformat(self.transfer_register)}')
+                         f'keys:\n\t{pformat(self.transfer_register.keys())}')
     
     def fetch_received_scan(self):
         """Try to fetch a scan from the received scans queue. If the queue is 
@@ -203,39 +209,139 @@ class Acquisition:
         """Requests from the algorithm runner to stop the acquisition"""
         self.queue_out.put((AcqMsgIDs.REQUEST_ACQUISITION_STOP, None))
         
-    def request_custom_scan(self, request, request_id = None):
-        """Requests a custom scan with the given parameters
+    def create_scan_template(self, params, varying = None):
+        """Creates a custom scan request template with the given constant
+        parameters. The parameters are validated against the possible 
+        parameters of the instrument, and the template is registered with the
+        session, which sets its constant parameters as defaults on the server.
+        Parameters
+        ----------
+        params : dict
+            Constant custom scan request parameters in the form of 
+            parameter_name : value, eg. "ScanType" : "MSn"
+        varying : tuple
+            Names of the parameters given at each request. By default the
+            precursor mass and the request id.
+        Returns
+        -------
+        ScanRequestTemplate
+            The template, whose rendered requests can be passed to
+            request_custom_scan. """
+        from . import scan_request
+        if varying is None:
+            varying = (scan_request.PRECURSOR_MASS, scan_request.REQUEST_ID)
+        template = scan_request.ScanRequestTemplate(params,
+                                                    self.possible_params,
+                                                    varying)
+        self.queue_out.put((AcqMsgIDs.REGISTER_SCAN_TEMPLATE,
+                            (template.template_id, template.defaults)))
+        return template
+        
+    def request_custom_scan(self,
+                            request,
+                            request_id = None,
+                            priority = 0,
+                            expiry = None,
+                            precursor_mz = None,
+                            survey_scan = None):
+        """Requests a custom scan with the given parameters. The request is
+        scheduled by the session before it is sent to the instrument.
         Parameters
         ----------
-        request : dict
+        request : dict or RenderedScanRequest
             Custom scan request parameters organised into a string-string 
             dictionary in the form of parameter_name : value, eg. 
-            "PrecursorMass" : "800.25" """
-        # TODO: Should check if the int is 64 bit length or not.
-        if ((request_id is not None) and (isinstance(request_id, int))):
-            request.update({'REQUEST_ID' : request_id})
-
-        self.queue_out.put((AcqMsgIDs.REQUEST_SCAN, request))       
+            "PrecursorMass" : "800.25", or a request rendered by a 
+            ScanRequestTemplate, see create_scan_template.
+        request_id : int or str
+            Id of the request. It is added to dictionary requests, rendered
+            requests have to contain it already and it is taken from them.
+        priority : int
+            Requests with higher priority are sent first.
+        expiry : float
+            Time in seconds after which the request is dropped if it was not
+            sent yet. None if the request does not expire.
+        precursor_mz : float
+            Precursor m/z of the request, used to drop duplicate requests. 
+            Taken from the "PrecursorMass" parameter of dictionary requests
+            if not given.
+        survey_scan : int
+            Scan number of the survey scan the request was computed from. The
+            request is dropped once a newer survey scan was received. """
+        from .scan_request import (ScanRequest, RenderedScanRequest,
+                                   PRECURSOR_MASS, REQUEST_ID)
+        if isinstance(request, RenderedScanRequest):
+            request_id = request.request_id
+        elif isinstance(request, dict):
+            # TODO: Should check if the int is 64 bit length or not.
+            if ((request_id is not None) and (isinstance(request_id, int))):
+                request.update({REQUEST_ID : request_id})
+            request_id = request.get(REQUEST_ID, request_id)
+            if precursor_mz is None and PRECURSOR_MASS in request:
+                precursor_mz = float(request[PRECURSOR_MASS])
+        deadline = None if expiry is None else time.time() + expiry
+        if request_id is not None:
+            self.request_tracker.request_sent(request_id)
+        self.queue_out.put((AcqMsgIDs.REQUEST_SCAN,
+                            ScanRequest(request,
+                                        priority,
+                                        deadline,
+                                        precursor_mz,
+                                        survey_scan,
+                                        request_id)))
         
-    def request_repeating_scan(self, request):
-        """Request a repeating scan with the given parameters
+    def request_repeating_scan(self,
+                               request,
+                               scan_id = None,
+                               rt_window = None,
+                               lifetime = None,
+                               priority = 0):
+        """Request a repeating scan with the given parameters. The session
+        issues the scan on the instrument while its retention time window is
+        open and until the end of its lifetime, and cancels it afterwards.
         Parameters
         ----------
-        request : dict
+        request : dict or RenderedScanRequest
             Repeating scan request parameters organised into a string-string 
             dictionary in the form of parameter_name : value, eg. 
-            "PrecursorMass" : "800.25" """
-        self.queue_out.put((AcqMsgIDs.REQUEST_REPEATING_SCAN, request))
+            "PrecursorMass" : "800.25", or a request rendered by a 
+            ScanRequestTemplate.
+        scan_id : int or str
+            Id of the repeating scan, to cancel or replace it later. 
+            Generated if not given.
+        rt_window : tuple
+            (start, end) retention times in minutes between which the scan is
+            repeated. None to repeat it regardless of the retention time.
+        lifetime : float
+            Time in seconds after which the scan is cancelled. None if the
+            scan is repeated until it is cancelled.
+        priority : int
+            The repeating scans with higher priority are repeated first, if 
+            the instrument cannot repeat all of them at the same time.
+        Returns
+        -------
+        int or str
+            Id of the repeating scan. """
+        from .scan_request import RepeatingScanRequest
+        if scan_id is None:
+            scan_id = next(self.repeating_scan_ids)
+        deadline = None if lifetime is None else time.time() + lifetime
+        self.queue_out.put((AcqMsgIDs.REQUEST_REPEATING_SCAN,
+                            RepeatingScanRequest(request,
+                                                 scan_id,
+                                                 rt_window,
+                                                 deadline,
+                                                 priority)))
+        return scan_id
         
-    def cancel_repeating_scan(self, request):
-        """Cancel a repeating scan with the given parameters
+    def cancel_repeating_scan(self, scan_id = None):
+        """Cancel a repeating scan
         Parameters
         ----------
-        request : dict
-            Repeating scan request parameters to cancel organised into a
-            string-string dictionary in the form of parameter_name : value, eg. 
-            "PrecursorMass" : "800.25" """
-        self.queue_out.put((AcqMsgIDs.CANCEL_REPEATING_SCAN, request))
+        scan_id : int or str
+            Id of the repeating scan to cancel, as returned by 
+            request_repeating_scan. None cancels all repeating scans. """
+        self.queue_out.put((AcqMsgIDs.CANCEL_REPEATING_SCAN, scan_id))
         
     def request_def_scan_param_update(self, params):
         """Request the update of default scan parameters. When a custom scan is 
@@ -329,13 +435,29 @@ class Acquisition:
             self.last_raw_file = raw_file_path
             
     def update_transfer_register(self, data):
-        with self.transfer_register_lock:
-            self.transfer_register.update(data)
+        """Writes the given values to the transfer register, so they are
+        available to the following acquisitions of the algorithm.
+        Parameters
+        ----------
+        data : dict
+            Dictionary of keys and values to write. The values can be JSON
+            serializable values, bytes or NumPy arrays."""
+        self.transfer_register.update(data)
             
     def save_transfer_register(self):
-        with self.transfer_register_lock:
-            with open(self.transfer_register_file, "w") as outfile:
-                json.dump(self.transfer_register, outfile)
+        """The transfer register is written on each update, this only 
+        releases the connection of the calling thread."""
+        self.transfer_register.close()
+
+    def get_request_stats(self):
+        """Get the statistics of the custom scan requests of the acquisition:
+        the fulfillment latency, the loss rate and the number of outstanding
+        requests among others. See RequestTracker.stats.
+        
+        Returns:
+            dict: The statistics of the requests
+        """
+        return self.request_tracker.stats()
 
     def subscribe_for_scans(self):
         self.queue_out.put((AcqMsgIDs.SUBSCRIBE_FOR_SCANS, None))
@@ -357,6 +479,8 @@ class Acquisition:
                 self.update_recent_raw_file_names(payload)
             elif AcqMsgIDs.RAW_FILE_DOWNLOAD_FINISHED == cmd:
                 self.update_raw_file_download_status(payload)
+            elif AcqMsgIDs.REQUEST_DROPPED == cmd:
+                self.request_tracker.request_dropped(payload)
             elif AcqMsgIDs.ACQUISITION_ENDED == cmd:
                 self.update_acquisition_status(AcqStatIDs.ACQUISITION_ENDED_NORMAL)
                 break
@@ -377,6 +501,8 @@ class Acquisition:
                 time.sleep(0.001)
                 continue
             if AcqMsgIDs.SCAN == cmd:
+                if 1 < payload[ScanFields.MS_SCAN_LEVEL]:
+                    self.request_tracker.scan_received(payload[ScanFields.ACCESS_ID])
                 self.scan_queue.put(payload)
             elif AcqMsgIDs.ACQUISITION_STARTED == cmd:
                 self.logger.info('Received acquisition started message.')
@@ -385,6 +511,8 @@ class Acquisition:
                 self.update_recent_raw_file_names(payload)
             elif AcqMsgIDs.RAW_FILE_DOWNLOAD_FINISHED == cmd:
                 self.update_raw_file_download_status(payload)
+            elif AcqMsgIDs.REQUEST_DROPPED == cmd:
+                self.request_tracker.request_dropped(payload)
             elif AcqMsgIDs.ACQUISITION_ENDED == cmd:
                 self.update_acquisition_status(AcqStatIDs.ACQUISITION_ENDED_NORMAL)
             elif AcqMsgIDs.ERROR == cmd:
@@ -437,7 +565,8 @@ def acquisition_process(module_name,
                         queue_in,
                         queue_out,
                         configs,
-                        transfer_register):
+                        transfer_register,
+                        possible_params = None):
     """This method is responsible for executing the pre-, intra- and 
        post-acquisition steps. The method is ran in a separate proccess.
 
@@ -453,13 +582,18 @@ def acquisition_process(module_name,
     queue_out : queue.Queue
        Output queue through which the acquisition can send messages to the 
        algorithm runner
+    possible_params : list
+       Possible scan parameters of the instrument
     """
     try:
         # Create and configure acquisition
         module = importlib.import_module(module_name)
         class_ = getattr(module, acquisition_name)
         acquisition = class_(queue_in, queue_out)
-        acquisition.configure(raw_file_name, configs, transfer_register)
+        acquisition.configure(raw_file_name,
+                              configs,
+                              transfer_register,
+                              possible_params)
 
         # Start listening for messages
         msg_listener_thread = \
@@ -497,6 +631,8 @@ def acquisition_process(module_name,
                 time.sleep(0.001)
             acquisition.subscribe_for_scans()
             acquisition.exec_acq_thread(intra_acq_thread)
+            acquisition.logger.info('Custom scan requests: ' +
+                                    f'{acquisition.get_request_stats()}')
 
             # After joining the acquisition thread, check if there are any scans left 
             # in the scan queue. Since the acquisition thread is already 
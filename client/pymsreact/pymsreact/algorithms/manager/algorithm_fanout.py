@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from .acquisition import AcqMsgIDs
+from .algorithm_runner import AlgorithmManager
+from .delivery import DropPolicies, DEFAULT_MAX_PENDING
+
+class AlgorithmFanOut:
+    """
+    This module is responsible for running several algorithms concurrently on
+    the scan stream of a single instrument client. It exposes the same
+    interface towards the application as the AlgorithmManager.
+
+    The lead algorithm is the only one that is allowed to control the
+    acquisition and to issue custom scans. The follower algorithms receive the
+    same scans and acquisition events through their own delivery channel, so a
+    slow follower cannot stall the lead or the other followers.
+
+    ...
+
+    Attributes
+    ----------
+    lead : AlgorithmManager
+        Algorithm manager of the algorithm that controls the acquisition and
+        is allowed to issue custom scans.
+    followers : list
+        List of algorithm managers of the passive algorithms.
+    """
+
+    def __init__(self, lead):
+        """
+        Parameters
+        ----------
+        lead : AlgorithmManager
+            Algorithm manager with a selected algorithm, that controls the
+            acquisition and is allowed to issue custom scans.
+        """
+        self.lead = lead
+        self.followers = []
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def managers(self):
+        return [self.lead] + self.followers
+
+    def add_follower(self,
+                     algorithm,
+                     fconf,
+                     instrument_type,
+                     exp_seq_file = None,
+                     drop_policy = DropPolicies.DROP_OLDEST,
+                     max_pending = DEFAULT_MAX_PENDING):
+        """Adds a passive algorithm that receives the scan stream of the lead
+        algorithm.
+
+        Parameters
+        ----------
+        algorithm : str
+            Name of the algorithm to run next to the lead algorithm.
+        fconf : str
+            Configuration file of the algorithm.
+        instrument_type : str
+            Type of the available instrument.
+        exp_seq_file : str
+            Exported sequence file of the algorithm.
+        drop_policy : DropPolicies
+            Policy to apply to the scans when the algorithm cannot keep up
+            with the scan stream.
+        max_pending : int
+            Number of undelivered scans tolerated before the drop policy
+            applies.
+
+        Returns
+        -------
+        bool
+            True if the algorithm was selected successfully, otherwise False.
+        """
+        follower = AlgorithmManager(self.__follower_cb(algorithm),
+                                    drop_policy,
+                                    max_pending)
+        success = follower.select_algorithm(algorithm,
+                                            fconf,
+                                            instrument_type,
+                                            exp_seq_file)
+        if success:
+            self.logger.info(f'Algorithm {algorithm} follows the scan stream ' +
+                             f'with drop policy {drop_policy.name}.')
+            self.followers.append(follower)
+        return success
+
+    def acquisition_started(self):
+        for manager in self.managers:
+            manager.acquisition_started()
+
+    def acquisition_ended(self):
+        for manager in self.managers:
+            manager.acquisition_ended()
+
+    def acquisition_file_download_finished(self, file_path):
+        for manager in self.managers:
+            manager.acquisition_file_download_finished(file_path)
+
+    def received_recent_raw_file_names(self, raw_file_names):
+        for manager in self.managers:
+            manager.received_recent_raw_file_names(raw_file_names)
+
+    def scan_request_dropped(self, request_id):
+        # Only the lead algorithm issues custom scans.
+        self.lead.scan_request_dropped(request_id)
+
+    def deliver_scan(self, scan):
+        for manager in self.managers:
+            manager.deliver_scan(scan)
+
+    def instrument_error(self):
+        for manager in self.managers:
+            manager.instrument_error()
+
+    async def run_algorithm(self):
+        """Runs the lead and the follower algorithms concurrently.
+
+        Returns
+        -------
+        bool
+            True if all the algorithms finished without error.
+        """
+        results = await asyncio.gather(*[manager.run_algorithm()
+                                         for manager in self.managers])
+        return all(results)
+
+    def __follower_cb(self, algorithm):
+        async def follower_cb(msg_id, args = None):
+            if AcqMsgIDs.ERROR == msg_id:
+                # An error in a follower must not tear down the acquisition of
+                # the lead algorithm.
+                self.logger.error(f'Follower algorithm {algorithm}: {args}')
+            else:
+                # Every other request of a follower would interfere with the
+                # acquisition of the lead algorithm.
+                self.logger.debug(f'Ignored {msg_id.name} from follower ' +
+                                  f'algorithm {algorithm}.')
+        return follower_cb
@@ -4,14 +4,16 @@ import multiprocessing
 import logging
 from queue import Empty, Full
 from .acquisition import AcqMsgIDs, acquisition_process
+from .delivery import DeliveryChannel, DropPolicies, DEFAULT_MAX_PENDING
+from .transfer_register import TransferRegister
+from . import config_cache
 import traceback
-import importlib
-import inspect
 import os
-import pkgutil
-from .algorithm import Algorithm
+import shutil
+import tempfile
+import time
+from utils import discovery
 from pathlib import Path
-import json
         
 class AlgorithmManager:
     """
@@ -33,35 +35,56 @@ class AlgorithmManager:
     ALGO_LISTS = { 'releases' : RELEASES,
                    'prototypes' : PROTO_ALGORITHMS }
                    
-    TRANSFER_REGISTER = '\\transfer_register.json'
+    TRANSFER_REGISTER = 'transfer_register_{}.sqlite'
     TRANSFER_REGISTER_DEFAULTS = {"KEY" : "value"}
+    # Minimal interval in seconds between two pumps of the buffered scans
+    # while no scan is delivered
+    PUMP_INTERVAL = 0.05
     
     
-    def __init__(self, app_cb):
+    def __init__(self,
+                 app_cb,
+                 drop_policy = DropPolicies.KEEP_ALL,
+                 max_pending = DEFAULT_MAX_PENDING):
         """
         Parameters
         ----------
         app_cb : func
             Callback function to forward messages to the application from the 
             AlgorithmManager
+        drop_policy : DropPolicies
+            Policy to apply to the scans when the algorithm cannot keep up
+            with the scan stream.
+        max_pending : int
+            Number of undelivered scans tolerated before the drop policy
+            applies.
         """
         
         # Register app callback and logging
         self.app_cb = app_cb
         self.logger = logging.getLogger(__name__)
         
-        # Create process pool, listening event and queues for multiprocessing
-        self.executor = ProcessPoolExecutor(max_workers=3)
+        # Create listening events. The process pool and the queues for
+        # multiprocessing are only created once an algorithm was selected,
+        # since starting the manager process is costly. See __start_workers.
         #self.listening = multiprocessing.Manager().Event()
         self.listening = asyncio.Event()
         self.error = asyncio.Event()
-        self.acq_in_q = multiprocessing.Manager().Queue()
-        self.acq_out_q = multiprocessing.Manager().Queue()
+        self.drop_policy = drop_policy
+        self.max_pending = max_pending
+        self.executor = None
+        self.mp_manager = None
+        self.acq_in_q = None
+        self.acq_out_q = None
+        self.acq_in_channel = None
+        self.last_pump = 0.0
+        self.possible_params = None
         
         # Discover algorithms
         self.discover_algorithms()
         
-    def get_algorithm_names(self, algo_type):
+    @classmethod
+    def get_algorithm_names(cls, algo_type):
         """Collects the algorithm names for a given algorithm type
 
         Parameters
@@ -76,11 +99,12 @@ class AlgorithmManager:
             List of strings containing the names of the algorithms of the given
             type.
         """
-        return [Algorithm.ALGORITHM_NAME 
-                for Algorithm, conf in self.ALGO_LISTS[algo_type]]
+        return [entry['name'] for entry in cls.ALGO_LISTS[algo_type]]
         
-    def find_by_name(self, name):
-        """Retreive an algorithm with a given name
+    @classmethod
+    def find_by_name(cls, name):
+        """Retreive an algorithm with a given name. Only the module of the 
+        retreived algorithm is imported.
 
         Parameters
         ----------
@@ -89,49 +113,41 @@ class AlgorithmManager:
 
         Returns
         -------
-        Algorithm
-            Returns an algorithm class if the algorithm is found by name, 
-            otherwise it returns None.
+        tuple
+            Returns the algorithm class and its default configuration file if
+            the algorithm is found by name, otherwise it returns None.
         """      
-        found_algorithm = False
-         
-        for key in self.ALGO_LISTS:
-            list_to_search = self.ALGO_LISTS[key]
-            for i in range(len(list_to_search)):
-                if name == list_to_search[i][0].ALGORITHM_NAME:
-                    found_algorithm = True
-                    return list_to_search[i]
-        if not found_algorithm:
-            return None
+        for key in cls.ALGO_LISTS:
+            for entry in cls.ALGO_LISTS[key]:
+                if name == entry['name']:
+                    return (discovery.load_class(entry),
+                            cls.__validate_fconf(entry['hocon']))
+        return None
             
-    def discover_algorithms(self):
+    @classmethod
+    def discover_algorithms(cls):
         """Search through the algorithms folder for algorithms and store them
-           based on which subfolder they were found in."""
-        current_dir = os.getcwd() + '\\pymsreact\\algorithms'
-        module_infos = pkgutil.iter_modules([current_dir])
-        for info in module_infos:
-            if info.ispkg:
-                sub_infos = pkgutil.iter_modules([current_dir + '\\' + info.name])
-                for subinfo in sub_infos:
-                    import_name = 'algorithms.' + info.name + '.' + subinfo.name
-                    module = importlib.import_module(import_name)
-                    for name, value in inspect.getmembers(module):
-                        #name, value = member
-                        if (inspect.isclass(value) and 
-                            issubclass(value, Algorithm) and
-                            value is not Algorithm):
-                            fconf = \
-                                self.__validate_fconf(current_dir + '\\'
-                                                      + info.name + '\\'
-                                                      + subinfo.name
-                                                      + '.hocon')
-                            self.ALGO_LISTS[info.name].append((value, fconf))
+           based on which subfolder they were found in. The modules are not
+           imported, the discovery is based on a manifest that is rebuilt only
+           when the algorithm files change."""
+        algorithms_dir = os.path.dirname(os.path.dirname(__file__))
+        for algo_type in cls.ALGO_LISTS:
+            entries = \
+                discovery.discover(os.path.join(algorithms_dir, algo_type),
+                                   'algorithms.' + algo_type,
+                                   'Algorithm',
+                                   'ALGORITHM_NAME',
+                                   f'algorithms_{algo_type}.json')
+            # The lists are shared by all the managers, so only register each
+            # algorithm once.
+            cls.ALGO_LISTS[algo_type][:] = entries
     
     def select_algorithm(self, 
                          algorithm, 
                          fconf, 
                          instrument_type, 
-                         exp_seq_file=None):
+                         exp_seq_file=None,
+                         possible_params=None):
         """Method to select the algorithm to run.
         
         Parameters
@@ -140,12 +156,17 @@ class AlgorithmManager:
             Name of the algorithm that is selected to be run.
         instrument_type : str
             Type of the available instrument.
+        possible_params : list
+            Possible scan parameters of the instrument, passed on to the
+            acquisitions to validate their scan requests.
         """
         self.logger.info(f'Selecting algorithm {algorithm}')
         success = True
-        selected_algorithm, default_fconf = self.find_by_name(algorithm)
+        self.possible_params = possible_params
+        found_algorithm = self.find_by_name(algorithm)
 
-        if selected_algorithm is not None:
+        if found_algorithm is not None:
+            selected_algorithm, default_fconf = found_algorithm
             
             self.algorithm = selected_algorithm()
 
@@ -173,24 +194,40 @@ class AlgorithmManager:
         else:
             success = False
             self.logger.error(f'Algorithm {algorithm} cannot be selected.')
+        
+        if success:
+            self.__start_workers()
         return success
     
     def acquisition_started(self):
         """Method to signal to the algorithm that the instrument 
         finished with the acquisition."""
-        self.acq_in_q.put((AcqMsgIDs.ACQUISITION_STARTED, None))
+        self.__put(AcqMsgIDs.ACQUISITION_STARTED)
         
     def acquisition_ended(self):
         """Method to signal to the algorithm that the instrument 
-        finished with the acquisition."""
-        self.acq_in_q.put((AcqMsgIDs.ACQUISITION_ENDED, None))
+        finished with the acquisition. The scans still buffered by the
+        delivery channel are forwarded first."""
+        self.__put(AcqMsgIDs.ACQUISITION_ENDED)
         
     def acquisition_file_download_finished(self, file_path):
-        self.acq_in_q.put((AcqMsgIDs.RAW_FILE_DOWNLOAD_FINISHED, file_path))
+        self.__put(AcqMsgIDs.RAW_FILE_DOWNLOAD_FINISHED, file_path)
 
     def received_recent_raw_file_names(self, raw_file_names):
-        self.acq_in_q.put((AcqMsgIDs.RECEIVED_RAW_FILE_NAMES, raw_file_names))
+        self.__put(AcqMsgIDs.RECEIVED_RAW_FILE_NAMES, raw_file_names)
         
+    def scan_request_dropped(self, request_id):
+        """Method to signal to the algorithm that one of its custom scan
+        requests was dropped by the session before it was acquired, so it is
+        not counted as lost.
+
+        Parameters
+        ----------
+        request_id : int or str
+            Id of the dropped request.
+        """
+        self.__put(AcqMsgIDs.REQUEST_DROPPED, request_id)
+
     def deliver_scan(self, scan):
         """Method to forward scans received from the instrument to the algorithm.
         
@@ -200,12 +237,13 @@ class AlgorithmManager:
             Scan that was received from the instrument (through the server) in
             the form of a dictionary.
         """
-        self.acq_in_q.put((AcqMsgIDs.SCAN, scan))
+        if self.acq_in_channel is not None:
+            self.acq_in_channel.deliver_scan(scan)
     
     def instrument_error(self):
         """Method to signal to the algorithm that the other parts of the client or
         the server encountered an error."""
-        self.acq_in_q.put((AcqMsgIDs.ERROR, None))
+        self.__put(AcqMsgIDs.ERROR)
         self.error.set()
         
     async def run_algorithm(self):
@@ -227,7 +265,28 @@ class AlgorithmManager:
         await acq_req_task
         return no_error
         
-    def __validate_fconf(self, fconf):
+    def __start_workers(self):
+        """Private method, creates the process pool and the queues to
+        communicate with the acquisition processes. Both queues are served by
+        the same manager process."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=3)
+            self.mp_manager = multiprocessing.Manager()
+            self.acq_in_q = self.mp_manager.Queue()
+            self.acq_out_q = self.mp_manager.Queue()
+            self.acq_in_channel = DeliveryChannel(self.acq_in_q,
+                                                  self.drop_policy,
+                                                  self.max_pending)
+        
+    def __put(self, msg_id, payload = None):
+        # The instrument events are sent to every session, and can arrive
+        # before any algorithm was selected, or after the selection failed,
+        # when there is no acquisition to deliver them to.
+        if self.acq_in_channel is not None:
+            self.acq_in_channel.put(msg_id, payload)
+        
+    @staticmethod
+    def __validate_fconf(fconf):
         if fconf is not None:
             file = Path(fconf)
             validated_fconf = \
@@ -236,6 +295,15 @@ class AlgorithmManager:
             validated_fconf = fconf
         return validated_fconf
             
+    def __cache_configs(self):
+        for config in self.algorithm.configs:
+            try:
+                config_cache.load_configs([self.fconf, config])
+            except Exception as e:
+                # The acquisition process will report the error when it 
+                # tries to load the configuration.
+                self.logger.warning(f'Could not parse configuration: {e}')
+            
     async def __execute_algorithm(self, loop):
         """Private method, runs the acquisitions in sequence within an algorithm.
         
@@ -245,13 +313,22 @@ class AlgorithmManager:
             The asyncio loop to execute the acquisition tasks on.
         
         """
+        # Create transfer register. Each run of an algorithm gets its own
+        # register in a temporary folder, since several algorithms and
+        # sessions can run concurrently from the same working directory.
+        register_dir = tempfile.mkdtemp(prefix = 'msreact_')
+        transfer_register = \
+            os.path.join(register_dir,
+                         self.TRANSFER_REGISTER.format(
+                             self.algorithm.ALGORITHM_NAME))
+        register = TransferRegister.create(transfer_register,
+                                           self.TRANSFER_REGISTER_DEFAULTS)
+        register.close()
+        
+        # Parse the configurations of the acquisitions upfront, so the
+        # acquisition processes only load the cached configurations.
+        await loop.run_in_executor(None, self.__cache_configs)
         try:
-            # Create transfer register
-            transfer_register = os.getcwd() + self.TRANSFER_REGISTER
-            #if not os.path.isfile(transfer_register):
-            with open(transfer_register, 'w') as f:
-                json.dump(self.TRANSFER_REGISTER_DEFAULTS, f)
-            
             # TODO - If there is a problem on the server side will the
             #        chain of acquisitions just be executed anyway?
             i = 0
@@ -266,7 +343,8 @@ class AlgorithmManager:
                                            self.acq_in_q,
                                            self.acq_out_q,
                                            [self.fconf, self.algorithm.configs[i]],
-                                           transfer_register)
+                                           transfer_register,
+                                           self.possible_params)
                 i = i + 1
                 if self.error.is_set():
                     self.logger.info(f'Instrument error received, breaking the workflow execution loop.')
@@ -274,8 +352,8 @@ class AlgorithmManager:
             self.logger.info(f'Algorithm execution ended.')
         finally:
             # Remove transfer register
-            if os.path.isfile(transfer_register):
-                os.remove(transfer_register)
+            register.remove()
+            shutil.rmtree(register_dir, ignore_errors = True)
         
                                        
     async def __process_acquisition_requests(self):
@@ -289,12 +367,24 @@ class AlgorithmManager:
                 except Empty:
                     if self.listening.is_set():
                         break
+                    self.__pump_scans()
                 await asyncio.sleep(0)
             self.logger.info(f'Process acquisition requests loop exited.')
         except Exception as e:
             self.logger.error(f'An exception occured:')
             traceback.print_exc()
             
+    def __pump_scans(self):
+        # Forwards the scans buffered while the acquisition was behind once it
+        # caught up, even if no other scan is delivered, eg. at the end of the
+        # acquisition. Rate limited, since the size of the input queue is a
+        # round trip to the manager process.
+        now = time.monotonic()
+        if (self.acq_in_channel is not None and self.acq_in_channel.pending and
+            now - self.last_pump >= self.PUMP_INTERVAL):
+            self.last_pump = now
+            self.acq_in_channel.pump()
+            
     async def __process_queue_items(self):
         item = self.acq_out_q.get_nowait()
         if isinstance(item, logging.LogRecord):
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+# Folder of the binary snapshots of the parsed configurations
+CACHE_DIR = os.path.join('output', 'cache', 'config')
+
+# Merged configurations parsed or loaded by this process
+_memory_cache = {}
+
+def load_configs(configs):
+    """Loads and merges HOCON configuration files into a plain dictionary. The
+    later configurations overwrite the earlier ones.
+
+    The merged configuration is cached in memory and in a binary snapshot on
+    disk, keyed by the paths and modification times of the files, so the
+    files are only parsed again when one of them changes. Note that files
+    included from within a configuration are not tracked.
+
+    Parameters
+    ----------
+    configs : list
+        List of configuration file paths. None items are skipped.
+
+    Returns
+    -------
+    dict
+        The merged configuration.
+    """
+    configs = [config for config in configs if config is not None]
+    if not configs:
+        return {}
+
+    key = _cache_key(configs)
+    config = _memory_cache.get(key)
+    if config is None:
+        snapshot = os.path.join(CACHE_DIR,
+                                hashlib.sha1(repr(key).encode()).hexdigest()
+                                + '.pickle')
+        config = _load_snapshot(snapshot, key)
+        if config is None:
+            config = _parse_configs(configs)
+            _save_snapshot(snapshot, key, config)
+        _memory_cache[key] = config
+    # The cached configuration is shared, callers get their own copy.
+    return pickle.loads(pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+
+def _cache_key(configs):
+    key = []
+    for config in configs:
+        stat = os.stat(config)
+        key.append((os.path.abspath(config), stat.st_mtime_ns, stat.st_size))
+    return tuple(key)
+
+def _parse_configs(configs):
+    # pyhocon is only needed when a configuration changed.
+    from pyhocon import ConfigFactory
+
+    merged = {}
+    for config in configs:
+        configtree = ConfigFactory.parse_file(config)
+        merged.update(_to_plain(configtree))
+    return merged
+
+def _to_plain(value):
+    # Converts the configuration tree into plain dictionaries and lists.
+    if isinstance(value, dict):
+        return {key : _to_plain(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_to_plain(item) for item in value]
+    return value
+
+def _load_snapshot(snapshot, key):
+    try:
+        with open(snapshot, 'rb') as f:
+            snapshot_key, config = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    return config if snapshot_key == key else None
+
+def _save_snapshot(snapshot, key, config):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a
+        # partially written snapshot.
+        temporary = f'{snapshot}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump((key, config), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, snapshot)
+    except OSError as e:
+        logger.warning(f'Could not save configuration snapshot: {e}')
@@ -0,0 +1,127 @@
+import collections
+import logging
+from enum import Enum
+from .acquisition import AcqMsgIDs
+
+class DropPolicies(Enum):
+    """
+    Enum of policies applied when an acquisition falls behind the scan stream
+    """
+    KEEP_ALL = 1
+    DROP_NEWEST = 2
+    DROP_OLDEST = 3
+
+DEFAULT_MAX_PENDING = 64
+
+class DeliveryChannel:
+    """
+    Delivery channel between the main process and the input queue of an
+    acquisition process. Scans are forwarded to the queue as long as the
+    acquisition keeps up, and are buffered or dropped according to the drop
+    policy when it falls behind. Control messages are never dropped.
+
+    ...
+
+    Attributes
+    ----------
+    queue : queue.Queue
+        Input queue of the acquisition process to deliver the messages to.
+    drop_policy : DropPolicies
+        Policy to apply to scans when the acquisition falls behind.
+    max_pending : int
+        Number of undelivered scans tolerated in the acquisition's input queue
+        and in the local buffer of the channel before the drop policy applies.
+    dropped : int
+        Number of scans dropped by the channel so far.
+    """
+
+    def __init__(self,
+                 queue,
+                 drop_policy = DropPolicies.KEEP_ALL,
+                 max_pending = DEFAULT_MAX_PENDING):
+        """
+        Parameters
+        ----------
+        queue : queue.Queue
+            Input queue of the acquisition process to deliver the messages to.
+        drop_policy : DropPolicies
+            Policy to apply to scans when the acquisition falls behind.
+        max_pending : int
+            Number of undelivered scans tolerated before the drop policy
+            applies.
+        """
+        self.queue = queue
+        self.drop_policy = drop_policy
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = collections.deque()
+        self.logger = logging.getLogger(__name__)
+
+    def put(self, msg_id, payload = None):
+        """Delivers a control message. Buffered scans are flushed first, so the
+        order of the messages is preserved.
+
+        Parameters
+        ----------
+        msg_id : AcqMsgIDs
+            Id of the message to deliver.
+        payload :
+            Payload of the message.
+        """
+        self.flush()
+        self.queue.put((msg_id, payload))
+
+    @property
+    def pending(self):
+        """Number of scans buffered by the channel."""
+        return len(self._pending)
+
+    def flush(self):
+        """Forwards all the buffered scans, whatever the backlog of the
+        acquisition, eg. when the acquisition ends."""
+        while self._pending:
+            self.queue.put((AcqMsgIDs.SCAN, self._pending.popleft()))
+
+    def pump(self):
+        """Forwards the buffered scans the acquisition has room for. Scans are
+        otherwise only forwarded when the next scan is delivered, so the
+        channel should be pumped while no scan is delivered."""
+        if not self._pending:
+            return
+        # The size of the queue is a round trip to the manager process, so it
+        # is queried only once per pump.
+        backlog = self.queue.qsize()
+        while self._pending and backlog < self.max_pending:
+            self.queue.put((AcqMsgIDs.SCAN, self._pending.popleft()))
+            backlog = backlog + 1
+
+    def deliver_scan(self, scan):
+        """Delivers a scan, applying the drop policy if the acquisition cannot
+        keep up with the scan stream.
+
+        Parameters
+        ----------
+        scan : dict
+            Scan that was received from the instrument.
+        """
+        if DropPolicies.KEEP_ALL == self.drop_policy:
+            self.queue.put((AcqMsgIDs.SCAN, scan))
+            return
+
+        if len(self._pending) < self.max_pending:
+            self._pending.append(scan)
+        elif DropPolicies.DROP_OLDEST == self.drop_policy:
+            self._pending.popleft()
+            self._pending.append(scan)
+            self.__count_drop()
+        else:
+            self.__count_drop()
+        self.pump()
+
+    def __count_drop(self):
+        self.dropped = self.dropped + 1
+        # Log only every max_pending drops to avoid flooding the log when a
+        # consumer is permanently slower than the instrument.
+        if 1 == self.dropped % self.max_pending:
+            self.logger.warning(f'Consumer is falling behind, {self.dropped} ' +
+                                f'scans dropped so far ({self.drop_policy.name}).')
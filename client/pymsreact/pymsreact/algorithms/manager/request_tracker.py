@@ -0,0 +1,143 @@
+import collections
+import statistics
+import threading
+import time
+
+class RequestTracker:
+    """
+    Keeps track of the outstanding custom scan requests of an acquisition,
+    and matches the received scans back to their request.
+
+    Outstanding requests are indexed by their request id, which the server
+    reports as the access id of the acquired scan, so matching a scan is a
+    single dictionary lookup. Requests that are not fulfilled within the
+    timeout are expired and counted as lost. Requests that the session
+    dropped on purpose, eg. duplicate or superseded requests, are counted as
+    dropped instead, and are not part of the loss rate. The requests are kept
+    in the order they were made, so expiring them only looks at the oldest
+    ones.
+
+    ...
+
+    Attributes
+    ----------
+    timeout : float
+        Time in seconds after which an outstanding request is lost.
+    outstanding : collections.OrderedDict
+        Outstanding requests, request id -> time of the request.
+    """
+
+    # Default time in seconds after which an outstanding request is lost
+    DEFAULT_TIMEOUT = 5
+    # Number of recent latencies kept for the latency percentiles
+    LATENCY_WINDOW = 1000
+
+    def __init__(self, timeout = DEFAULT_TIMEOUT):
+        """
+        Parameters
+        ----------
+        timeout : float
+            Time in seconds after which an outstanding request is lost.
+        """
+        self.timeout = timeout
+        self.outstanding = collections.OrderedDict()
+        self.requested = 0
+        self.fulfilled = 0
+        self.expired = 0
+        self.dropped = 0
+        self.unmatched = 0
+        self.latencies = collections.deque(maxlen = self.LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def request_sent(self, request_id):
+        """Registers a request.
+
+        Parameters
+        ----------
+        request_id : int or str
+            Id of the request.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.__expire(now)
+            self.outstanding[str(request_id)] = now
+            self.requested += 1
+
+    def scan_received(self, access_id):
+        """Matches a received scan to its request.
+
+        Parameters
+        ----------
+        access_id : int or str
+            Access id of the received scan, see ScanFields.ACCESS_ID.
+
+        Returns
+        -------
+        bool
+            True if the scan fulfilled an outstanding request.
+        """
+        now = time.monotonic()
+        with self.lock:
+            requested_at = self.outstanding.pop(str(access_id), None)
+            if requested_at is None:
+                self.unmatched += 1
+            else:
+                self.fulfilled += 1
+                self.latencies.append(now - requested_at)
+            self.__expire(now)
+        return requested_at is not None
+
+    def request_dropped(self, request_id):
+        """Registers a request that the session dropped before it was
+        acquired.
+
+        Parameters
+        ----------
+        request_id : int or str
+            Id of the request.
+        """
+        with self.lock:
+            if self.outstanding.pop(str(request_id), None) is not None:
+                self.dropped += 1
+
+    def expire(self):
+        """Expires the requests that are outstanding for longer than the
+        timeout."""
+        with self.lock:
+            self.__expire(time.monotonic())
+
+    def stats(self):
+        """Returns the statistics of the requests.
+
+        Returns
+        -------
+        dict
+            Number of requested, fulfilled, expired, dropped and outstanding
+            requests, number of received scans without request, ratio of the
+            lost requests among the fulfilled and expired ones, and median and 95th percentile of the latency between
+            a request and its scan in seconds, over the recent requests.
+        """
+        with self.lock:
+            self.__expire(time.monotonic())
+            finished = self.fulfilled + self.expired
+            latencies = sorted(self.latencies)
+            return {'requested' : self.requested,
+                    'fulfilled' : self.fulfilled,
+                    'expired' : self.expired,
+                    'dropped' : self.dropped,
+                    'unmatched' : self.unmatched,
+                    'queue_depth' : len(self.outstanding),
+                    'loss_rate' : self.expired / finished if finished else 0.0,
+                    'latency_median' : (statistics.median(latencies)
+                                        if latencies else None),
+                    'latency_p95' : (latencies[int(0.95 * (len(latencies) - 1))]
+                                     if latencies else None)}
+
+    def __expire(self, now):
+        cutoff = now - self.timeout
+        while self.outstanding:
+            request_id, requested_at = next(iter(self.outstanding.items()))
+            if requested_at > cutoff:
+                break
+            del self.outstanding[request_id]
+            self.expired += 1
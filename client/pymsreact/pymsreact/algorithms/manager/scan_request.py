@@ -0,0 +1,190 @@
+import collections
+import msgpack
+import uuid
+
+# Names of the scan request parameters that usually change from one request to
+# the other
+PRECURSOR_MASS = 'PrecursorMass'
+REQUEST_ID = 'REQUEST_ID'
+
+# Parameters that are accepted by the server without being possible parameters
+# of the instrument
+CLIENT_PARAMS = [REQUEST_ID]
+
+# Custom scan request with its scheduling information, as sent by the
+# acquisitions to the scan request scheduler of the session.
+#   params - Request parameters, as dictionary or rendered by a template
+#   priority - Requests with higher priority are sent first
+#   deadline - Time (time.time()) after which the request is dropped, or None
+#   precursor_mz - Precursor m/z of the request, used for de-duplication
+#   survey_scan - Scan number of the survey scan the request was computed
+#                 from. The request is dropped once a newer survey scan was
+#                 received. None if the request does not expire this way.
+#   request_id - Id of the request, or None
+ScanRequest = collections.namedtuple('ScanRequest',
+                                     ['params',
+                                      'priority',
+                                      'deadline',
+                                      'precursor_mz',
+                                      'survey_scan',
+                                      'request_id'],
+                                     defaults = (0, None, None, None, None))
+
+# Repeating scan request with the conditions of its repetition, as sent by the
+# acquisitions to the repeating scan manager of the session.
+#   params - Request parameters, as dictionary or rendered by a template
+#   scan_id - Id of the repeating scan, used to cancel it
+#   rt_window - (start, end) retention times in minutes between which the
+#               scan is repeated, or None to repeat it regardless
+#   deadline - Time (time.time()) after which the scan is cancelled, or None
+#   priority - The repeating scans with higher priority are issued first
+RepeatingScanRequest = collections.namedtuple('RepeatingScanRequest',
+                                              ['params',
+                                               'scan_id',
+                                               'rt_window',
+                                               'deadline',
+                                               'priority'],
+                                              defaults = (None, None, 0))
+
+# Custom scan request rendered by a ScanRequestTemplate.
+#   template_id - Id of the template, whose defaults the request relies on
+#   payload - Serialized parameters of the request that are not defaults
+#   request_id - Id of the request, or None if it is not a varying parameter
+RenderedScanRequest = collections.namedtuple('RenderedScanRequest',
+                                             ['template_id',
+                                              'payload',
+                                              'request_id'])
+
+class ScanRequestTemplate:
+    """
+    Custom scan request with constant parameters, of which only a few varying
+    fields change from one request to the other.
+
+    The constant parameters are validated once, against the possible
+    parameters of the instrument. The constant parameters with a known
+    default value are set as the default scan parameters of the server once,
+    the other ones are serialized once. Rendering a request only serializes
+    the varying fields, and returns the request that can be passed to
+    :func:`~algorithms.manager.acquisition.Acquisition.request_custom_scan`.
+
+    ...
+
+    Attributes
+    ----------
+    template_id : str
+        Id of the template, unique across the acquisition processes.
+    params : dict
+        Constant parameters of the request, organised into a string-string
+        dictionary in the form of parameter_name : value.
+    defaults : dict
+        Constant parameters that are set as default scan parameters on the
+        server, and are left out of the rendered requests.
+    varying : tuple
+        Names of the parameters that are given at each request.
+    """
+
+    def __init__(self,
+                 params,
+                 possible_params = None,
+                 varying = (PRECURSOR_MASS, REQUEST_ID)):
+        """
+        Parameters
+        ----------
+        params : dict
+            Constant parameters of the request. The values are converted to
+            strings.
+        possible_params : list
+            Possible parameters of the instrument, as received from the
+            server. See
+            :func:`~com.instrument.InstrumentClient.get_possible_params`.
+            If None, the parameters are not validated.
+        varying : tuple
+            Names of the parameters that are given at each request.
+
+        Raises
+        ------
+        ValueError
+            If a parameter is not a possible parameter of the instrument, or
+            its value is not one of the possible values.
+        """
+        self.template_id = uuid.uuid4().hex
+        self.params = {name : str(value) for name, value in params.items()
+                       if name not in varying}
+        self.varying = tuple(varying)
+        self.defaults = {}
+        if possible_params is not None:
+            self.__validate(possible_params)
+            # Only the parameters with a known default value can be set as
+            # defaults, since they have to be restored for other requests.
+            known = {param['Name'] for param in possible_params
+                     if param.get('DefaultValue') is not None}
+            self.defaults = {name : value
+                             for name, value in self.params.items()
+                             if name in known}
+        explicit = {name : value for name, value in self.params.items()
+                    if name not in self.defaults}
+
+        # Serialize the map header and the constant parameters that are not
+        # defaults once, and the names of the varying parameters.
+        packer = msgpack.Packer()
+        self.__prefix = (packer.pack_map_header(len(explicit) +
+                                                len(self.varying)) +
+                         b''.join(msgpack.packb(name) + msgpack.packb(value)
+                                  for name, value in explicit.items()))
+        self.__varying_names = [msgpack.packb(name) for name in self.varying]
+        self.__request_id_index = (self.varying.index(REQUEST_ID)
+                                   if REQUEST_ID in self.varying else None)
+
+    def render(self, *values):
+        """Serializes a request with the given values of the varying
+        parameters.
+
+        Parameters
+        ----------
+        values :
+            Values of the varying parameters, in the order of the varying
+            attribute. The values are converted to strings.
+
+        Returns
+        -------
+        RenderedScanRequest
+            The request, relying on the defaults of the template.
+        """
+        if len(values) != len(self.varying):
+            raise ValueError(f'Expected values for {self.varying}, ' +
+                             f'got {len(values)} values.')
+        parts = [self.__prefix]
+        for name, value in zip(self.__varying_names, values):
+            parts.append(name)
+            parts.append(msgpack.packb(str(value)))
+        request_id = (None if self.__request_id_index is None
+                      else str(values[self.__request_id_index]))
+        return RenderedScanRequest(self.template_id, b''.join(parts),
+                                   request_id)
+
+    def as_dict(self, *values):
+        """Returns the request with the given values of the varying
+        parameters as a dictionary."""
+        return self.params | {name : str(value)
+                              for name, value in zip(self.varying, values)}
+
+    def __validate(self, possible_params):
+        schema = {param['Name'] : param for param in possible_params}
+        unknown = [name for name in list(self.params) + list(self.varying)
+                   if name not in schema and name not in CLIENT_PARAMS]
+        if unknown:
+            raise ValueError(f'Unknown scan parameters: {unknown}. ' +
+                             f'Possible parameters: {list(schema)}')
+        for name, value in self.params.items():
+            selection = self.__selection(schema.get(name))
+            if selection and value not in selection:
+                raise ValueError(f'Invalid value "{value}" of scan parameter ' +
+                                 f'{name}, possible values: {selection}')
+
+    def __selection(self, param):
+        # The selection of a parameter lists its possible values, when the
+        # values are enumerable.
+        selection = None if param is None else param.get('Selection')
+        if isinstance(selection, (list, tuple)):
+            return [str(item) for item in selection]
+        return None
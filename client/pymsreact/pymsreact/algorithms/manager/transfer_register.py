@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from enum import IntEnum
+
+class ValueKinds(IntEnum):
+    """
+    Encodings of the values stored in the transfer register
+    """
+    JSON = 0
+    BYTES = 1
+    NDARRAY = 2
+
+class TransferRegister:
+    """
+    Key-value store to pass information between the acquisitions of an
+    algorithm. The values are stored in an SQLite database, so each key can be
+    read and written on its own, and the acquisitions running in different
+    processes or threads can access the register at the same time.
+
+    Plain values are stored as JSON, bytes as they are, and NumPy arrays as
+    their raw buffer. Arrays are read back without decoding, as read-only
+    views on the stored buffer.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        Path of the database file of the register.
+    """
+
+    # Time in seconds to wait for a concurrent writer to finish
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the database file of the register.
+        """
+        self.path = path
+        self._local = threading.local()
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def create(cls, path, defaults = None):
+        """Creates an empty register, replacing any previous register at the
+        same path.
+
+        Parameters
+        ----------
+        path : str
+            Path of the database file of the register.
+        defaults : dict
+            Initial content of the register.
+
+        Returns
+        -------
+        TransferRegister
+            The created register.
+        """
+        register = cls(path)
+        register.remove()
+        # Write-ahead logging lets readers proceed while a writer commits.
+        register.__connection().execute('PRAGMA journal_mode=WAL')
+        with register.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS register ('
+                               'key TEXT PRIMARY KEY, '
+                               'kind INTEGER NOT NULL, '
+                               'meta TEXT, '
+                               'value BLOB)')
+        if defaults:
+            register.update(defaults)
+        return register
+
+    def remove(self):
+        """Closes the connection of this thread and deletes the register."""
+        self.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.isfile(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def close(self):
+        """Closes the connection of the calling thread to the register."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    @contextmanager
+    def transaction(self):
+        """Context manager grouping reads and writes into one transaction.
+        The write lock is taken when the transaction starts, so a
+        read-modify-write sequence cannot interleave with other writers.
+        Nested transactions are merged into the outermost one.
+
+        Yields
+        ------
+        sqlite3.Connection
+            Connection of the calling thread to the register.
+        """
+        connection = self.__connection()
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    def get(self, key, default = None):
+        """Reads a single value from the register.
+
+        Parameters
+        ----------
+        key : str
+            Key of the value.
+        default :
+            Value to return if the key is not in the register.
+        """
+        row = self.__connection().execute(
+            'SELECT kind, meta, value FROM register WHERE key = ?',
+            (key, )).fetchone()
+        return default if row is None else self.__decode(*row)
+
+    def set(self, key, value):
+        """Writes a single value to the register.
+
+        Parameters
+        ----------
+        key : str
+            Key of the value.
+        value :
+            JSON serializable value, bytes or NumPy array.
+        """
+        self.update({key : value})
+
+    def update(self, data):
+        """Writes several values to the register in one transaction.
+
+        Parameters
+        ----------
+        data : dict
+            Dictionary of keys and values to write.
+        """
+        rows = [(key, ) + self.__encode(value) for key, value in data.items()]
+        with self.transaction() as connection:
+            connection.executemany('INSERT OR REPLACE INTO register '
+                                   '(key, kind, meta, value) '
+                                   'VALUES (?, ?, ?, ?)', rows)
+
+    def delete(self, key):
+        """Removes a value from the register.
+
+        Parameters
+        ----------
+        key : str
+            Key of the value.
+        """
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM register WHERE key = ?', (key, ))
+
+    def keys(self):
+        """Returns the list of keys in the register."""
+        return [key for (key, ) in
+                self.__connection().execute('SELECT key FROM register')]
+
+    def as_dict(self):
+        """Reads the whole register into a dictionary."""
+        rows = self.__connection().execute(
+            'SELECT key, kind, meta, value FROM register')
+        return {key : self.__decode(kind, meta, value)
+                for key, kind, meta, value in rows}
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.__connection().execute(
+            'SELECT 1 FROM register WHERE key = ?', (key, )).fetchone() is not None
+
+    def __connection(self):
+        # SQLite connections cannot be shared between threads, each thread of
+        # the acquisition gets its own connection.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path,
+                                         timeout = self.BUSY_TIMEOUT,
+                                         isolation_level = None)
+            self._local.connection = connection
+        return connection
+
+    def __encode(self, value):
+        # NumPy is not imported by the register itself, an array can only be
+        # passed if NumPy was already imported by the caller.
+        np = sys.modules.get('numpy')
+        if np is not None and isinstance(value, np.ndarray):
+            meta = json.dumps({'dtype' : value.dtype.str,
+                               'shape' : value.shape})
+            return (ValueKinds.NDARRAY, meta,
+                    memoryview(np.ascontiguousarray(value)).cast('B'))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return (ValueKinds.BYTES, None, value)
+        return (ValueKinds.JSON, None, json.dumps(value))
+
+    def __decode(self, kind, meta, value):
+        if ValueKinds.NDARRAY == kind:
+            import numpy as np
+            meta = json.loads(meta)
+            return np.frombuffer(value,
+                                 dtype = meta['dtype']).reshape(meta['shape'])
+        elif ValueKinds.BYTES == kind:
+            return value
+        return json.loads(value)
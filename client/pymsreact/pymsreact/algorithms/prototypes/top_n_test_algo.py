@@ -1,5 +1,5 @@
 from algorithms.manager.algorithm import Algorithm
-from algorithms.manager.acquisition import Acquisition, AcqStatIDs, ScanFields, CentroidFields
+from algorithms.manager.acquisition import Acquisition, AcqStatIDs, ScanFields
 import algorithms.manager.ms_instruments.mock_instrument as mi
 import algorithms.manager.ms_instruments.tribrid_instrument as ti
 import algorithms.manager.acquisition_workflow as aw
@@ -9,6 +9,13 @@ import time
 from datetime import datetime
 import csv
 from utils.real_time_mgf import RealTimeMGFWriter
+from utils.precursor_selection import centroid_arrays, select_top_n
+from utils.dynamic_exclusion import DynamicExclusion
+from utils.isotopes import detect_envelopes, precursor_candidates
+from utils.purity import isolation_purity
+from utils.fragment_index import FragmentIndex
+from utils.spectral_clustering import SpectrumClusters
+from utils.recalibration import MassRecalibration
 
 # Acquisition settings
 ACQUISITION_WORKFLOW = aw.Listening
@@ -23,6 +30,18 @@ COMMENT = "This test is checking whether top N method " + \
 MZ_TOLERANCE = 0.0001 # Tolerance for the exclusion
 NUMBER_OF_PEAKS = 15 # Number of precursors to select for MS2
 EXCLUSION_TIME = 0.5 # Exclusion time in minutes
+ISOLATION_WIDTH = 1 # Width of the isolation window in m/z
+MIN_PURITY = 0.5 # Minimal fraction of the precursor in the isolation window
+# Folder of a fragment index built by utils/fragment_index.py to search the MS2
+# scans in real time, None to disable the search
+SEARCH_INDEX_DIR = None
+IDENTIFIED_EXCLUSION_TIME = 2 # Exclusion time of identified precursors in minutes
+# Number of similar MS2 scans after which a precursor is not selected again,
+# None to disable the clustering of the MS2 scans
+REDUNDANT_CLUSTER_SIZE = None
+# m/z values of the lock masses recalibrating the scans, eg.
+# [MassRecalibration.POLYSILOXANE_MZ], None to disable the recalibration
+LOCK_MASSES = None
 
 class TopNAcquisition(Acquisition):
     instruments = [mi.MockInstrument, ti.ThermoTribridInstrument]
@@ -49,27 +68,75 @@ class TopNAcquisition(Acquisition):
         self.logger.info('Executing intra-acquisition steps.')
         scans = []
         
-        exclusion_list = []
+        exclusion = DynamicExclusion(EXCLUSION_TIME, MZ_TOLERANCE, ppm = False)
         num_requests = 0
         num_received = 0
+        num_identified = 0
+        search_index = (None if SEARCH_INDEX_DIR is None
+                        else FragmentIndex(SEARCH_INDEX_DIR))
+        clusters = (None if REDUNDANT_CLUSTER_SIZE is None
+                    else SpectrumClusters(min_size = REDUNDANT_CLUSTER_SIZE))
+        recalibration = (None if LOCK_MASSES is None
+                         else MassRecalibration(LOCK_MASSES))
+        if clusters is None:
+            excluded = exclusion.excluded
+        else:
+            excluded = lambda mzs: exclusion.excluded(mzs) | clusters.redundant(mzs)
         
         rn = 1
         self.diagnostics = {}
         
         writer = RealTimeMGFWriter("output/test.mgf")
         
+        # Only the precursor mass and the request id change from one request
+        # to the other.
+        template = self.create_scan_template({"ScanType": "MSn",
+                                              "AGCTarget": "100000",
+                                              "MaxIT": "50",
+                                              "IsolationMode": "Quadrupole",
+                                              "ActivationType": "HCD",
+                                              "FirstMass": "100",
+                                              "LastMass": "2000",
+                                              "IsolationWidth": str(ISOLATION_WIDTH),
+                                              "CollisionEnergy": "30"})
+        
         with writer:
             while AcqStatIDs.ACQUISITION_RUNNING == self.get_acquisition_status():
                 scan = self.fetch_received_scan()
                 
                 if ((scan is not None) and (2 == scan[ScanFields.MS_SCAN_LEVEL])):
-                    writer.write_scan(scan)
                     num_received = num_received + 1
+                    if ((search_index is not None) or (clusters is not None) or
+                        (recalibration is not None)):
+                        ms2_mzs, ms2_intensities = centroid_arrays(scan[ScanFields.CENTROIDS])
+                    if recalibration is not None:
+                        # The MGF holds the recalibrated m/z values, the scan
+                        # itself is left as received.
+                        recalibration.correct(ms2_mzs)
+                        writer.write_scan(scan, ms2_mzs)
+                    else:
+                        writer.write_scan(scan)
+                    if clusters is not None:
+                        clusters.add(ms2_mzs, ms2_intensities,
+                                     scan[ScanFields.PRECURSOR_MASS],
+                                     scan[ScanFields.RETENTION_TIME],
+                                     scan[ScanFields.PRECURSOR_CHARGE])
+                    if search_index is not None:
+                        # Identified precursors are excluded for longer, to
+                        # spend the MS2 scans on peptides not identified yet.
+                        result = search_index.search(ms2_mzs, ms2_intensities,
+                                                     scan[ScanFields.PRECURSOR_MASS],
+                                                     scan[ScanFields.PRECURSOR_CHARGE])
+                        if result is not None:
+                            exclusion.add([scan[ScanFields.PRECURSOR_MASS]],
+                                          scan[ScanFields.RETENTION_TIME],
+                                          duration = IDENTIFIED_EXCLUSION_TIME)
+                            num_identified = num_identified + 1
                 if ((scan is not None) and (1 == scan[ScanFields.MS_SCAN_LEVEL])):
                     time_of_algorithm = time.time()
-                    self.logger.info(f'Received/Requested ratio = {num_received}/{num_requests}, ' +
+                    self.logger.info(f'Requests: {self.get_request_stats()}, ' +
                                      f'Last running number: {rn}, ' +
-                                     f'Exclusion list length: {len(exclusion_list)}')
+                                     f'Exclusion list length: {len(exclusion)}')
                     self.diagnostics.update({scan[ScanFields.SCAN_NUMBER] : {'NumReceived' : num_received,
                                                                              'CentroidCount' : scan[ScanFields.CENTROID_COUNT]}})
                     num_received = 0
@@ -78,65 +145,48 @@ class TopNAcquisition(Acquisition):
                     # Get current time
                     current_rt = scan[ScanFields.RETENTION_TIME]
                     
-                    # Remove expired centroids from the exclusion list
-                    cutoff = 0 # This assignment is necessary in case of empty exclusion list.
-                    while cutoff < len(exclusion_list):
-                        if abs(current_rt - exclusion_list[cutoff]["ExclusionTime"]) < EXCLUSION_TIME:
-                            break
-                        cutoff = cutoff + 1
-                    exclusion_list = exclusion_list[cutoff:]
-                            
-                    # Get centroids from the scan
-                    centroids = scan[ScanFields.CENTROIDS]
-                    # Get mzs and intensities from centroids
-                    mzs = [centroid[CentroidFields.MZ] for centroid in centroids]
-                    intensities = [centroid[CentroidFields.INTENSITY] for centroid in centroids]
+                    # Remove expired precursors from the exclusion list
+                    exclusion.expire(current_rt)
                     
-                    # Combine the mzs and intensities in to a list of dicts
-                    centroids = [{CentroidFields.MZ : mzs[i], 
-                                  CentroidFields.INTENSITY: intensities[i] } 
-                                 for i in range(len(mzs))]
-
+                    # Recalibrate the scan with the lock masses it contains
+                    mzs, intensities = centroid_arrays(scan[ScanFields.CENTROIDS])
+                    if recalibration is not None:
+                        recalibration.observe(mzs, intensities, current_rt)
+                        recalibration.correct(mzs)
                     
-                    # Sort centroids by their intensity
-                    centroids.sort(key=lambda i: i[CentroidFields.INTENSITY], reverse=True)
+                    # Select the most intense precursors that are not excluded,
+                    # among the monoisotopic peaks and the peaks that are not
+                    # part of an isotope envelope, whose isolation window is
+                    # pure enough.
+                    envelopes = detect_envelopes(mzs, intensities)
+                    candidates = precursor_candidates(envelopes)
+                    purity = isolation_purity(mzs, intensities, candidates,
+                                              ISOLATION_WIDTH, envelopes)
+                    candidates = candidates[purity >= MIN_PURITY]
+                    selected = candidates[select_top_n(
+                        mzs[candidates], intensities[candidates], NUMBER_OF_PEAKS,
+                        excluded = excluded)]
                     
-                    # TODO: This code might be written nicer and shorter with some list comprehension
-                    i = 0
-                    excl_list_buffer = []
-                    while ((i < len(centroids)) and (len(excl_list_buffer) != NUMBER_OF_PEAKS)):
-                        not_excluded = True
-                        for centroid_excl in exclusion_list:
-                            if MZ_TOLERANCE > abs(centroids[i][CentroidFields.MZ] - centroid_excl[CentroidFields.MZ]):
-                                not_excluded = False # it is excluded
-                                break
-                        if not_excluded:
-                            self.request_custom_scan({"PrecursorMass": str(centroids[i][CentroidFields.MZ]),
-                                                      "ScanType": "MSn",
-                                                      "AGCTarget": "100000",
-                                                      "MaxIT": "50",
-                                                      "IsolationMode": "Quadrupole",
-                                                      "ActivationType": "HCD",
-                                                      "FirstMass": "100",
-                                                      "LastMass": "2000",
-                                                      "IsolationWidth": "1",
-                                                      "CollisionEnergy": "30",
-                                                      "REQUEST_ID": "_".join([str(scan[ScanFields.SCAN_NUMBER]), str(rn)]),
-                                                      })
-                                                      
-                            centroid = centroids[i] | {"ExclusionTime" : current_rt}
-                            excl_list_buffer.append(centroid)
-                            num_requests = num_requests + 1
-                            rn = rn + 1
-                        i = i + 1
-                    exclusion_list = exclusion_list + excl_list_buffer
+                    for rank, mz in enumerate(mzs[selected].tolist()):
+                        # Requests computed from this survey scan are
+                        # dropped once the next survey scan arrived.
+                        self.request_custom_scan(
+                            template.render(mz, f'{scan[ScanFields.SCAN_NUMBER]}_{rn}'),
+                            priority = NUMBER_OF_PEAKS - rank,
+                            precursor_mz = mz,
+                            survey_scan = scan[ScanFields.SCAN_NUMBER])
+                        num_requests = num_requests + 1
+                        rn = rn + 1
+                    exclusion.add(mzs[selected], current_rt)
                     algo_time = time.time() - time_of_algorithm
                     self.diagnostics[scan[ScanFields.SCAN_NUMBER]].update({"AlgoTime" : algo_time,
                                                                            "NumRequests" : num_requests,
-                                                                           "ExclusionListLen" : len(exclusion_list)})
+                                                                           "ExclusionListLen" : len(exclusion)})
                 else:
                     pass
         
+        if search_index is not None:
+            self.logger.info(f'Identified MS2 scans: {num_identified}')
         self.logger.info('Finishing intra acquisition.')
     
     def post_acquisition(self):
@@ -1,9 +1,10 @@
 from algorithms.manager.algorithm import Algorithm
-from algorithms.manager.acquisition import Acquisition, AcqStatIDs
+from algorithms.manager.acquisition import Acquisition, AcqStatIDs, ScanFields
 import algorithms.manager.ms_instruments.mock_instrument as mi
 import algorithms.manager.ms_instruments.tribrid_instrument as ti
 import logging
 import time
+from utils.qc_metrics import QCMetrics
 
 class MonitorAcquisition(Acquisition):
     instruments = [mi.MockInstrument, ti.ThermoTribridInstrument]
@@ -11,6 +12,7 @@ class MonitorAcquisition(Acquisition):
     def __init__(self, *args):
         super().__init__(*args)
         self.name = 'Monitor_algo_first_acquisition'
+        self.qc_metrics = QCMetrics()
         
     def pre_acquisition(self):
         self.logger.info('Executing pre-acquisition steps.')
@@ -21,14 +23,36 @@ class MonitorAcquisition(Acquisition):
             scan = self.fetch_received_scan()
             if (scan is not None):
                 self.logger.info('Received scan with scan number: ' + 
-                                 f'{scan["ScanNumber"]} Centroid count :' + 
-                                 str(scan["CentroidCount"]))
+                                 f'{scan[ScanFields.SCAN_NUMBER]} Centroid count :' + 
+                                 str(scan[ScanFields.CENTROID_COUNT]))
+                snapshot = self.qc_metrics.add_scan(scan)
+                if snapshot is not None:
+                    self.log_snapshot(snapshot)
             else:
                 pass
         self.logger.info('Finishing intra acquisition.')
     
     def post_acquisition(self):
         self.logger.info('Executing post-acquisition steps.')
+        self.log_snapshot(self.qc_metrics.snapshot())
+        
+    def log_snapshot(self, snapshot):
+        """Logs a snapshot of the quality control metrics.
+        
+        Parameters
+        ----------
+        snapshot : QCSnapshot
+            The snapshot to log.
+        """
+        self.logger.info(f'QC at {snapshot.rt:.2f} min - ' +
+                         f'MS1 scans: {snapshot.ms1_count} ({snapshot.ms1_rate:.2f} Hz), ' +
+                         f'MS2 scans: {snapshot.ms2_count} ({snapshot.ms2_rate:.2f} Hz), ' +
+                         f'Cycle time median: {snapshot.cycle_times[0.5]:.3f} s ' +
+                         f'(95%: {snapshot.cycle_times[0.95]:.3f} s), ' +
+                         f'MS1 centroid count median: {snapshot.ms1_centroid_counts[0.5]:.0f}, ' +
+                         f'MS2 centroid count median: {snapshot.ms2_centroid_counts[0.5]:.0f}, ' +
+                         f'TIC: {snapshot.tic:.3e}, Base peak: {snapshot.base_peak:.3e}, ' +
+                         f'Precursor coverage: {100 * snapshot.precursor_coverage:.1f} %')
 
 class MonitorAlgorithm(Algorithm):
     """Algorithm implementing simple monitoring"""
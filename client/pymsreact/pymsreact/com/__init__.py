@@ -1,3 +1,9 @@
-# Import submodules and subpackages
-from . import protocol, transport, instrument, mock
-__all__ = ['protocol', 'transport', 'instrument', 'mock']
\ No newline at end of file
+# Submodules and subpackages are imported on first access, so that only the
+# modules used by the selected sub-command are loaded.
+import importlib
+__all__ = ['protocol', 'transport', 'instrument', 'metadata', 'mock', 'broker']
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,256 @@
+import asyncio
+import collections
+import logging
+import os
+from .transport.local import (parse_local_address, read_frame, write_frame,
+                              DEFAULT_ADDRESS)
+
+class ScanBroker:
+    '''
+    This module holds the single upstream connection to the MSReact server and
+    republishes it to client processes running on the same host, through
+    Unix domain sockets or the local TCP loopback. The server transmits each
+    scan once, regardless of the number of local subscribers.
+
+    Messages are relayed as raw protocol frames, scans are never decoded by
+    the broker. Commands of the subscribers are forwarded to the server and the
+    responses are routed back to the subscriber that sent the command, except
+    for the instrument selection and the scan subscriptions that are handled
+    by the broker itself. The default scan parameters are owned by the first
+    subscriber that updates them, the updates of the other subscribers are
+    refused, since the owner sends its requests relying on its defaults.
+
+    ...
+
+    Attributes
+    ----------
+    protocol: BaseProtocol
+        Protocol to use for the communication with the server
+    local_address : str
+        Path of the Unix domain socket or "host:port" address the broker
+        listens on for subscribers.
+    '''
+
+    # Commands after which the server does not send a response
+    NO_RESPONSE_CMDS = ['REQ_CUSTOM_SCAN_CMD',
+                        'CANCEL_CUSTOM_SCAN_CMD',
+                        'SET_REPEATING_SCAN_CMD',
+                        'CLEAR_REPEATING_SCAN_CMD',
+                        'SET_MS_SCAN_LVL_CMD',
+                        'SHUT_DOWN_MOCK_SERVER_CMD']
+    # Maximum amount of bytes buffered towards a subscriber before scans are
+    # dropped for that subscriber, so a slow subscriber cannot stall the others
+    MAX_SUBSCRIBER_BUFFER = 64 * 1024 * 1024
+
+    def __init__(self, protocol, local_address = DEFAULT_ADDRESS):
+        """
+        Parameters
+        ----------
+        protocol: BaseProtocol
+            Protocol to use for the communication with the server.
+        local_address : str
+            Path of the Unix domain socket or "host:port" address to listen on
+            for subscribers.
+        """
+        self.proto = protocol
+        self.ids = protocol.MessageIDs
+        self.local_address = local_address
+        self.no_response_cmds = [self.ids[name] for name in self.NO_RESPONSE_CMDS]
+
+        self.server = None
+        self.upstream_task = None
+        self.subscribers = {}
+        self.pending_responses = collections.deque()
+        self.request_lock = asyncio.Lock()
+        self.upstream_subscribed = False
+        # Subscriber whose default scan parameter updates are forwarded
+        self.defaults_owner = None
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self, address, inst_num = 1):
+        """Connects to the server, selects the instrument and starts serving
+        local subscribers.
+
+        Parameters
+        ----------
+        address : str
+            IP address of the server to connect to eg. "172.18.160.1".
+        inst_num : int
+            The id of the instrument.
+
+        Returns
+        -------
+        bool
+            True if the broker started successfully, otherwise False.
+        """
+        if not await self.proto.connect(address):
+            return False
+        loop = asyncio.get_running_loop()
+        self.upstream_task = loop.create_task(self.__relay_upstream())
+
+        msg = await self.__request(self.ids.SELECT_INSTR_CMD, inst_num)
+        if self.ids.OK_RSP != msg:
+            self.logger.error("Problem with instrument selection.")
+            await self.stop()
+            return False
+
+        kind, location = parse_local_address(self.local_address)
+        if 'unix' == kind:
+            if os.path.exists(location):
+                os.remove(location)
+            self.server = await asyncio.start_unix_server(self.__serve,
+                                                          location)
+        else:
+            self.server = await asyncio.start_server(self.__serve, *location)
+        self.logger.info(f'Scan broker is listening at {self.local_address}')
+        return True
+
+    async def serve_forever(self):
+        """Serves local subscribers until the upstream connection is lost."""
+        try:
+            await self.upstream_task
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Stops serving local subscribers and disconnects from the server."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            for writer in list(self.subscribers):
+                writer.close()
+        # The upstream connection is also open when the broker failed to
+        # start after connecting to the server.
+        if self.upstream_task is not None:
+            self.upstream_task.cancel()
+            self.upstream_task = None
+            await self.proto.disconnect()
+            self.logger.info('Scan broker stopped.')
+
+    async def __serve(self, reader, writer):
+        self.subscribers[writer] = False
+        self.logger.info(f'Subscriber connected, {len(self.subscribers)} ' +
+                         'subscriber(s) in total.')
+        try:
+            while True:
+                frame = await read_frame(reader)
+                await self.__handle_command(writer, frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.subscribers[writer]
+            if self.defaults_owner is writer:
+                self.defaults_owner = None
+            await self.__update_upstream_subscription()
+            writer.close()
+            self.logger.info('Subscriber disconnected, ' +
+                             f'{len(self.subscribers)} subscriber(s) left.')
+
+    async def __handle_command(self, writer, frame):
+        # A malformed frame is answered with an error, without disconnecting
+        # the subscriber.
+        try:
+            msg = self.ids(frame[0])
+        except (IndexError, ValueError):
+            self.logger.warning(f'Malformed command from a subscriber: {frame[:8]!r}')
+            msg = None
+        if msg is None:
+            self.__reply(writer, self.ids.ERROR_RSP)
+        elif self.ids.SELECT_INSTR_CMD == msg:
+            # The instrument is selected by the broker when it starts.
+            self.__reply(writer, self.ids.OK_RSP)
+        elif self.ids.SUBSCRIBE_TO_SCANS_CMD == msg:
+            self.subscribers[writer] = True
+            await self.__update_upstream_subscription()
+            self.__reply(writer, self.ids.OK_RSP)
+        elif self.ids.UNSUBSCRIBE_FROM_SCANS_CMD == msg:
+            self.subscribers[writer] = False
+            await self.__update_upstream_subscription()
+            self.__reply(writer, self.ids.OK_RSP)
+        elif (self.ids.UPDATE_DEF_SCAN_PARAMS_CMD == msg and
+              not self.__owns_defaults(writer)):
+            self.logger.warning('Default scan parameter update refused, the ' +
+                                'defaults are owned by another subscriber.')
+            self.__reply(writer, self.ids.ERROR_RSP)
+        elif msg in self.no_response_cmds:
+            await self.proto.tl.send(frame)
+        else:
+            response = await self.__forward(frame)
+            write_frame(writer, response)
+        await writer.drain()
+
+    async def __update_upstream_subscription(self):
+        # The server is subscribed to as long as at least one subscriber
+        # wants to receive scans.
+        wanted = any(self.subscribers.values())
+        if wanted != self.upstream_subscribed:
+            cmd = (self.ids.SUBSCRIBE_TO_SCANS_CMD if wanted
+                   else self.ids.UNSUBSCRIBE_FROM_SCANS_CMD)
+            msg = await self.__request(cmd)
+            if self.ids.OK_RSP == msg:
+                self.upstream_subscribed = wanted
+            else:
+                self.logger.error(f'Problem with {cmd.name} on the server.')
+
+    def __owns_defaults(self, writer):
+        # The first subscriber updating the defaults owns them until it
+        # disconnects. A new owner sets all the original defaults first.
+        if self.defaults_owner is None:
+            self.defaults_owner = writer
+        return self.defaults_owner is writer
+
+    def __reply(self, writer, msg):
+        write_frame(writer, msg.to_bytes(1, 'big'))
+
+    async def __request(self, msg, payload = None):
+        async with self.request_lock:
+            response = self.__expect_response()
+            await self.proto.send_message(msg, payload)
+            frame = await response
+        return self.ids(frame[0])
+
+    async def __forward(self, frame):
+        async with self.request_lock:
+            response = self.__expect_response()
+            await self.proto.tl.send(frame)
+            return await response
+
+    def __expect_response(self):
+        response = asyncio.get_running_loop().create_future()
+        self.pending_responses.append(response)
+        return response
+
+    async def __relay_upstream(self):
+        try:
+            while True:
+                frame = await self.proto.tl.receive()
+                msg = self.ids(frame[0])
+                if self.ids.SCAN_EVT == msg:
+                    self.__publish(frame, scans_only = True)
+                elif 'RSP' == msg.name[-3:]:
+                    if self.pending_responses:
+                        self.pending_responses.popleft().set_result(frame)
+                    else:
+                        self.logger.error(f'Unexpected response: {msg.name}')
+                else:
+                    self.__publish(frame, scans_only = False)
+        except asyncio.CancelledError:
+            self.logger.info('Cancellation request of the upstream relay received.')
+        except Exception as e:
+            self.logger.error(f'Upstream connection lost: {e}')
+            self.__publish(self.ids.ERROR_EVT.to_bytes(1, 'big'),
+                           scans_only = False)
+        finally:
+            # Nothing will answer the outstanding requests anymore.
+            while self.pending_responses:
+                self.pending_responses.popleft().cancel()
+
+    def __publish(self, frame, scans_only):
+        for writer, subscribed in self.subscribers.items():
+            if scans_only and not subscribed:
+                continue
+            if (scans_only and
+                writer.transport.get_write_buffer_size() > self.MAX_SUBSCRIBER_BUFFER):
+                continue
+            write_frame(writer, frame)
@@ -1,14 +1,13 @@
 import asyncio
-import csv
+import collections
+import itertools
 import logging
-import multiprocessing
-import time
+import msgpack
 import os
-import requests
-from tqdm import *
 from enum import Enum
-from multiprocessing import Queue
-from queue import Empty, Full
+from . import metadata
+from .scan_defaults import ScanDefaults
+from algorithms.manager.scan_request import RenderedScanRequest
 
 class InstrMsgIDs(Enum):
     SCAN = 1
@@ -18,6 +17,14 @@ class InstrMsgIDs(Enum):
     FINISHED_ACQUISITION = 5
     ERROR = 6
 
+# Request waiting for its response from the server.
+#   expected - Message id of the response, besides ERROR_RSP
+#   future - Future of the (message id, payload) of the response, None for
+#            the probes of the readiness handshake
+#   probe - True if the request is a probe of the readiness handshake
+PendingResponse = collections.namedtuple('PendingResponse',
+                                         ['expected', 'future', 'probe'])
+
 class InstrumentClient:
     '''
     This module is responsible for managing the instrument server through the 
@@ -33,9 +40,32 @@ class InstrumentClient:
     app_cb : func
         Callback function to forward messages to the application from the 
         InstrumentClient
+    protocol_version : str
+        Protocol version of the connected server.
+    server_version : str
+        Software version of the connected server.
+    instrument_type : str
+        Type of the selected instrument.
+    possible_params : list
+        Possible parameters for requesting scans from the selected instrument.
+        See :func:`~instrument.InstrumentClient.get_possible_params`.
     
     '''
     
+    # Time in seconds to wait for the server to answer the readiness handshake
+    READY_TIMEOUT = 10
+    # Interval in seconds between two attempts of the readiness handshake
+    READY_RETRY_INTERVAL = 0.25
+    # Responses of the commands that are not answered with OK_RSP
+    RESPONSES = {'GET_SERVER_PROTO_VER_CMD' : 'SERVER_PROTO_VER_RSP',
+                 'GET_SERVER_SW_VER_CMD' : 'SERVER_SW_VER_RSP',
+                 'GET_ACQ_RAW_FILE_NAME' : 'ACQ_RAW_FILE_NAME_RSP',
+                 'GET_AVAILABLE_INSTR_CMD' : 'AVAILABLE_INSTR_RSP',
+                 'GET_INSTR_TYPE_CMD' : 'INSTR_TYPE_RSP',
+                 'GET_INSTR_STATE_CMD' : 'INSTR_STATE_RSP',
+                 'GET_POSSIBLE_PARAMS_CMD' : 'POSSIBLE_PARAMS_RSP',
+                 'GET_LAST_ACQ_FILE_CMD' : 'LAST_ACQ_FILE_RSP'}
+    
     def __init__(self, protocol, app_cb): 
         """
         Parameters
@@ -55,8 +85,31 @@ class InstrumentClient:
         self.address = None
         self.acq_running = False
         self.acq_lock = asyncio.Lock()
-        self.resp_cond = asyncio.Condition()
-        self.resp = None
+        # The responses are matched to the pending requests by message type,
+        # in the order the commands were sent. Commands can be pipelined this
+        # way, without waiting for the previous responses.
+        self.request_lock = asyncio.Lock()
+        self.pending_responses = collections.deque()
+        self.responses = {self.proto.MessageIDs[command] :
+                          self.proto.MessageIDs[response]
+                          for command, response in self.RESPONSES.items()}
+        self.handshake = None
+        self.listening_task = None
+        self.revalidation_task = None
+        
+        # Metadata of the server and the selected instrument
+        self.protocol_version = None
+        self.server_version = None
+        self.instrument_type = None
+        self.possible_params = None
+        
+        # Default scan parameters, against which the custom scan requests are
+        # delta encoded. Parameters are only promoted to defaults once the
+        # original defaults are known from the possible parameters.
+        self.scan_defaults = ScanDefaults()
+        # Template id -> constant parameters of the template that are set as
+        # defaults for its requests
+        self.scan_templates = {}
         
         # Initialise logger
         self.logger = logging.getLogger(__name__)
@@ -103,8 +156,11 @@ class InstrumentClient:
         """
         self.logger.info('Getting protocol version')
 
-        await self.proto.send_message(self.proto.MessageIDs.GET_SERVER_PROTO_VER_CMD)
-        msg, payload = await self.__wait_for_response()
+        # A late answer to the readiness handshake is a valid answer too.
+        self.pending_responses = collections.deque(
+            response for response in self.pending_responses
+            if not response.probe)
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_SERVER_PROTO_VER_CMD)
         if (self.proto.MessageIDs.SERVER_PROTO_VER_RSP == msg):
             self.logger.info(f'Received protocol version: {payload}')
         else:
@@ -123,8 +179,7 @@ class InstrumentClient:
         """
         self.logger.info('Getting server software version')
         
-        await self.proto.send_message(self.proto.MessageIDs.GET_SERVER_SW_VER_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_SERVER_SW_VER_CMD)
         if (self.proto.MessageIDs.SERVER_SW_VER_RSP == msg):
             self.logger.info(f'Received server software version: {payload}')
         else:
@@ -141,8 +196,7 @@ class InstrumentClient:
         """
         self.logger.info('Getting available instruments')
         
-        await self.proto.send_message(self.proto.MessageIDs.GET_AVAILABLE_INSTR_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_AVAILABLE_INSTR_CMD)
         if (self.proto.MessageIDs.AVAILABLE_INSTR_RSP == msg):
             # TODO: Process the payload into a list.
             self.logger.info(f'Available instruments: {payload}')
@@ -166,8 +220,7 @@ class InstrumentClient:
     
         self.logger.info(f'Requesting type of the instrument.')
         
-        await self.proto.send_message(self.proto.MessageIDs.GET_INSTR_TYPE_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_INSTR_TYPE_CMD)
         if (self.proto.MessageIDs.INSTR_TYPE_RSP == msg):
             self.logger.info(f'Instrument type: {payload}')
         else:
@@ -190,9 +243,7 @@ class InstrumentClient:
     
         self.logger.info(f'Get instrument state of instrument: {instrument}')
         
-        await self.proto.send_message(self.proto.MessageIDs.GET_INSTR_STATE_CMD,
-                                      instrument)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_INSTR_STATE_CMD, instrument)
         if (self.proto.MessageIDs.INSTR_STATE_RSP == msg):
             self.logger.info(f'Instrument state:\n{payload}')
         else:
@@ -209,9 +260,7 @@ class InstrumentClient:
             
         """
         self.logger.info('Selecting instrument.')
-        await self.proto.send_message(self.proto.MessageIDs.SELECT_INSTR_CMD,
-                                      instrument)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.SELECT_INSTR_CMD, instrument)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with instrument selection.")
             raise Exception("Problem with instrument selection.")
@@ -227,8 +276,7 @@ class InstrumentClient:
             dictionary with keys: "Name", "Selection", "DefaultValue" "Help".
         """
         self.logger.info('Getting possible parameters for requesting scans...')
-        await self.proto.send_message(self.proto.MessageIDs.GET_POSSIBLE_PARAMS_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_POSSIBLE_PARAMS_CMD)
         if (self.proto.MessageIDs.POSSIBLE_PARAMS_RSP != msg):
             # TODO - raise exception
             self.logger.error("Response was not POSSIBLE_PARAMS message.")
@@ -250,20 +298,78 @@ class InstrumentClient:
 
         Parameters
         ----------
-        parameters : dict
+        parameters : dict or RenderedScanRequest
             String-string dictionary of parameters, where a given key has to be
             one of the names of the possible parameters. 
             See :func:`~instrument.InstrumentClient.get_possible_params`.
+            Or a request rendered by a registered ScanRequestTemplate.
             
+        Requests are sent as deltas against the default scan parameters, and
+        parameters that repeat across requests are promoted to defaults. See
+        :class:`~scan_defaults.ScanDefaults`. Rendered requests are sent as
+        they were serialized, after the defaults of their template were set.
         """
         #self.logger.info(f'Requesting scans with the following parameters:\n{parameters}')
+        if isinstance(parameters, RenderedScanRequest):
+            await self.__request_rendered_scan(parameters)
+            return
+        promotion = self.scan_defaults.track(parameters)
+        if promotion is not None:
+            await self.__promote_default_scan_params(promotion)
         await self.proto.send_message(self.proto.MessageIDs.REQ_CUSTOM_SCAN_CMD,
-                                      parameters)
+                                      self.scan_defaults.encode(parameters))
         #msg, payload = await self.proto.receive_message()
         #if (self.proto.MessageIDs.OK_RSP != msg):
         #    self.logger.error("Problem with custom scan request.")
         #    raise Exception("Problem with custom scan request.")
         
+    async def __request_rendered_scan(self, rendered):
+        # The defaults of the template are only set again when other requests
+        # changed them in the meantime.
+        defaults = self.__template_defaults(rendered.template_id)
+        update = self.scan_defaults.activate(defaults)
+        if update is not None:
+            await self.__promote_default_scan_params(update)
+        if self.scan_defaults.owned:
+            await self.proto.send_packed(self.proto.MessageIDs.REQ_CUSTOM_SCAN_CMD,
+                                         rendered.payload)
+        else:
+            await self.proto.send_message(self.proto.MessageIDs.REQ_CUSTOM_SCAN_CMD,
+                                          self.scan_defaults.complete(
+                                              self.__unpack_rendered(rendered)))
+        
+    async def register_scan_template(self, template_id, defaults):
+        """Registers a scan request template, and sets its constant parameters
+        as the default scan parameters of the server, so its rendered requests
+        only carry their varying parameters.
+
+        Parameters
+        ----------
+        template_id : str
+            Id of the template, see
+            :class:`~algorithms.manager.scan_request.ScanRequestTemplate`.
+        defaults : dict
+            String-string dictionary of the constant parameters of the
+            template that are left out of its rendered requests.
+        """
+        self.scan_templates[template_id] = defaults
+        update = self.scan_defaults.activate(defaults)
+        if update is not None:
+            await self.__promote_default_scan_params(update)
+        
+    def __template_defaults(self, template_id):
+        try:
+            return self.scan_templates[template_id]
+        except KeyError:
+            self.logger.error("Request of an unregistered scan template.")
+            raise Exception("Request of an unregistered scan template.")
+        
+    def __unpack_rendered(self, rendered):
+        # Complete parameters of a rendered request, without the defaults of
+        # its template.
+        return (self.__template_defaults(rendered.template_id) |
+                msgpack.unpackb(rendered.payload))
+        
     async def cancel_custom_scan(self):
         """Cancels the previously requested custom scan."""
         await self.proto.send_message(self.proto.MessageIDs.CANCEL_CUSTOM_SCAN_CMD)
@@ -274,14 +380,19 @@ class InstrumentClient:
 
         Parameters
         ----------
-        parameters : dict
+        parameters : dict or RenderedScanRequest
             String-string dictionary of parameters, where a given key has to be
             one of the names of the possible parameters. 
             See :func:`~instrument.InstrumentClient.get_possible_params`.
+            Or a request rendered by a registered ScanRequestTemplate.
             
         """
+        if isinstance(parameters, RenderedScanRequest):
+            parameters = self.__unpack_rendered(parameters)
+        # Repeating scans are not delta encoded, they must not rely on the
+        # promoted defaults, which can change while the scan repeats.
         await self.proto.send_message(self.proto.MessageIDs.SET_REPEATING_SCAN_CMD,
-                                      parameters)
+                                      self.scan_defaults.complete(parameters))
                                       
     async def cancel_repeating_scan(self):
         """Cancels the previously requested repeating scan."""
@@ -291,8 +402,7 @@ class InstrumentClient:
         """Subscribes to scans on the selected instrument, i.e. the server will 
         transmit the scans acquired by the instrument to the client."""
         self.logger.info('Subscribing for scans.')
-        await self.proto.send_message(self.proto.MessageIDs.SUBSCRIBE_TO_SCANS_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.SUBSCRIBE_TO_SCANS_CMD)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with subscribing to scans.")
             raise Exception("Problem with subscribing to scans.")
@@ -301,8 +411,7 @@ class InstrumentClient:
         """Unsubscribes from scans on the selected instrument, i.e. the server will
         stop transmitting the scans acquired by the instrument to the client."""
         self.logger.info('Unsubscribing from scans.')
-        await self.proto.send_message(self.proto.MessageIDs.UNSUBSCRIBE_FROM_SCANS_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.UNSUBSCRIBE_FROM_SCANS_CMD)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with unsubscribing from scans.")
             raise Exception("Problem with unsubscribing from scans.")
@@ -322,8 +431,7 @@ class InstrumentClient:
             "SingleProcessingDelay" : TODO - Link to reference
             "WaitForContactClosure" : TODO - Link to reference"""
         self.logger.info('Configure the acquisition')
-        await self.proto.send_message(self.proto.MessageIDs.CONFIG_ACQ_CMD, config)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.CONFIG_ACQ_CMD, config)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with configuring acquisition.")
             raise Exception("Problem with configuring acquisition.")
@@ -331,8 +439,7 @@ class InstrumentClient:
     async def start_acquisition(self):
         """Requests the start of an acquisition from server."""
         self.logger.info('Start receiving scans from the instrument')
-        await self.proto.send_message(self.proto.MessageIDs.START_ACQ_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.START_ACQ_CMD)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with starting acquisition.")
             raise Exception("Problem with starting acquisition.")
@@ -340,8 +447,7 @@ class InstrumentClient:
     async def stop_acquisition(self):
         """Requests the stop of the current acquisition from server."""
         self.logger.info('Stop receiving scans from the instrument')
-        await self.proto.send_message(self.proto.MessageIDs.STOP_ACQ_CMD)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.STOP_ACQ_CMD)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with stopping acquisition.")
             raise Exception("Problem with stopping acquisition.")
@@ -354,17 +460,32 @@ class InstrumentClient:
            don't need to be specified at each request if they stay the same."""
         self.logger.info('Update default scan parameters to the following: ' +
                          f'{params}')
-        await self.proto.send_message(self.proto.MessageIDs.UPDATE_DEF_SCAN_PARAMS_CMD, params)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.UPDATE_DEF_SCAN_PARAMS_CMD, params)
         if (self.proto.MessageIDs.OK_RSP != msg):
             self.logger.error("Problem with updating default scan parameters.")
             raise Exception("Problem with updating default scan parameters.")
+        self.scan_defaults.set_defaults(params)
+        
+    async def __promote_default_scan_params(self, params):
+        # A refused update means that the defaults are owned by another
+        # client, eg. through the scan broker. The requests do not rely on
+        # the defaults from then on.
+        msg, payload = await self.__request(self.proto.MessageIDs.UPDATE_DEF_SCAN_PARAMS_CMD, params)
+        if (self.proto.MessageIDs.OK_RSP != msg):
+            self.scan_defaults.disown()
+            return
+        self.scan_defaults.promoted(params)
+        
+    async def __claim_default_scan_params(self):
+        # Sets the original defaults on the server, which can be left
+        # changed by a previous client, before relying on them.
+        if self.scan_defaults.base:
+            await self.__promote_default_scan_params(self.scan_defaults.base)
             
     async def request_raw_file_name(self):
         """Requests the name of the current acquisitions raw file"""
         self.logger.info('Requesting recent raw file names from the instrument.')
-        await self.proto.send_message(self.proto.MessageIDs.GET_ACQ_RAW_FILE_NAME)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_ACQ_RAW_FILE_NAME)
         if (self.proto.MessageIDs.ACQ_RAW_FILE_NAME_RSP == msg):
             self.app_cb(InstrMsgIDs.RECEIVED_RAW_FILE_NAMES, payload)
         else:
@@ -376,9 +497,7 @@ class InstrumentClient:
         self.logger.info('Request latest acquisition raw file from server.')
         raw_file = args[0]
         target_dir = args[1]
-        await self.proto.send_message(self.proto.MessageIDs.GET_LAST_ACQ_FILE_CMD, raw_file)
-        time.sleep(1)
-        msg, payload = await self.__wait_for_response()
+        msg, payload = await self.__request(self.proto.MessageIDs.GET_LAST_ACQ_FILE_CMD, raw_file)
         if (self.proto.MessageIDs.LAST_ACQ_FILE_RSP == msg):
             file_path = self.__download(payload, target_dir)
             self.app_cb(InstrMsgIDs.FINISHED_ACQ_FILE_DOWNLOAD, file_path)
@@ -386,21 +505,141 @@ class InstrumentClient:
             self.logger.error("Problem with getting last acquisition raw file.")
             raise Exception("Problem with getting last acquisition raw file.")
         
-    async def setup_instrument_connection(self, inst_num):
+    async def wait_until_ready(self, timeout = READY_TIMEOUT):
+        """Waits until the server answers messages after the connection, by
+        requesting its protocol version until it responds. Messages must be
+        being listened for, see :func:`~instrument.InstrumentClient.listen_for_messages`.
+
+        Parameters
+        ----------
+        timeout : float
+            Time in seconds to wait for the server to answer.
+
+        Returns
+        -------
+        str
+            The protocol version of the server.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.handshake = loop.create_future()
+        while not self.handshake.done():
+            if loop.time() >= deadline:
+                self.logger.error(f'Server did not answer within {timeout} s.')
+                raise asyncio.TimeoutError('Server did not answer within ' +
+                                           f'{timeout} s.')
+            async with self.request_lock:
+                self.pending_responses.append(
+                    PendingResponse(self.proto.MessageIDs.SERVER_PROTO_VER_RSP,
+                                    None,
+                                    True))
+                await self.proto.send_message(
+                    self.proto.MessageIDs.GET_SERVER_PROTO_VER_CMD)
+            await asyncio.wait([self.handshake],
+                               timeout = min(self.READY_RETRY_INTERVAL,
+                                             deadline - loop.time()))
+        self.protocol_version = self.handshake.result()
+        self.logger.info(f'Server is ready, protocol version: {self.protocol_version}')
+        return self.protocol_version
+        
+    async def setup_instrument_connection(self, inst_num, use_cache = True):
+        """Starts listening for messages from the server, waits until the
+        server is ready, selects the instrument and collects its metadata:
+        the server and protocol versions, the type of the instrument and the
+        possible parameters for requesting scans.
+
+        The metadata is kept in a snapshot keyed by the server version. When a
+        snapshot exists, the metadata is taken from the snapshot and is
+        revalidated against the server in the background. The metadata must
+        not be used for an acquisition before
+        :func:`~instrument.InstrumentClient.validate_metadata` confirmed it.
+
+        Parameters
+        ----------
+        inst_num : int
+            The id of the instrument.
+        use_cache : bool
+            Whether to start from the metadata snapshot if there is one.
+        """
         # Start listening from messages from the client
         loop = asyncio.get_running_loop()
-        self.listening_task = \
-            loop.create_task(self.listen_for_messages())
+        if self.listening_task is None or self.listening_task.done():
+            self.listening_task = \
+                loop.create_task(self.listen_for_messages())
+        
+        await self.wait_until_ready()
             
         # Select instrument TODO - This should be instrument discovery, or simply
         # assume that there is a separate computer for each mass spectrometer 
         # instrument.
-        await self.select_instrument(inst_num)
-        
-        # Collect possible parameters for requesting custom scans
-        possible_params = await self.get_possible_params()
+        self.server_version, _ = \
+            await asyncio.gather(self.get_server_version(),
+                                 self.select_instrument(inst_num))
+        
+        key = metadata.snapshot_key(self.address,
+                                    inst_num,
+                                    self.server_version,
+                                    self.protocol_version)
+        snapshot = metadata.load_snapshot(key) if use_cache else None
+        if snapshot is not None:
+            self.logger.info('Using the cached instrument metadata.')
+            self.instrument_type = snapshot['instrument_type']
+            self.possible_params = snapshot['possible_params']
+            self.scan_defaults = ScanDefaults(self.possible_params)
+            self.revalidation_task = \
+                loop.create_task(self.__revalidate_metadata(key, snapshot))
+        else:
+            await self.__collect_metadata(key)
+            self.scan_defaults = ScanDefaults(self.possible_params)
+        await self.__claim_default_scan_params()
+        
+    async def __collect_metadata(self, key):
+        # Collect the type of the instrument and the possible parameters for
+        # requesting custom scans.
+        self.possible_params, self.instrument_type = \
+            await asyncio.gather(self.get_possible_params(),
+                                 self.get_instrument_type())
+        snapshot = {'protocol_version' : self.protocol_version,
+                    'server_version' : self.server_version,
+                    'instrument_type' : self.instrument_type,
+                    'possible_params' : self.possible_params}
+        metadata.save_snapshot(key, snapshot)
+        return snapshot
+        
+    async def validate_metadata(self):
+        """Waits until the metadata the instrument connection was set up with
+        was checked against the server, when it was taken from a snapshot.
+
+        Returns
+        -------
+        bool
+            True if the metadata is up to date. False if it changed since it
+            was cached, or could not be checked, in which case the metadata
+            the connection was set up with must not be used.
+        """
+        if self.revalidation_task is None:
+            return True
+        return await self.revalidation_task
+        
+    async def __revalidate_metadata(self, key, snapshot):
+        # Checks the snapshot against the server, and returns whether it is
+        # still valid. A changed snapshot is updated by the collection, and a
+        # snapshot that could not be checked is not reused.
+        try:
+            current = await self.__collect_metadata(key)
+        except Exception as e:
+            self.logger.error(f'Could not revalidate instrument metadata: {e}')
+            metadata.invalidate_snapshot(key)
+            return False
+        if snapshot != current:
+            self.scan_defaults = ScanDefaults(self.possible_params)
+            self.logger.error('The instrument metadata changed since it was cached.')
+            return False
+        return True
         
     async def instrument_clean_up(self):
+        if self.revalidation_task is not None:
+            self.revalidation_task.cancel()
         self.logger.info("Unsubscribe from scans.")
         await self.unsubscribe_from_scans()
         self.logger.info("Stop the listening loop.")
@@ -425,9 +664,17 @@ class InstrumentClient:
         no_error = True
         msg_type = msg.name[-3:]
         if ('RSP' == msg_type):
-            async with self.resp_cond:
-                self.resp = (msg, payload)
-                self.resp_cond.notify()
+            response = self.__match_response(msg)
+            if response is None:
+                self.logger.error(f'Unexpected response: {msg.name}')
+            elif response.probe:
+                # Answer to the readiness handshake
+                if (self.proto.MessageIDs.SERVER_PROTO_VER_RSP == msg and
+                    not self.handshake.done()):
+                    self.handshake.set_result(payload)
+            # The request might have been cancelled in the meantime.
+            elif not response.future.done():
+                response.future.set_result((msg, payload))
         elif ('EVT' == msg_type):
             if (self.proto.MessageIDs.STARTED_ACQ_EVT == msg):
                 self.logger.info('Start message received in instrument server manager')
@@ -445,15 +692,42 @@ class InstrumentClient:
             # That is an error situation
         return no_error
         
-    async def __wait_for_response(self):
-        async with self.resp_cond:
-            await self.resp_cond.wait()
-            received_resp, resp_payload = self.resp
-            self.resp = None
+    def __match_response(self, msg):
+        # Returns the first pending request that expects this type of
+        # response, or the first one for an ERROR_RSP. The server answers in
+        # order, so the probes of the handshake before the answered request
+        # are dropped: the server did not answer them.
+        pending = self.pending_responses
+        for index, response in enumerate(pending):
+            if (msg == response.expected or
+                self.proto.MessageIDs.ERROR_RSP == msg):
+                self.pending_responses = collections.deque(
+                    [earlier for earlier in itertools.islice(pending, index)
+                     if not earlier.probe] +
+                    list(itertools.islice(pending, index + 1, None)))
+                return response
+        return None
+        
+    async def __request(self, msg, payload = None):
+        # Sends a command and waits for its response. The lock only covers
+        # the sending, so the order of the pending responses matches the
+        # order of the commands.
+        expected = self.responses.get(msg, self.proto.MessageIDs.OK_RSP)
+        async with self.request_lock:
+            response = PendingResponse(expected,
+                                       asyncio.get_running_loop().create_future(),
+                                       False)
+            self.pending_responses.append(response)
+            await self.proto.send_message(msg, payload)
+        received_resp, resp_payload = await response.future
         self.logger.info(f'Response: {received_resp.name}')
         return received_resp, resp_payload
             
     def __download(self, url: str, dest_folder: str):
+        # Only needed for downloading raw files, imported on first use.
+        import requests
+        from tqdm import tqdm
+        
         if not os.path.exists(dest_folder):
             os.makedirs(dest_folder)  # create folder if it does not exist
 
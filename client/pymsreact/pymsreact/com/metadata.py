@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Folder of the instrument metadata snapshots
+CACHE_DIR = os.path.join('output', 'cache', 'instrument')
+
+# Snapshots loaded or saved by this process
+_memory_cache = {}
+
+def snapshot_key(address, inst_num, server_version, protocol_version):
+    """Returns the key of the metadata snapshot of an instrument. The snapshot
+    is only valid as long as the server software and protocol versions stay
+    the same.
+
+    Parameters
+    ----------
+    address : str
+        Address of the server, or None for the default address.
+    inst_num : int
+        The id of the instrument on the server.
+    server_version : str
+        Software version of the server.
+    protocol_version : str
+        Protocol version of the server.
+    """
+    return json.dumps([address, inst_num, server_version, protocol_version])
+
+def load_snapshot(key):
+    """Loads the metadata snapshot stored under the given key.
+
+    Parameters
+    ----------
+    key : str
+        Key returned by :func:`snapshot_key`.
+
+    Returns
+    -------
+    dict
+        The metadata of the instrument, or None if there is no snapshot.
+    """
+    metadata = _memory_cache.get(key)
+    if metadata is None:
+        try:
+            with open(_snapshot_path(key), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get('key') != key:
+            return None
+        metadata = snapshot['metadata']
+        _memory_cache[key] = metadata
+    return metadata
+
+def save_snapshot(key, metadata):
+    """Stores the metadata snapshot of an instrument.
+
+    Parameters
+    ----------
+    key : str
+        Key returned by :func:`snapshot_key`.
+    metadata : dict
+        JSON serializable metadata of the instrument.
+    """
+    _memory_cache[key] = metadata
+    path = _snapshot_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a
+        # partially written snapshot.
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'key' : key, 'metadata' : metadata}, f)
+        os.replace(temporary, path)
+    except (OSError, TypeError) as e:
+        logger.warning(f'Could not save instrument metadata snapshot: {e}')
+
+def invalidate_snapshot(key):
+    """Removes the metadata snapshot stored under the given key, eg. when it
+    could not be checked against the server.
+
+    Parameters
+    ----------
+    key : str
+        Key returned by :func:`snapshot_key`.
+    """
+    _memory_cache.pop(key, None)
+    try:
+        os.remove(_snapshot_path(key))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f'Could not remove instrument metadata snapshot: {e}')
+
+def _snapshot_path(key):
+    return os.path.join(CACHE_DIR,
+                        hashlib.sha1(key.encode()).hexdigest() + '.json')
@@ -1,3 +1,9 @@
-# Import submodules
-from . import base, msrp
-_all__ = ['base', 'msrp']
\ No newline at end of file
+# Submodules are imported on first access, so that only the
+# modules used by the selected sub-command are loaded.
+import importlib
+__all__ = ['base', 'msrp']
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -45,6 +45,8 @@ class BaseProtocol:
         pass
     async def send_message(self, msg, payload = None):
         pass
+    async def send_packed(self, msg, packed_payload):
+        pass
     
     async def receive_message(self):
         msg = None
@@ -103,6 +103,19 @@ class MSReactProtocol(BaseProtocol):
             raise ProtocolException("Sending message failed: Incorrect message ID",
                                     ProtocolErrors.MESSAGE_PACKING_ERROR)
     
+    async def send_packed(self, msg, packed_payload):
+        """Sends a message with a payload that is already serialized, eg. by a
+        :class:`~algorithms.manager.scan_request.ScanRequestTemplate`."""
+        if (msg in self.MessageIDs):
+            try:
+                await self.tl.send(msg.to_bytes(1, 'big') + packed_payload)
+            except TransportException as tex:
+                raise ProtocolException("Error while trying to send message.", 
+                                        ProtocolErrors.TRANSPORT_ERROR) from tex
+        else:
+            raise ProtocolException("Sending message failed: Incorrect message ID",
+                                    ProtocolErrors.MESSAGE_PACKING_ERROR)
+    
     async def receive_message(self):
         msg_id = self.MessageIDs.ERROR_EVT
         payload = None
@@ -0,0 +1,226 @@
+import asyncio
+import collections
+import logging
+import time
+
+class RepeatingScanManager:
+    '''
+    Keeps track of the repeating scans requested by the algorithms, and issues
+    and cancels them on the instrument as their retention time windows open
+    and close and their lifetimes end. An algorithm requests a repeating scan
+    once, instead of requesting the same custom scan at each cycle.
+
+    The instrument repeats at most max_active scans at a time. When more
+    repeating scans are in their window, the ones with the highest priority,
+    and then the earliest requested ones, are repeated. Since clearing the
+    repeating scans on the instrument clears all of them, the remaining ones
+    are issued again after a repeating scan is removed.
+
+    A failure to update the repeating scans of the instrument is logged, and
+    the update is retried after retry_interval, starting by clearing the
+    repeating scans since the state of the instrument is unknown. After
+    max_failures consecutive failures, the error is raised from run.
+
+    ...
+
+    Attributes
+    ----------
+    scans : collections.OrderedDict
+        Requested repeating scans, scan id -> RepeatingScanRequest.
+    active : list
+        Ids of the repeating scans currently issued on the instrument.
+    '''
+
+    # Number of scans the instrument can repeat at a time
+    DEFAULT_MAX_ACTIVE = 1
+    # Time in seconds after which a failed update is retried
+    DEFAULT_RETRY_INTERVAL = 1.0
+    # Number of consecutive failed updates after which run raises
+    DEFAULT_MAX_FAILURES = 5
+
+    def __init__(self,
+                 set_cb,
+                 clear_cb,
+                 max_active = DEFAULT_MAX_ACTIVE,
+                 retry_interval = DEFAULT_RETRY_INTERVAL,
+                 max_failures = DEFAULT_MAX_FAILURES):
+        """
+        Parameters
+        ----------
+        set_cb : coroutine function
+            Issues a repeating scan on the instrument with the given
+            parameters, eg.
+            :func:`~instrument.InstrumentClient.request_repeating_scan`.
+        clear_cb : coroutine function
+            Clears the repeating scans on the instrument, eg.
+            :func:`~instrument.InstrumentClient.cancel_repeating_scan`.
+        max_active : int
+            Number of scans the instrument can repeat at a time.
+        retry_interval : float
+            Time in seconds after which a failed update is retried.
+        max_failures : int
+            Number of consecutive failed updates after which run raises the
+            last error.
+        """
+        self.set_cb = set_cb
+        self.clear_cb = clear_cb
+        self.max_active = max_active
+        self.retry_interval = retry_interval
+        self.max_failures = max_failures
+        self.failures = 0
+        self.scans = collections.OrderedDict()
+        self.active = []
+        # False when the repeating scans of the instrument are unknown, after
+        # a failed update.
+        self.synced = True
+        self.retention_time = None
+        self.wakeup = asyncio.Event()
+        self.stats = collections.Counter()
+        self.logger = logging.getLogger(__name__)
+
+    def add(self, request):
+        """Adds or replaces a repeating scan.
+
+        Parameters
+        ----------
+        request : RepeatingScanRequest
+            The repeating scan with the conditions of its repetition.
+        """
+        if request.scan_id in self.active:
+            # The parameters might have changed. The instrument repeats the
+            # old scan until it is cleared, so the repeating scans are
+            # cleared and issued again.
+            self.active.remove(request.scan_id)
+            self.synced = False
+            self.stats['replaced'] += 1
+        self.scans[request.scan_id] = request
+        self.wakeup.set()
+
+    def remove(self, scan_id = None):
+        """Removes a repeating scan.
+
+        Parameters
+        ----------
+        scan_id :
+            Id of the repeating scan, or None to remove all of them.
+        """
+        if scan_id is None:
+            self.scans.clear()
+        else:
+            self.scans.pop(scan_id, None)
+        self.wakeup.set()
+
+    def retention_time_changed(self, retention_time):
+        """Updates the current retention time, from the received scans.
+
+        Parameters
+        ----------
+        retention_time : float
+            Retention time of the last received scan in minutes.
+        """
+        self.retention_time = retention_time
+        # Only wake up if a window opened or closed.
+        if self.synced and self.__selection() != self.active:
+            self.wakeup.set()
+
+    async def run(self):
+        """Keeps the repeating scans of the instrument up to date until
+        cancelled. The repeating scans are cleared on the instrument when
+        the manager stops.
+
+        Raises
+        ------
+        Exception
+            The last error, after max_failures consecutive failed updates.
+        """
+        try:
+            while True:
+                timeout = self.__expire(time.time())
+                if not self.synced:
+                    timeout = (self.retry_interval if timeout is None
+                               else min(timeout, self.retry_interval))
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                self.__expire(time.time())
+                try:
+                    await self.__update(self.__selection())
+                except Exception as e:
+                    self.__failed(e)
+                else:
+                    self.failures = 0
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.__clear()
+            self.logger.info(f'Repeating scan manager stopped: {dict(self.stats)}')
+
+    async def __clear(self):
+        # Clears the repeating scans that might be left on the instrument.
+        if self.synced and not self.active:
+            return
+        try:
+            await self.clear_cb()
+        except Exception as e:
+            self.logger.error(f'Failed to clear the repeating scans: {e!r}')
+        else:
+            self.active = []
+            self.synced = True
+
+    def __failed(self, error):
+        # Logs a failed update, and raises it once there were too many
+        # consecutive ones.
+        self.stats['failed'] += 1
+        self.failures += 1
+        self.synced = False
+        self.logger.error('Failed to update the repeating scans ' +
+                          f'({self.failures} consecutive failures): {error!r}')
+        if self.failures >= self.max_failures:
+            raise error
+
+    async def __update(self, selection):
+        if self.synced and selection == self.active:
+            return
+        if ((not self.synced) or
+            any(scan_id not in selection for scan_id in self.active)):
+            # Repeating scans can only be cleared all at once.
+            await self.clear_cb()
+            self.stats['cleared'] += 1
+            self.active = []
+            self.synced = True
+        for scan_id in selection:
+            if scan_id not in self.active:
+                await self.set_cb(self.scans[scan_id].params)
+                self.stats['issued'] += 1
+                self.active.append(scan_id)
+
+    def __selection(self):
+        # Ids of the repeating scans that should be active
+        in_window = [request for request in self.scans.values()
+                     if self.__in_window(request)]
+        in_window.sort(key = lambda request: -request.priority)
+        return [request.scan_id for request in in_window[:self.max_active]]
+
+    def __in_window(self, request):
+        if request.rt_window is None:
+            return True
+        if self.retention_time is None:
+            return False
+        start, end = request.rt_window
+        return start <= self.retention_time <= end
+
+    def __expire(self, now):
+        # Removes the repeating scans at the end of their lifetime, and
+        # returns the time until the next one ends.
+        next_deadline = None
+        for scan_id, request in list(self.scans.items()):
+            if request.deadline is None:
+                continue
+            if request.deadline <= now:
+                del self.scans[scan_id]
+                self.stats['expired'] += 1
+            elif next_deadline is None or request.deadline < next_deadline:
+                next_deadline = request.deadline
+        return None if next_deadline is None else next_deadline - now
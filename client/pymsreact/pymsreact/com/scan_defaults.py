@@ -0,0 +1,203 @@
+import logging
+
+class ScanDefaults:
+    '''
+    Keeps track of the default scan parameters of the instrument, to send
+    custom scan requests as deltas against the defaults.
+
+    The server completes each custom scan request with the default scan
+    parameters. Parameters that are requested with the same value again and
+    again are promoted to defaults, after which they are left out of the
+    requests. Algorithms keep requesting against the defaults they know of:
+    when a request leaves out a promoted parameter, its original default is
+    sent explicitly.
+
+    The defaults of the server are shared by every client connected to it.
+    They are only relied on while the server accepts the updates of this
+    client, the scan broker refuses them when another of its subscribers owns
+    the defaults. The requests are then sent complete.
+
+    ...
+
+    Attributes
+    ----------
+    base : dict
+        Default parameters as known by the algorithms: the default values
+        reported by the instrument, updated by explicit default parameter
+        updates.
+    current : dict
+        Default parameters currently set on the server.
+    owned : bool
+        Whether the defaults of the server are only updated by this client,
+        so the requests can rely on them.
+    '''
+
+    # Number of consecutive requests with the same value of a parameter after
+    # which the value is promoted to default
+    PROMOTION_THRESHOLD = 3
+    # Parameters that are never promoted, since they change with each request
+    EXCLUDED_PARAMS = ['REQUEST_ID', 'PrecursorMass']
+
+    def __init__(self,
+                 possible_params = None,
+                 promotion_threshold = PROMOTION_THRESHOLD):
+        """
+        Parameters
+        ----------
+        possible_params : list
+            Possible parameters of the instrument with their default values.
+            See :func:`~instrument.InstrumentClient.get_possible_params`.
+            Without them the original defaults are unknown, and no parameter
+            is promoted.
+        promotion_threshold : int
+            Number of consecutive requests with the same value of a parameter
+            after which the value is promoted to default.
+        """
+        self.base = {}
+        for param in possible_params or []:
+            if param.get('DefaultValue') is not None:
+                self.base[param['Name']] = str(param['DefaultValue'])
+        self.current = dict(self.base)
+        # Names of the parameters whose current default differs from the
+        # base default
+        self.promoted_names = set()
+        self.promotion_threshold = promotion_threshold
+        # Parameter name -> (value, number of consecutive requests)
+        self.streaks = {}
+        self.owned = True
+        self.logger = logging.getLogger(__name__)
+
+    def track(self, request):
+        """Tracks the values of the parameters of a request, and returns the
+        parameters to promote to defaults before sending it.
+
+        Parameters
+        ----------
+        request : dict
+            String-string dictionary of scan parameters.
+
+        Returns
+        -------
+        dict
+            Parameters to promote, or None if there is nothing to promote.
+        """
+        if not self.owned:
+            return None
+        promotion = {}
+        streaks = {}
+        for name in self.__affected(request):
+            if name in self.EXCLUDED_PARAMS or name not in self.base:
+                continue
+            value = str(request.get(name, self.base[name]))
+            if value == self.current.get(name):
+                continue
+            last_value, count = self.streaks.get(name, (None, 0))
+            count = count + 1 if last_value == value else 1
+            if count >= self.promotion_threshold:
+                promotion[name] = value
+            else:
+                streaks[name] = (value, count)
+        # Streaks of parameters that are not in the request are broken.
+        self.streaks = streaks
+        return promotion or None
+
+    def encode(self, request):
+        """Returns the part of a request that differs from the defaults set
+        on the server.
+
+        Parameters
+        ----------
+        request : dict
+            String-string dictionary of scan parameters.
+
+        Returns
+        -------
+        dict
+            The parameters to send.
+        """
+        if not self.owned:
+            return self.base | request
+        delta = {name : value for name, value in request.items()
+                 if self.current.get(name) != str(value)}
+        for name in self.promoted_names:
+            if name not in request:
+                delta[name] = self.base[name]
+        return delta
+
+    def complete(self, request):
+        """Returns a request that does not rely on promoted defaults, eg. for
+        requests that are not delta encoded.
+
+        Parameters
+        ----------
+        request : dict
+            String-string dictionary of scan parameters.
+        """
+        if not self.owned:
+            return self.base | request
+        completed = dict(request)
+        for name in self.promoted_names:
+            completed.setdefault(name, self.base[name])
+        return completed
+
+    def activate(self, params):
+        """Returns the default parameters to set on the server, so the given
+        parameters are the defaults and every other parameter has its original
+        default, eg. for the requests of a scan request template.
+
+        Parameters
+        ----------
+        params : dict
+            String-string dictionary of scan parameters, with a base default.
+
+        Returns
+        -------
+        dict
+            Parameters to set, or None if the defaults are already set or are
+            not owned.
+        """
+        if not self.owned:
+            return None
+        # Requests relying on other defaults break the streaks.
+        self.streaks = {}
+        update = {name : value for name, value in params.items()
+                  if self.current.get(name) != value}
+        for name in self.promoted_names:
+            if name not in params:
+                update[name] = self.base[name]
+        return update or None
+
+    def disown(self):
+        """Registers that the server refused to update its defaults. The
+        requests are sent complete from then on, since the defaults can be
+        changed by other clients."""
+        self.owned = False
+        self.streaks = {}
+        self.logger.warning('The default scan parameters are owned by ' +
+                            'another client, sending complete requests.')
+
+    def promoted(self, params):
+        """Registers the parameters that were promoted to defaults on the
+        server, or restored to their original defaults."""
+        self.current.update(params)
+        for name, value in params.items():
+            if self.base.get(name) != value:
+                self.promoted_names.add(name)
+            else:
+                self.promoted_names.discard(name)
+        self.logger.info(f'Default scan parameters set to: {params}')
+
+    def set_defaults(self, params):
+        """Registers an explicit update of the default scan parameters."""
+        params = {name : str(value) for name, value in params.items()}
+        self.base.update(params)
+        self.current.update(params)
+        for name in params:
+            self.streaks.pop(name, None)
+            self.promoted_names.discard(name)
+
+    def __affected(self, request):
+        # Parameters whose value is defined by the request: the parameters of
+        # the request, and the promoted parameters left out of the request.
+        return list(request) + [name for name in self.promoted_names
+                                if name not in request]
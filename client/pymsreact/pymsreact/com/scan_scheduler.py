@@ -0,0 +1,237 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+class ScanRequestScheduler:
+    '''
+    Schedules the custom scan requests of the algorithms before they are sent
+    to the instrument.
+
+    Pending requests are sent by priority, and the number of requests queued
+    on the instrument is capped by its duty cycle: a request is estimated to
+    be acquired one scan time after the previous one, and no more than
+    max_queued requests are estimated to wait on the instrument at any time.
+    Requests are dropped when they expire before being sent, when they
+    duplicate a pending or queued request within the m/z tolerance, or when
+    a survey scan newer than the one they were computed from was received.
+    Queued requests of superseded survey scans are cancelled on the
+    instrument with CANCEL_CUSTOM_SCAN_CMD.
+
+    A request that fails to be sent is logged and dropped, and the scheduler
+    goes on with the next one. Dropped and cancelled requests are reported
+    to dropped_cb, so they are not counted as lost by the acquisition that
+    made them. After max_failures consecutive failures, the
+    connection is considered lost and the error is raised from run.
+
+    ...
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        Number of sent, failed, expired, duplicate and superseded requests,
+        number of cancel commands (cancelled) and of the requests they
+        cancelled (cancelled_requests), and number of failed cancel commands
+        (failed_cancels).
+    '''
+
+    # Estimated time in seconds to acquire a custom scan
+    DEFAULT_SCAN_TIME = 0.02
+    # Maximum number of requests estimated to wait on the instrument
+    DEFAULT_MAX_QUEUED = 20
+    # Tolerance in m/z within which two requests are duplicates
+    DEFAULT_MZ_TOLERANCE = 0.01
+    # Number of consecutive failures to send after which run raises
+    DEFAULT_MAX_FAILURES = 5
+
+    def __init__(self,
+                 send_cb,
+                 cancel_cb,
+                 dropped_cb = None,
+                 scan_time = DEFAULT_SCAN_TIME,
+                 max_queued = DEFAULT_MAX_QUEUED,
+                 mz_tolerance = DEFAULT_MZ_TOLERANCE,
+                 max_failures = DEFAULT_MAX_FAILURES):
+        """
+        Parameters
+        ----------
+        send_cb : coroutine function
+            Sends the parameters of a request to the instrument, eg.
+            :func:`~instrument.InstrumentClient.request_scan`.
+        cancel_cb : coroutine function
+            Cancels the custom scans queued on the instrument, eg.
+            :func:`~instrument.InstrumentClient.cancel_custom_scan`.
+        dropped_cb : function
+            Called with each ScanRequest that is dropped before being sent,
+            that failed to be sent, or that was cancelled on the instrument.
+            None if the dropped requests are not reported.
+        scan_time : float
+            Estimated time in seconds to acquire a custom scan.
+        max_queued : int
+            Maximum number of requests estimated to wait on the instrument.
+        mz_tolerance : float
+            Tolerance in m/z within which two requests are duplicates.
+        max_failures : int
+            Number of consecutive failures to send or cancel requests after
+            which run raises the last error.
+        """
+        self.send_cb = send_cb
+        self.cancel_cb = cancel_cb
+        self.dropped_cb = dropped_cb
+        self.scan_time = scan_time
+        self.max_queued = max_queued
+        self.mz_tolerance = mz_tolerance
+        self.max_failures = max_failures
+        self.failures = 0
+
+        # Heap of [-priority, sequence number, request, still valid] entries
+        self.pending = []
+        self.sequence = itertools.count()
+        # Requests sent to the instrument and estimated not acquired yet, as
+        # (estimated acquisition time, request) tuples.
+        self.queued = collections.deque()
+        self.last_survey_scan = None
+        self.cancel_requested = False
+        self.wakeup = asyncio.Event()
+        self.stats = collections.Counter()
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, request):
+        """Adds a request to the pending requests.
+
+        Parameters
+        ----------
+        request : ScanRequest
+            The request with its scheduling information.
+        """
+        if self.__is_superseded(request):
+            self.__drop(request, 'superseded')
+            return
+        if request.precursor_mz is not None:
+            self.__drop_acquired(time.monotonic())
+            for _, queued in self.queued:
+                if self.__is_duplicate(request, queued):
+                    self.__drop(request, 'duplicate')
+                    return
+            for entry in self.pending:
+                if entry[3] and self.__is_duplicate(request, entry[2]):
+                    if entry[2].priority >= request.priority:
+                        self.__drop(request, 'duplicate')
+                        return
+                    # The new request replaces the pending one.
+                    entry[3] = False
+                    self.__drop(entry[2], 'duplicate')
+        heapq.heappush(self.pending,
+                       [-request.priority, next(self.sequence), request, True])
+        self.wakeup.set()
+
+    def survey_scan_received(self, scan_number):
+        """Drops the pending requests computed from older survey scans, and
+        cancels them on the instrument if some of them might still be queued.
+
+        Parameters
+        ----------
+        scan_number : int
+            Scan number of the received survey scan.
+        """
+        self.last_survey_scan = scan_number
+        for entry in self.pending:
+            if entry[3] and self.__is_superseded(entry[2]):
+                entry[3] = False
+                self.__drop(entry[2], 'superseded')
+        self.__drop_acquired(time.monotonic())
+        if any(self.__is_superseded(request) for _, request in self.queued):
+            # All the queued requests are cancelled, not only the superseded
+            # ones.
+            for _, request in self.queued:
+                self.__drop(request, 'cancelled_requests')
+            self.queued.clear()
+            self.cancel_requested = True
+            self.wakeup.set()
+
+    async def run(self):
+        """Sends the pending requests until cancelled.
+
+        Raises
+        ------
+        Exception
+            The last error, after max_failures consecutive failures to send
+            or cancel requests.
+        """
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.pending or self.cancel_requested:
+                    if self.cancel_requested:
+                        self.cancel_requested = False
+                        try:
+                            await self.cancel_cb()
+                        except Exception as e:
+                            self.stats['failed_cancels'] += 1
+                            self.__failed('cancel the queued requests', e)
+                        else:
+                            self.stats['cancelled'] += 1
+                            self.failures = 0
+                        continue
+                    now = time.monotonic()
+                    self.__drop_acquired(now)
+                    if len(self.queued) >= self.max_queued:
+                        # Wait until the first queued request is acquired.
+                        await asyncio.sleep(self.queued[0][0] - now)
+                        continue
+                    _, _, request, valid = heapq.heappop(self.pending)
+                    if not valid:
+                        continue
+                    if ((request.deadline is not None) and
+                        (time.time() > request.deadline)):
+                        self.__drop(request, 'expired')
+                        continue
+                    acquired = max(now, self.queued[-1][0] if self.queued
+                                   else now) + self.scan_time
+                    entry = (acquired, request)
+                    self.queued.append(entry)
+                    try:
+                        await self.send_cb(request.params)
+                    except Exception as e:
+                        # The request is not on the instrument.
+                        if entry in self.queued:
+                            self.queued.remove(entry)
+                        self.__drop(request, 'failed')
+                        self.__failed('send a request', e)
+                    else:
+                        self.stats['sent'] += 1
+                        self.failures = 0
+        except asyncio.CancelledError:
+            self.logger.info(f'Scan request scheduler stopped: {dict(self.stats)}')
+
+    def __drop(self, request, reason):
+        # Counts a dropped request, and reports it.
+        self.stats[reason] += 1
+        if self.dropped_cb is not None:
+            self.dropped_cb(request)
+
+    def __failed(self, action, error):
+        # Logs a failure, and raises it once there were too many consecutive
+        # ones.
+        self.failures += 1
+        self.logger.error(f'Failed to {action} ({self.failures} consecutive ' +
+                          f'failures): {error!r}')
+        if self.failures >= self.max_failures:
+            self.logger.error(f'Scan request scheduler stopped: {dict(self.stats)}')
+            raise error
+
+    def __is_superseded(self, request):
+        return ((request.survey_scan is not None) and
+                (self.last_survey_scan is not None) and
+                (request.survey_scan < self.last_survey_scan))
+
+    def __is_duplicate(self, request, other):
+        return ((other.precursor_mz is not None) and
+                (abs(request.precursor_mz - other.precursor_mz) <= self.mz_tolerance))
+
+    def __drop_acquired(self, now):
+        while self.queued and self.queued[0][0] <= now:
+            self.queued.popleft()
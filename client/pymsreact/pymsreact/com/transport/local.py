@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import socket
+import struct
+import tempfile
+from .base import BaseTransport, TransportStates, TransportErrors, TransportException
+
+# Frames are prefixed with their length as a 4 byte big-endian integer
+FRAME_HEADER = struct.Struct('>I')
+
+# Unix domain sockets are not supported by asyncio on every platform, the
+# local TCP loopback is used instead on those platforms.
+UNIX_SOCKETS_SUPPORTED = (hasattr(socket, 'AF_UNIX') and
+                          hasattr(asyncio, 'open_unix_connection'))
+DEFAULT_UNIX_ADDRESS = os.path.join(tempfile.gettempdir(), 'msreact_broker.sock')
+DEFAULT_TCP_ADDRESS = '127.0.0.1:4650'
+DEFAULT_ADDRESS = (DEFAULT_UNIX_ADDRESS if UNIX_SOCKETS_SUPPORTED
+                   else DEFAULT_TCP_ADDRESS)
+
+def parse_local_address(address = None):
+    """Interprets the address of a local broker.
+
+    Parameters
+    ----------
+    address : str
+        Either the path of a Unix domain socket, or a "host:port" address on
+        the local TCP loopback.
+
+    Returns
+    -------
+    tuple
+        ('unix', path) or ('tcp', (host, port)).
+    """
+    if address is None:
+        address = DEFAULT_ADDRESS
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and os.sep not in address:
+        return ('tcp', (host, int(port)))
+    return ('unix', address)
+
+async def read_frame(reader):
+    """Reads a length prefixed frame from a stream.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        Stream to read the frame from.
+
+    Returns
+    -------
+    bytes
+        The content of the frame.
+    """
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length, ) = FRAME_HEADER.unpack(header)
+    return await reader.readexactly(length)
+
+def write_frame(writer, frame):
+    """Writes a length prefixed frame to a stream. The frame is only buffered,
+    the caller decides whether to wait for the stream to drain.
+
+    Parameters
+    ----------
+    writer : asyncio.StreamWriter
+        Stream to write the frame to.
+    frame : bytes
+        The content of the frame.
+    """
+    writer.write(FRAME_HEADER.pack(len(frame)))
+    writer.write(frame)
+
+class LocalTransport(BaseTransport):
+    """
+    A class implementing a transport layer towards a scan broker running on
+    the same host, using Unix domain sockets or the local TCP loopback. It
+    carries the same messages as the WebSocket transport, so the protocol and
+    the instrument client work unchanged on top of it.
+
+    ...
+
+    Attributes
+    ----------
+    address : str
+       Path of the Unix domain socket or "host:port" address of the broker.
+
+    """
+
+    def __init__(self, address = None):
+        """
+        Parameters
+        ----------
+        address : str
+            Path of the Unix domain socket or "host:port" address of the
+            broker.
+        """
+        self.address = DEFAULT_ADDRESS if address is None else address
+        self.reader = None
+        self.writer = None
+        self.state = TransportStates.DISCONNECTED
+        self.logger = logging.getLogger(__name__)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def connect(self, address = None):
+        """Connects to the broker with the given address
+        Parameters
+        ----------
+        address : str
+            Path of the Unix domain socket or "host:port" address of the
+            broker.
+        """
+        success = False
+
+        if TransportStates.DISCONNECTED == self.state:
+            if address is not None:
+                self.address = address
+            kind, location = parse_local_address(self.address)
+            try:
+                if 'unix' == kind:
+                    self.reader, self.writer = \
+                        await asyncio.open_unix_connection(location)
+                else:
+                    self.reader, self.writer = \
+                        await asyncio.open_connection(*location)
+                self.state = TransportStates.CONNECTED
+                self.logger.info(f'Connected to local broker at {self.address}')
+                success = True
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.logger.error(f'No broker is listening at {self.address}')
+        else:
+            self.logger.error('Invalid LocalTransport State - ' +
+                              f'Cannot connect to {address} when ' +
+                              'already connected!')
+        return success
+
+    async def disconnect(self):
+        """Disconnects from the broker"""
+        if self.state != TransportStates.DISCONNECTED:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.state = TransportStates.DISCONNECTED
+        else:
+            raise TransportException(
+                "Cannot disconnect from broker when already disconnected!",
+                TransportErrors.INVALID_STATE_ERROR)
+
+    async def receive(self):
+        """Listens for messages from the broker"""
+        if TransportStates.CONNECTED == self.state:
+            try:
+                message = await read_frame(self.reader)
+            except (asyncio.IncompleteReadError, ConnectionError) as ex:
+                self.logger.error(f'Lost connection to broker at {self.address}')
+                self.state = TransportStates.DISCONNECTED
+                raise TransportException("Disconnected from broker with error.",
+                                         TransportErrors.DISCONNECTION_ERROR) from ex
+        else:
+            raise TransportException(
+                "Cannot listen on local transport when not connected!",
+                TransportErrors.INVALID_STATE_ERROR)
+        return message
+
+    async def send(self, message):
+        """Sends messages to the broker
+        Parameters
+        ----------
+        message : bytes
+            Message to transport to the broker
+        """
+        if TransportStates.CONNECTED == self.state:
+            write_frame(self.writer, message)
+            await self.writer.drain()
+        else:
+            raise TransportException(
+                "Cannot send on local transport when not connected!",
+                TransportErrors.INVALID_STATE_ERROR)
@@ -3,26 +3,21 @@ import asyncio
 import json
 import logging
 import logging.config
-import com.instrument as instrument
-import com.mock as mock
-import com.protocol.msrp as msrp
-import com.transport.websocket as wst
+import os
+import com.transport.local as lt
 from datetime import datetime
 import signal
 import time
 import traceback
-from algorithms.manager.acquisition import AcqMsgIDs
 from algorithms.manager.algorithm_runner import AlgorithmManager
+from algorithms.manager.delivery import DropPolicies, DEFAULT_MAX_PENDING
 from custom_apps.manager import CustomAppManager
-from enum import IntEnum
+from session import InstrumentSession
 
 import cProfile
 
 VERSION = 'v0.0'
-
-class ClientStates(IntEnum):
-    NO_ERROR    = 0
-    ERROR       = 1
+DROP_POLICIES = [policy.name.lower() for policy in DropPolicies]
 
 class MSReactClient:
 
@@ -37,20 +32,19 @@ class MSReactClient:
         self.loop.set_exception_handler(self.custom_exception_handler)
         asyncio.set_event_loop(self.loop)
         
-        # Instantiate transport and protocol layers here. TODO: if later those 
-        # modules are selectable through the application, the instantiation
-        # can be moved to a separate function. 
-        # Instrument server manager are declared here but not yet instantiated.
-        self.transport = wst.WebSocketTransport()
-        self.protocol = msrp.MSReactProtocol(self.transport)
-        self.inst_client = None
+        # Transport and protocol layers are instantiated by the sub-commands
+        # that connect to a server, see __create_protocol.
+        self.transport = None
+        self.protocol = None
         
-        # Instantiate the algorithm and custom app managers
-        self.algo_manager = AlgorithmManager(self.algorithm_runner_cb)
+        # The default instrument session, that holds the instrument client
+        # and the algorithm manager, is created with the protocol by the
+        # sub-commands that use it, see __create_protocol. Instantiate the
+        # custom app manager.
+        self.session = None
+        AlgorithmManager.discover_algorithms()
         self.cusom_app_manager = CustomAppManager()
         
-        self.state = ClientStates.NO_ERROR
-        
     def parse_client_arguments(self):
         # Top level parser
         parser = argparse.ArgumentParser(description='MSReact python client')
@@ -61,7 +55,7 @@ class MSReactClient:
         subparsers = parser.add_subparsers(help='available sub-commands:',
                                            dest='command')
                                            
-        algorithm_choices = self.algo_manager.get_algorithm_names('releases')
+        algorithm_choices = AlgorithmManager.get_algorithm_names('releases')
         
         # Parser for sub-command "run"
         parser_run = \
@@ -71,6 +65,11 @@ class MSReactClient:
         # the middleware, or from elsewhere.
         parser_run.add_argument('address',
                                    help='address to the MSReact server')
+        parser_run.add_argument('-b', '--broker',
+                                action = 'store_true',
+                                help='connect through the local scan broker, \
+                                      the address is then the local address \
+                                      of the broker')
         parser_run.add_argument('alg', choices = algorithm_choices,
                                    metavar = 'algorithm', default = 'monitor',
                                    help=f'algorithm to use during the acquisition, \
@@ -88,9 +87,19 @@ class MSReactClient:
                                 help='sequence file exported in csv format to \
                                       enable dynamic acquisition sequence execution')
 
+        parser_run.add_argument('-f',
+                                metavar = 'follower',
+                                dest = 'followers',
+                                action = 'append',
+                                default = [],
+                                help=f'additional algorithm to run passively on \
+                                      the same scan stream, in the format \
+                                      algorithm[:drop_policy[:max_pending]], \
+                                      drop policies: {", ".join(DROP_POLICIES)}')
+
         # Parser for sub-command "proto"
         proto_choices = \
-            self.algo_manager.get_algorithm_names("prototypes")
+            AlgorithmManager.get_algorithm_names("prototypes")
         proto_choice_string = "\n".join(proto_choices)
         
         parser_proto = \
@@ -108,6 +117,16 @@ class MSReactClient:
                                 dest = 'sequence',
                                 help='sequence file exported in csv format to \
                                       enable dynamic acquisition sequence execution')
+
+        parser_proto.add_argument('-f',
+                                metavar = 'follower',
+                                dest = 'followers',
+                                action = 'append',
+                                default = [],
+                                help=f'additional algorithm to run passively on \
+                                      the same scan stream, in the format \
+                                      algorithm[:drop_policy[:max_pending]], \
+                                      drop policies: {", ".join(DROP_POLICIES)}')
                                   
         parser_proto.add_argument('alg', choices = proto_choices,
                                  metavar = 'algorithm', default = 'monitor',
@@ -120,6 +139,11 @@ class MSReactClient:
                                    instrument for prototyping new algorithms')
         parser_proto_inst.add_argument('address',
                                        help='address to the MSReact server')
+        parser_proto_inst.add_argument('-b', '--broker',
+                                       action = 'store_true',
+                                       help='connect through the local scan \
+                                       broker, the address is then the local \
+                                       address of the broker')
         
         parser_proto_mock = \
             protoparser.add_parser('mock', help= 'subcommand to use MS \
@@ -136,6 +160,42 @@ class MSReactClient:
                                        analyse the scan and decide if it \
                                        requests a custom scan')
                                        
+        # Parser for sub-command "multi"
+        parser_multi = \
+            subparsers.add_parser('multi',
+                                  help='command to run algorithms on several \
+                                  instruments concurrently')
+        parser_multi.add_argument('sessions', nargs='+',
+                                  metavar = 'session',
+                                  help=f'instrument session in the format \
+                                  algorithm@address[/instrument], algorithm \
+                                  choices: {", ".join(algorithm_choices)}')
+        parser_multi.add_argument('-c',
+                                  metavar = 'config',
+                                  dest = 'configs',
+                                  action = 'append',
+                                  default = [],
+                                  help='configuration json file to pass into \
+                                  the algorithms, given once to share it \
+                                  between the sessions, or once per session \
+                                  in the order of the sessions')
+                                  
+        # Parser for sub-command "broker"
+        parser_broker = \
+            subparsers.add_parser('broker',
+                                  help='command to share the scans of one \
+                                  MSReact server connection with several \
+                                  client processes on this computer')
+        parser_broker.add_argument('address',
+                                   help='address to the MSReact server')
+        parser_broker.add_argument('-l',
+                                   metavar = 'local_address',
+                                   dest = 'local_address',
+                                   default = lt.DEFAULT_ADDRESS,
+                                   help=f'unix socket path or host:port to \
+                                   serve the local clients on, default: \
+                                   {lt.DEFAULT_ADDRESS}')
+                                       
         # Parser for sub-command "test"
         app_choices = self.cusom_app_manager.get_app_names()
         parser_custom = \
@@ -163,152 +223,96 @@ class MSReactClient:
         
         return self.args
         
-    def instrument_client_cb(self, msg_id, args = None):
-        if (instrument.InstrMsgIDs.SCAN == msg_id):
-            self.algo_manager.deliver_scan(args)
-        elif (instrument.InstrMsgIDs.RECEIVED_RAW_FILE_NAMES == msg_id):
-            self.logger.info(f'Received recent raw file names:{args}')
-            self.algo_manager.received_recent_raw_file_names(args)
-        elif (instrument.InstrMsgIDs.FINISHED_ACQ_FILE_DOWNLOAD == msg_id):
-            self.logger.info('Received acquisition file download finished message.')
-            self.algo_manager.acquisition_file_download_finished(args)
-        elif (instrument.InstrMsgIDs.STARTED_ACQUISITION == msg_id):
-            self.logger.info('Received started acquisition message.')
-            self.algo_manager.acquisition_started()
-        elif (instrument.InstrMsgIDs.FINISHED_ACQUISITION == msg_id):
-            self.logger.info('Received finished acquisition message.')
-            self.algo_manager.acquisition_ended()
-        elif (instrument.InstrMsgIDs.ERROR == msg_id):
-            self.logger.error(f'Received error message from instrument: {args}')
-            self.algo_manager.instrument_error()
-            self.state = ClientStates.ERROR
+    @property
+    def inst_client(self):
+        return self.session.inst_client
         
-    async def algorithm_runner_cb(self, msg_id, args = None):
-        if (AcqMsgIDs.REQUEST_SCAN == msg_id):
-            await self.inst_client.request_scan(args)
-        elif (AcqMsgIDs.REQUEST_REPEATING_SCAN == msg_id):
-            pass
-        elif (AcqMsgIDs.CANCEL_REPEATING_SCAN == msg_id):
-            pass
-        elif (AcqMsgIDs.READY_FOR_ACQUISITION_START == msg_id):
-            #await self.inst_client.subscribe_to_scans()
-            self.logger.info(f'{args.get_settings_dict()}')
-            await self.inst_client.configure_acquisition(args.get_settings_dict())
-            if args is not None:
-                if args.acquisition_workflow.is_acquisition_triggering:
-                    await self.inst_client.start_acquisition()
-        elif (AcqMsgIDs.REQUEST_ACQUISITION_STOP == msg_id):
-            await self.inst_client.stop_acquisition()
-        elif (AcqMsgIDs.REQUEST_DEF_SCAN_PARAM_UPDATE == msg_id):
-            await self.inst_client.update_default_scan_params(args)
-        elif (AcqMsgIDs.SET_TX_SCAN_LEVEL == msg_id):
-            if self.args.mode == "mock":
-                await self.inst_client.set_ms_scan_tx_level(args)
-        elif (AcqMsgIDs.ERROR == msg_id):
-            self.logger.error(args)
-            # Should let the instrument manager know that there was an error in
-            # the algorithm manager.
-            await self.inst_client.instrument_clean_up()
-            self.state = ClientStates.ERROR
-        elif (AcqMsgIDs.REQUEST_RAW_FILE_NAME == msg_id):
-            await self.inst_client.request_raw_file_name()
-        elif (AcqMsgIDs.REQUEST_LAST_RAW_FILE == msg_id):
-            await self.inst_client.request_last_acquisition_file(args)
-        elif (AcqMsgIDs.SUBSCRIBE_FOR_SCANS == msg_id):
-            await self.inst_client.subscribe_to_scans()
-        elif (AcqMsgIDs.UNSUBSCRIBE_FROM_SCANS == msg_id):
-            await self.inst_client.unsubscribe_from_scans()
+    @property
+    def algo_manager(self):
+        return self.session.algo_manager
+        
+    @property
+    def state(self):
+        return self.session.state
         
     async def run_on_instrument(self, loop, args):
     
         #pr = cProfile.Profile(builtins=False)
         #pr.enable()
         
-        # Init the instrument server manager
-        self.inst_client = \
-            instrument.InstrumentClient(self.protocol,
-                                        self.instrument_client_cb)
-
-        self.logger.info(f'Instrument address: {args.address}')
-        
-        # Connect to the server
-        success = await self.inst_client.connect_to_server(args.address)
-        if success:
-            self.logger.info("Successful connection to server!")
-            # Wait a bit after connection
-            await asyncio.sleep(1)
-            
-            # Start listening for messages from the server, select instrument,
-            # and get possible parameters.
-            await self.inst_client.setup_instrument_connection(1)
-
-            # Get the type of the instrument
-            intr_type = await self.inst_client.get_instrument_type()
-
-            # Try to select the requested algorithm, and if the algorithm 
-            # selection was successful run the algorithm.
-            if self.algo_manager.select_algorithm(args.alg,
-                                                  args.config,
-                                                  intr_type,
-                                                  args.sequence):
-                await self.algo_manager.run_algorithm()
-            else:
-                self.logger.error(f"Failed loading {args.alg} workflow.")
+        # When running through the local scan broker, use the local transport
+        # instead of the WebSocket one.
+        self.__create_protocol(getattr(args, 'broker', False))
             
-            if self.state != ClientStates.ERROR:
-                await self.inst_client.instrument_clean_up()
-            self.logger.info("Client is shutting down.")
-            
-        else:
-            self.logger.error("Connection Failed")
+        followers = self.__parse_followers(args)
+        if followers is not None:
+            await self.session.run_on_instrument(args.address,
+                                                 args.alg,
+                                                 args.config,
+                                                 args.sequence,
+                                                 followers)
+        self.logger.info("Client is shutting down.")
             
         #pr.disable()
         #pr.dump_stats('output/profiling.txt')
     
     async def run_on_mock(self, loop, args):
-        # Init the mock instrument server manager
-        self.inst_client = \
-            mock.MockClient(self.protocol,
-                            self.instrument_client_cb)
-                                               
-        self.inst_client.create_mock_server(args.raw_files,
-                                            args.scan_interval)
-
-        success = await self.inst_client.connect_to_server()
+        self.__create_protocol()
+        followers = self.__parse_followers(args)
+        if followers is not None:
+            await self.session.run_on_mock(args.raw_files,
+                                           args.scan_interval,
+                                           args.alg,
+                                           args.config,
+                                           args.sequence,
+                                           followers)
+        self.logger.info("Client is shutting down.")
         
-        if success:
-            self.logger.info("Successful connection to server!")
-            # Wait a bit after connection
-            await asyncio.sleep(1)
+    async def run_multi(self, loop, args):
+        # Each instrument gets its own session with its own connection, 
+        # algorithm worker processes and metrics, all of them running
+        # concurrently on this event loop.
+        if len(args.configs) > 1 and len(args.configs) != len(args.sessions):
+            self.logger.error(f'{len(args.configs)} configurations given for ' +
+                              f'{len(args.sessions)} instrument sessions.')
+            return
+        # One configuration per session, or a single one shared by all
+        configs = (args.configs if len(args.configs) > 1
+                   else (args.configs or [None]) * len(args.sessions))
+        sessions = []
+        for spec, config in zip(args.sessions, configs):
+            try:
+                algorithm, address, inst_num = self.__parse_session(spec)
+            except ValueError:
+                self.logger.error(f'Invalid instrument session: {spec}')
+                return
+            protocol = self.__create_protocol(default_session = False)
+            session = InstrumentSession(f'{address}/{inst_num}',
+                                        protocol,
+                                        inst_num)
+            sessions.append(session.run_on_instrument(address,
+                                                      algorithm,
+                                                      config))
+        self.logger.info(f'Running {len(sessions)} instrument sessions.')
+        await asyncio.gather(*sessions)
+        self.logger.info("Client is shutting down.")
             
-            # Start listening for messages from the server, select instrument,
-            # and get possible parameters.
-            await self.inst_client.setup_instrument_connection(1)
-
-            # Get the type of the instrument
-            intr_type = await self.inst_client.get_instrument_type()
-
-            if self.algo_manager.select_algorithm(args.alg,
-                                                  args.config,
-                                                  intr_type,
-                                                  args.sequence):
-                await self.algo_manager.run_algorithm()
-            else:
-                self.logger.error(f"Failed loading {args.alg} workflow.")
-                self.inst_client.terminate_mock_server()
-                
-            self.logger.info("Unsubscribe from scans.")
-            await self.inst_client.unsubscribe_from_scans()
-            self.logger.info("Stop the listening loop.")
-            listening_task.cancel()
-            self.logger.info("Request shut down of mock server.")
-            await self.inst_client.request_shut_down_server()
-            self.logger.info("Client is shutting down.")
+    async def run_broker(self, loop, args):
+        # The broker holds the only connection to the server and shares it
+        # with the local clients.
+        import com.broker as broker
+        scan_broker = broker.ScanBroker(self.__create_protocol(),
+                                        args.local_address)
+        self.logger.info(f'Instrument address: {args.address}')
+        if await scan_broker.start(args.address):
+            self.logger.info("Successful connection to server!")
+            await scan_broker.serve_forever()
         else:
             self.logger.error("Connection Failed")
-            self.inst_client.terminate_mock_server()
             
     async def test_app(self, loop, args):
+        import com.instrument as instrument
+        self.__create_protocol()
         test = self.algo_manager.find_custom_test_by_name(args.suite, "test_algorithms")
         if test is not None:
             # It is a custom test
@@ -317,21 +321,17 @@ class MSReactClient:
         else:
             # It must be an algorithm
             # Init the instrument server manager
-            self.inst_client = \
+            self.session.inst_client = \
                 instrument.InstrumentClient(self.protocol,
-                                            self.instrument_client_cb)
+                                            self.session.instrument_client_cb)
 
             self.logger.info(f'Instrument address: {args.address}')
             success = await self.inst_client.connect_to_server(args.address)
             if success:
                 self.logger.info("Successful connection to server!")
-                # Wait a bit after connection
-                await asyncio.sleep(1)
                 
                 await self.inst_client.setup_instrument_connection(1)
-
-                # Get the type of the instrument
-                intr_type = await self.inst_client.get_instrument_type()
+                intr_type = self.inst_client.instrument_type
 
                 if self.algo_manager.select_algorithm(args.suite, args.config, intr_type):
                     await self.algo_manager.run_algorithm()
@@ -349,9 +349,58 @@ class MSReactClient:
             else:
                 self.logger.error("Connection Failed")
             
+    def __create_protocol(self, broker = False, default_session = True):
+        """Creates the transport and protocol layers. The modules are imported
+        here, so that the sub-commands that don't connect to a server don't
+        load them."""
+        import com.protocol.msrp as msrp
+        if broker:
+            transport = lt.LocalTransport()
+        else:
+            import com.transport.websocket as wst
+            transport = wst.WebSocketTransport()
+        protocol = msrp.MSReactProtocol(transport)
+        if default_session:
+            self.transport = transport
+            self.protocol = protocol
+            self.session = InstrumentSession('instrument', protocol)
+        return protocol
+        
+    def __parse_followers(self, args):
+        """Parses the follower algorithms given on the command line into a
+        list of (algorithm, drop_policy, max_pending) tuples. Returns None if
+        any of them is invalid."""
+        followers = []
+        for follower in args.followers:
+            try:
+                followers.append(self.__parse_follower(follower))
+            except (KeyError, ValueError):
+                self.logger.error(f'Invalid follower algorithm: {follower}')
+                return None
+        return followers
+        
+    def __parse_follower(self, follower):
+        fields = follower.split(':')
+        name = fields[0]
+        if AlgorithmManager.find_by_name(name) is None:
+            raise KeyError(name)
+        drop_policy = (DropPolicies[fields[1].upper()] if 1 < len(fields) 
+                       else DropPolicies.DROP_OLDEST)
+        max_pending = int(fields[2]) if 2 < len(fields) else DEFAULT_MAX_PENDING
+        return name, drop_policy, max_pending
+        
+    def __parse_session(self, spec):
+        # Format: algorithm@address[/instrument]
+        algorithm, separator, location = spec.partition('@')
+        if not separator or AlgorithmManager.find_by_name(algorithm) is None:
+            raise ValueError(spec)
+        address, separator, inst_num = location.partition('/')
+        return algorithm, address, int(inst_num) if separator else 1
+            
     def __load_log_config(self):
         config = {}
-        with open("pymsreact\\log_conf.json", "r", encoding="utf-8") as fd:
+        log_conf = os.path.join(os.path.dirname(__file__), 'log_conf.json')
+        with open(log_conf, "r", encoding="utf-8") as fd:
             config = json.load(fd)
             config["handlers"]["file"]["filename"] = \
                 config["handlers"]["file"]["filename"] \
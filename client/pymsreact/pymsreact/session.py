@@ -0,0 +1,369 @@
+import asyncio
+import collections
+import logging
+import com.instrument as instrument
+from com.repeating_scans import RepeatingScanManager
+from com.scan_scheduler import ScanRequestScheduler
+from algorithms.manager.acquisition import AcqMsgIDs, ScanFields
+from algorithms.manager.algorithm_runner import AlgorithmManager
+from algorithms.manager.algorithm_fanout import AlgorithmFanOut
+from enum import IntEnum
+
+class ClientStates(IntEnum):
+    NO_ERROR    = 0
+    ERROR       = 1
+
+class InstrumentSession:
+    '''
+    This module is responsible for a single instrument session: the connection
+    to the instrument through its instrument client and the algorithms running
+    on it. Several sessions can run concurrently on the same event loop, each
+    of them with its own connection, worker processes and metrics.
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        Name of the session, used to identify the session in the logs.
+    protocol: BaseProtocol
+        Protocol to use for the communication with the server.
+    inst_num : int
+        The id of the instrument to select on the server.
+    metrics : collections.Counter
+        Number of messages exchanged in the session by message type.
+    scheduler : ScanRequestScheduler
+        Scheduler of the custom scan requests of the algorithms.
+    repeating_scans : RepeatingScanManager
+        Manager of the repeating scans requested by the algorithms.
+    '''
+
+    def __init__(self, name, protocol, inst_num = 1):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the session, used to identify the session in the logs.
+        protocol: BaseProtocol
+            Protocol to use for the communication with the server.
+        inst_num : int
+            The id of the instrument to select on the server.
+        """
+        self.name = name
+        self.protocol = protocol
+        self.inst_num = inst_num
+        self.inst_client = None
+        self.scheduler = None
+        self.repeating_scans = None
+        self.is_mock = False
+        self.algo_manager = AlgorithmManager(self.algorithm_runner_cb)
+        self.state = ClientStates.NO_ERROR
+        self.metrics = collections.Counter()
+        self.logger = logging.getLogger(f'{__name__}.{name}')
+
+    def instrument_client_cb(self, msg_id, args = None):
+        self.metrics[msg_id.name] += 1
+        if (instrument.InstrMsgIDs.SCAN == msg_id):
+            if ((self.scheduler is not None) and
+                (1 == args[ScanFields.MS_SCAN_LEVEL])):
+                self.scheduler.survey_scan_received(args[ScanFields.SCAN_NUMBER])
+                self.repeating_scans.retention_time_changed(
+                    args[ScanFields.RETENTION_TIME])
+            self.algo_manager.deliver_scan(args)
+        elif (instrument.InstrMsgIDs.RECEIVED_RAW_FILE_NAMES == msg_id):
+            self.logger.info(f'Received recent raw file names:{args}')
+            self.algo_manager.received_recent_raw_file_names(args)
+        elif (instrument.InstrMsgIDs.FINISHED_ACQ_FILE_DOWNLOAD == msg_id):
+            self.logger.info('Received acquisition file download finished message.')
+            self.algo_manager.acquisition_file_download_finished(args)
+        elif (instrument.InstrMsgIDs.STARTED_ACQUISITION == msg_id):
+            self.logger.info('Received started acquisition message.')
+            self.algo_manager.acquisition_started()
+        elif (instrument.InstrMsgIDs.FINISHED_ACQUISITION == msg_id):
+            self.logger.info('Received finished acquisition message.')
+            self.algo_manager.acquisition_ended()
+        elif (instrument.InstrMsgIDs.ERROR == msg_id):
+            self.logger.error(f'Received error message from instrument: {args}')
+            self.algo_manager.instrument_error()
+            self.state = ClientStates.ERROR
+
+    async def algorithm_runner_cb(self, msg_id, args = None):
+        self.metrics[msg_id.name] += 1
+        if (AcqMsgIDs.REQUEST_SCAN == msg_id):
+            if self.scheduler is not None:
+                self.scheduler.submit(args)
+            else:
+                await self.inst_client.request_scan(args.params)
+        elif (AcqMsgIDs.REQUEST_REPEATING_SCAN == msg_id):
+            self.repeating_scans.add(args)
+        elif (AcqMsgIDs.CANCEL_REPEATING_SCAN == msg_id):
+            self.repeating_scans.remove(args)
+        elif (AcqMsgIDs.READY_FOR_ACQUISITION_START == msg_id):
+            #await self.inst_client.subscribe_to_scans()
+            self.logger.info(f'{args.get_settings_dict()}')
+            await self.inst_client.configure_acquisition(args.get_settings_dict())
+            if args is not None:
+                if args.acquisition_workflow.is_acquisition_triggering:
+                    await self.inst_client.start_acquisition()
+        elif (AcqMsgIDs.REQUEST_ACQUISITION_STOP == msg_id):
+            await self.inst_client.stop_acquisition()
+        elif (AcqMsgIDs.REQUEST_DEF_SCAN_PARAM_UPDATE == msg_id):
+            await self.inst_client.update_default_scan_params(args)
+        elif (AcqMsgIDs.REGISTER_SCAN_TEMPLATE == msg_id):
+            await self.inst_client.register_scan_template(*args)
+        elif (AcqMsgIDs.SET_TX_SCAN_LEVEL == msg_id):
+            if self.is_mock:
+                await self.inst_client.set_ms_scan_tx_level(args)
+        elif (AcqMsgIDs.ERROR == msg_id):
+            self.logger.error(args)
+            # Should let the instrument manager know that there was an error in
+            # the algorithm manager.
+            await self.inst_client.instrument_clean_up()
+            self.state = ClientStates.ERROR
+        elif (AcqMsgIDs.REQUEST_RAW_FILE_NAME == msg_id):
+            await self.inst_client.request_raw_file_name()
+        elif (AcqMsgIDs.REQUEST_LAST_RAW_FILE == msg_id):
+            await self.inst_client.request_last_acquisition_file(args)
+        elif (AcqMsgIDs.SUBSCRIBE_FOR_SCANS == msg_id):
+            await self.inst_client.subscribe_to_scans()
+        elif (AcqMsgIDs.UNSUBSCRIBE_FROM_SCANS == msg_id):
+            await self.inst_client.unsubscribe_from_scans()
+
+    def select_algorithms(self,
+                          algorithm,
+                          fconf,
+                          instrument_type,
+                          exp_seq_file = None,
+                          followers = ()):
+        """Selects the algorithm to run in the session, and the follower
+        algorithms that run passively on the same scan stream if any.
+
+        Parameters
+        ----------
+        algorithm : str
+            Name of the algorithm that is selected to be run.
+        fconf : str
+            Configuration file of the algorithm.
+        instrument_type : str
+            Type of the available instrument.
+        exp_seq_file : str
+            Exported sequence file of the algorithm.
+        followers : list
+            List of (algorithm, drop_policy, max_pending) tuples of the
+            follower algorithms.
+
+        Returns
+        -------
+        bool
+            True if all the algorithms were selected successfully.
+        """
+        possible_params = (None if self.inst_client is None
+                           else self.inst_client.possible_params)
+        success = self.algo_manager.select_algorithm(algorithm,
+                                                     fconf,
+                                                     instrument_type,
+                                                     exp_seq_file,
+                                                     possible_params)
+        if success and followers:
+            fan_out = AlgorithmFanOut(self.algo_manager)
+            for name, drop_policy, max_pending in followers:
+                success = fan_out.add_follower(name,
+                                               None,
+                                               instrument_type,
+                                               drop_policy = drop_policy,
+                                               max_pending = max_pending)
+                if not success:
+                    break
+            self.algo_manager = fan_out
+        return success
+
+    async def run_on_instrument(self,
+                                address,
+                                algorithm,
+                                fconf = None,
+                                exp_seq_file = None,
+                                followers = ()):
+        """Connects to the instrument and runs the selected algorithm on it.
+
+        Parameters
+        ----------
+        address : str
+            Address of the server to connect to.
+        algorithm : str
+            Name of the algorithm to run.
+        fconf : str
+            Configuration file of the algorithm.
+        exp_seq_file : str
+            Exported sequence file of the algorithm.
+        followers : list
+            List of (algorithm, drop_policy, max_pending) tuples of the
+            follower algorithms.
+        """
+        # Init the instrument server manager
+        self.inst_client = \
+            instrument.InstrumentClient(self.protocol,
+                                        self.instrument_client_cb)
+
+        self.logger.info(f'Instrument address: {address}')
+
+        # Connect to the server
+        success = await self.inst_client.connect_to_server(address)
+        if success:
+            self.logger.info("Successful connection to server!")
+
+            # Start listening for messages from the server, wait until the
+            # server is ready, select the instrument and collect its metadata,
+            # among others the type of the instrument.
+            await self.inst_client.setup_instrument_connection(self.inst_num)
+            intr_type = self.inst_client.instrument_type
+            request_tasks = self.__start_request_handling()
+
+            # Try to select the requested algorithm, and if the algorithm
+            # selection was successful run the algorithm.
+            selected = self.select_algorithms(algorithm,
+                                              fconf,
+                                              intr_type,
+                                              exp_seq_file,
+                                              followers)
+            ran = False
+            if selected:
+                ran = await self.__run_algorithms()
+            else:
+                self.logger.error(f"Failed loading {algorithm} workflow.")
+            await self.__stop_request_handling(request_tasks)
+
+            if self.state != ClientStates.ERROR:
+                await self.inst_client.instrument_clean_up()
+            if selected and not ran:
+                # The algorithms were not run since the instrument metadata
+                # was out of date.
+                self.state = ClientStates.ERROR
+            self.logger.info(f'Session metrics: {dict(self.metrics)}')
+            self.logger.info("Session is shutting down.")
+
+        else:
+            self.logger.error("Connection Failed")
+
+    async def run_on_mock(self,
+                          raw_files,
+                          scan_interval,
+                          algorithm,
+                          fconf = None,
+                          exp_seq_file = None,
+                          followers = ()):
+        """Starts a mock server replaying the given raw files and runs the
+        selected algorithm on it.
+
+        Parameters
+        ----------
+        raw_files : list
+            List of raw files to replay by the mock server.
+        scan_interval : int
+            Interval in milliseconds between two transmitted scans.
+        algorithm : str
+            Name of the algorithm to run.
+        fconf : str
+            Configuration file of the algorithm.
+        exp_seq_file : str
+            Exported sequence file of the algorithm.
+        followers : list
+            List of (algorithm, drop_policy, max_pending) tuples of the
+            follower algorithms.
+        """
+        # Init the mock instrument server manager
+        import com.mock as mock
+        self.is_mock = True
+        self.inst_client = \
+            mock.MockClient(self.protocol,
+                            self.instrument_client_cb)
+
+        self.inst_client.create_mock_server(raw_files, scan_interval)
+
+        success = await self.inst_client.connect_to_server()
+
+        if success:
+            self.logger.info("Successful connection to server!")
+
+            # Start listening for messages from the server, wait until the
+            # server is ready, select the instrument and collect its metadata,
+            # among others the type of the instrument.
+            await self.inst_client.setup_instrument_connection(self.inst_num)
+            intr_type = self.inst_client.instrument_type
+            request_tasks = self.__start_request_handling()
+
+            selected = self.select_algorithms(algorithm,
+                                              fconf,
+                                              intr_type,
+                                              exp_seq_file,
+                                              followers)
+            ran = False
+            if selected:
+                ran = await self.__run_algorithms()
+            else:
+                self.logger.error(f"Failed loading {algorithm} workflow.")
+            if not ran:
+                self.inst_client.terminate_mock_server()
+            if selected and not ran:
+                self.state = ClientStates.ERROR
+            await self.__stop_request_handling(request_tasks)
+
+            self.logger.info("Unsubscribe from scans.")
+            await self.inst_client.unsubscribe_from_scans()
+            self.logger.info("Stop the listening loop.")
+            self.inst_client.listening_task.cancel()
+            self.logger.info("Request shut down of mock server.")
+            await self.inst_client.request_shut_down_server()
+            self.logger.info(f'Session metrics: {dict(self.metrics)}')
+            self.logger.info("Session is shutting down.")
+        else:
+            self.logger.error("Connection Failed")
+            self.inst_client.terminate_mock_server()
+
+    async def __run_algorithms(self):
+        # Runs the selected algorithms once the metadata of the instrument
+        # they were selected with is confirmed, since it may come from a
+        # snapshot that is checked against the server in the meantime.
+        # Returns whether the algorithms were run.
+        if await self.inst_client.validate_metadata():
+            await self.algo_manager.run_algorithm()
+            return True
+        self.logger.error('The instrument metadata could not be confirmed, ' +
+                          'the algorithms are not run.')
+        return False
+
+    def __start_request_handling(self):
+        # The custom scan requests of the algorithms go through the scheduler,
+        # and the repeating scans through the repeating scan manager.
+        self.scheduler = ScanRequestScheduler(self.inst_client.request_scan,
+                                              self.inst_client.cancel_custom_scan,
+                                              self.__scan_request_dropped)
+        self.repeating_scans = \
+            RepeatingScanManager(self.inst_client.request_repeating_scan,
+                                 self.inst_client.cancel_repeating_scan)
+        loop = asyncio.get_running_loop()
+        tasks = [loop.create_task(self.scheduler.run()),
+                 loop.create_task(self.repeating_scans.run())]
+        for task in tasks:
+            task.add_done_callback(self.__request_handling_done)
+        return tasks
+
+    def __scan_request_dropped(self, request):
+        # The acquisition does not count the dropped requests as lost.
+        if request.request_id is not None:
+            self.algo_manager.scan_request_dropped(request.request_id)
+
+    def __request_handling_done(self, task):
+        # The scheduler and the repeating scan manager only stop on their own
+        # when the instrument cannot be reached anymore.
+        if task.cancelled() or task.exception() is None:
+            return
+        self.logger.error(f'Scan request handling stopped: {task.exception()!r}')
+        self.algo_manager.instrument_error()
+        self.state = ClientStates.ERROR
+
+    async def __stop_request_handling(self, tasks):
+        # The repeating scans are cleared on the instrument when the manager
+        # stops.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
@@ -0,0 +1,160 @@
+import ast
+import importlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Folder of the discovery manifests
+CACHE_DIR = os.path.join('output', 'cache')
+MANIFEST_VERSION = 1
+
+# Marker of a name attribute whose value is not a literal
+_DYNAMIC = object()
+# Marker of a class deriving from the base class without its own name
+_INHERITED = object()
+
+def discover(folder, import_prefix, base_class, name_attr, manifest_name):
+    """Finds the classes deriving from a base class in the modules of a folder
+    without importing the modules. The source files are parsed instead, and
+    the result is kept in a manifest that is only rebuilt when a file of the
+    folder is added, removed or modified.
+
+    Parameters
+    ----------
+    folder : str
+        Folder of the modules to search through.
+    import_prefix : str
+        Prefix of the import name of the modules in the folder, eg.
+        "algorithms.prototypes".
+    base_class : str
+        Name of the base class the discovered classes derive from.
+    name_attr : str
+        Name of the class attribute holding the name of the discovered class,
+        eg. "ALGORITHM_NAME".
+    manifest_name : str
+        File name of the manifest in the cache folder.
+
+    Returns
+    -------
+    list
+        List of dictionaries with the keys "name", "class", "module" and
+        "hocon", the latter being the path of the configuration file next to
+        the module, or None if there is none.
+    """
+    files = _list_files(folder)
+    manifest_path = os.path.join(CACHE_DIR, manifest_name)
+    manifest = _load_manifest(manifest_path)
+    if ((manifest is not None) and
+        (manifest['version'] == MANIFEST_VERSION) and
+        (manifest['files'] == files)):
+        return manifest['entries']
+
+    entries = []
+    for file_name in sorted(files):
+        module_name, extension = os.path.splitext(file_name)
+        if '.py' != extension or '__init__' == module_name:
+            continue
+        entries.extend(_scan_module(os.path.join(folder, file_name),
+                                    f'{import_prefix}.{module_name}',
+                                    base_class,
+                                    name_attr,
+                                    files))
+    _save_manifest(manifest_path, {'version' : MANIFEST_VERSION,
+                                   'files' : files,
+                                   'entries' : entries})
+    return entries
+
+def load_class(entry):
+    """Imports the module of a discovered class and returns the class.
+
+    Parameters
+    ----------
+    entry : dict
+        Entry returned by :func:`discover`.
+    """
+    module = importlib.import_module(entry['module'])
+    return getattr(module, entry['class'])
+
+def _list_files(folder):
+    files = {}
+    if os.path.isdir(folder):
+        for item in os.scandir(folder):
+            if item.is_file() and item.name.endswith(('.py', '.hocon')):
+                files[item.name] = item.stat().st_mtime_ns
+    return files
+
+def _scan_module(path, module_name, base_class, name_attr, files):
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+
+    # Collect the classes of the module with their base classes and the
+    # literal value of their name attribute.
+    classes = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            bases = [base.id if isinstance(base, ast.Name) else
+                     base.attr if isinstance(base, ast.Attribute) else None
+                     for base in node.bases]
+            classes[node.name] = (bases, _class_constant(node, name_attr))
+
+    entries = []
+    for class_name in classes:
+        name = _resolve_name(class_name, classes, base_class, set())
+        if name is None:
+            continue
+        if name is _DYNAMIC:
+            # The name is not a literal, the module has to be imported.
+            name = getattr(load_class({'module' : module_name,
+                                       'class' : class_name}), name_attr)
+        hocon = os.path.splitext(os.path.basename(path))[0] + '.hocon'
+        entries.append({'name' : name,
+                        'class' : class_name,
+                        'module' : module_name,
+                        'hocon' : (os.path.join(os.path.dirname(path), hocon)
+                                   if hocon in files else None)})
+    return entries
+
+def _class_constant(node, name_attr):
+    for statement in node.body:
+        if (isinstance(statement, ast.Assign) and
+            any(isinstance(target, ast.Name) and name_attr == target.id
+                for target in statement.targets)):
+            if (isinstance(statement.value, ast.Constant) and
+                isinstance(statement.value.value, str)):
+                return statement.value.value
+            return _DYNAMIC
+    return _INHERITED
+
+def _resolve_name(class_name, classes, base_class, visited):
+    # Returns the name of a class deriving, directly or through other classes
+    # of the same module, from the base class, or None for any other class.
+    if class_name in visited or class_name not in classes:
+        return None
+    visited.add(class_name)
+    bases, name = classes[class_name]
+    for base in bases:
+        if base_class == base:
+            return _DYNAMIC if name is _INHERITED else name
+        inherited = _resolve_name(base, classes, base_class, visited)
+        if inherited is not None:
+            return inherited if name is _INHERITED else name
+    return None
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_manifest(path, manifest):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning(f'Could not save discovery manifest: {e}')
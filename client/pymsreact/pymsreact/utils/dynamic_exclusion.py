@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import numpy as np
+
+class DynamicExclusion:
+    """
+    Dynamic exclusion list of precursors, that excludes the m/z values of the
+    recently selected precursors for a given time.
+
+    The excluded m/z values are kept sorted, so checking k candidates takes
+    O(k log n) binary searches over the n excluded m/z values. The exclusions
+    are also kept in a heap by their expiry time, so expiring them only looks
+    at the expired ones. Precursors are added and checked in batches, with
+    the arrays of the candidates of a survey scan.
+
+    The times are given by the caller, eg. the retention times of the survey
+    scans in minutes, and the duration of the exclusion is in the same unit.
+
+    ...
+
+    Attributes
+    ----------
+    duration : float
+        Default duration of the exclusion.
+    tolerance : float
+        Tolerance in m/z, or in ppm if ppm is True.
+    ppm : bool
+        True if the tolerance is given in ppm.
+    charge_aware : bool
+        True if precursors are only excluded by exclusions of the same charge.
+        Precursors or exclusions of unknown charge (0) match any charge.
+    """
+
+    # Default tolerance in ppm
+    DEFAULT_TOLERANCE = 10
+
+    def __init__(self,
+                 duration,
+                 tolerance = DEFAULT_TOLERANCE,
+                 ppm = True,
+                 charge_aware = False):
+        """
+        Parameters
+        ----------
+        duration : float
+            Default duration of the exclusion.
+        tolerance : float
+            Tolerance in m/z, or in ppm if ppm is True. m/z values are
+            excluded when they are closer than the tolerance to an excluded
+            m/z.
+        ppm : bool
+            True if the tolerance is given in ppm.
+        charge_aware : bool
+            True if precursors are only excluded by exclusions of the same
+            charge.
+        """
+        self.duration = duration
+        self.tolerance = tolerance
+        self.ppm = ppm
+        self.charge_aware = charge_aware
+        # Excluded m/z values in ascending order, with the key and the charge
+        # of each exclusion
+        self.__mzs = np.empty(0, dtype = np.float64)
+        self.__keys = np.empty(0, dtype = np.int64)
+        self.__charges = np.empty(0, dtype = np.int64)
+        # Heap of (expiry time, key) tuples
+        self.__expiries = []
+        self.__key_counter = itertools.count()
+
+    def __len__(self):
+        return len(self.__mzs)
+
+    def add(self, mzs, time, charges = None, duration = None):
+        """Excludes m/z values from the given time.
+
+        Parameters
+        ----------
+        mzs : array_like
+            m/z values to exclude.
+        time : float
+            Start time of the exclusion.
+        charges : array_like
+            Charges of the precursors, 0 if unknown. If None, the charges are
+            unknown.
+        duration : float
+            Duration of the exclusion. If None, the default duration is used.
+        """
+        mzs = np.asarray(mzs, dtype = np.float64).ravel()
+        if 0 == len(mzs):
+            return
+        charges = (np.zeros(len(mzs), dtype = np.int64) if charges is None
+                   else np.asarray(charges, dtype = np.int64).ravel())
+        keys = np.fromiter(itertools.islice(self.__key_counter, len(mzs)),
+                           dtype = np.int64, count = len(mzs))
+        expiry = time + (self.duration if duration is None else duration)
+        for key in keys.tolist():
+            heapq.heappush(self.__expiries, (expiry, key))
+
+        # Merge the new m/z values into the sorted ones.
+        order = np.argsort(mzs, kind = 'stable')
+        positions = np.searchsorted(self.__mzs, mzs[order])
+        self.__mzs = np.insert(self.__mzs, positions, mzs[order])
+        self.__keys = np.insert(self.__keys, positions, keys[order])
+        self.__charges = np.insert(self.__charges, positions, charges[order])
+
+    def expire(self, time):
+        """Removes the exclusions that expired by the given time.
+
+        Parameters
+        ----------
+        time : float
+            Current time.
+
+        Returns
+        -------
+        int
+            Number of removed exclusions.
+        """
+        expired = []
+        while self.__expiries and self.__expiries[0][0] <= time:
+            expired.append(heapq.heappop(self.__expiries)[1])
+        if expired:
+            kept = ~np.isin(self.__keys, expired)
+            self.__mzs = self.__mzs[kept]
+            self.__keys = self.__keys[kept]
+            self.__charges = self.__charges[kept]
+        return len(expired)
+
+    def excluded(self, mzs, charges = None):
+        """Returns which m/z values are excluded.
+
+        Parameters
+        ----------
+        mzs : array_like
+            m/z values to check.
+        charges : array_like
+            Charges of the precursors, 0 if unknown. Only used if the
+            exclusion is charge aware.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, True where the m/z value is excluded.
+        """
+        mzs = np.asarray(mzs, dtype = np.float64)
+        tolerance = self.tolerance * 1e-6 * mzs if self.ppm else self.tolerance
+        # Excluded m/z values strictly within the tolerance are in [low, high)
+        low = np.searchsorted(self.__mzs, mzs - tolerance, side = 'right')
+        high = np.searchsorted(self.__mzs, mzs + tolerance, side = 'left')
+        mask = high > low
+        if (not self.charge_aware) or (charges is None):
+            return mask
+        charges = np.asarray(charges, dtype = np.int64)
+        for i in np.flatnonzero(mask & (charges != 0)).tolist():
+            window = self.__charges[low[i]:high[i]]
+            mask[i] = bool(np.any((window == charges[i]) | (window == 0)))
+        return mask
+
+    def clear(self):
+        """Removes all exclusions."""
+        self.__mzs = self.__mzs[:0]
+        self.__keys = self.__keys[:0]
+        self.__charges = self.__charges[:0]
+        self.__expiries = []
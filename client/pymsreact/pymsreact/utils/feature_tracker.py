@@ -0,0 +1,326 @@
+import collections
+import itertools
+import numpy as np
+
+# Feature of a precursor, followed across consecutive survey scans.
+#   feature_id - Id of the feature
+#   mz - Intensity weighted mean m/z of the feature
+#   charge - Charge of the feature, 0 if unknown
+#   start_rt - Retention time of the first scan of the feature in minutes
+#   end_rt - Retention time of the last scan of the feature in minutes
+#   apex_rt - Retention time of the most intense scan of the feature
+#   apex_intensity - Intensity of the feature in its most intense scan
+#   rts - Retention times of the scans of the feature, within the profile
+#         length of the tracker
+#   intensities - Intensities of the feature in these scans
+#   triggered - True if the feature was marked as triggered
+Feature = collections.namedtuple('Feature',
+                                 ['feature_id',
+                                  'mz',
+                                  'charge',
+                                  'start_rt',
+                                  'end_rt',
+                                  'apex_rt',
+                                  'apex_intensity',
+                                  'rts',
+                                  'intensities',
+                                  'triggered'])
+
+class FeatureTracker:
+    """
+    Follows the peaks of consecutive survey scans, linking them into
+    features, as the scans are received.
+
+    The open features are kept in arrays sorted by m/z. The centroids of a
+    scan are linked to the closest open feature within the tolerance, with
+    one binary search per centroid, so linking a scan costs O(centroids *
+    log(features)). When several centroids match the same feature, the most
+    intense one extends it and the others start new features. Features that
+    are not extended for more than max_gap scans are closed and returned. The
+    new features, and the few extended ones that moved out of m/z order, are
+    merged into the open features at their binary searched positions, so
+    updating the arrays costs O(features + centroids * log(features)).
+
+    The intensity profiles of the features are kept for the last
+    profile_length scans, as the feature ids and intensities linked in each
+    scan.
+
+    ...
+
+    Attributes
+    ----------
+    tolerance : float
+        Tolerance of the m/z match in ppm.
+    max_gap : int
+        Number of consecutive scans a feature may be missing from before it
+        is closed.
+    min_scans : int
+        Minimal number of scans of the closed features that are returned.
+    """
+
+    # Default tolerance of the m/z match in ppm
+    DEFAULT_TOLERANCE = 10
+    # Default number of scans a feature may be missing from
+    DEFAULT_MAX_GAP = 2
+    # Default number of scans the profiles are kept for
+    DEFAULT_PROFILE_LENGTH = 200
+    # Default minimal number of scans of the returned features
+    DEFAULT_MIN_SCANS = 3
+
+    # Fields of the open features, with their types
+    FIELDS = {'feature_id' : np.int64,
+              'mz' : np.float64,
+              'charge' : np.int64,
+              'start_rt' : np.float64,
+              'start_scan' : np.int64,
+              'last_rt' : np.float64,
+              'last_scan' : np.int64,
+              'last_intensity' : np.float64,
+              'apex_rt' : np.float64,
+              'apex_scan' : np.int64,
+              'apex_intensity' : np.float64,
+              'total_intensity' : np.float64,
+              'scans' : np.int64,
+              'triggered' : bool}
+
+    def __init__(self,
+                 tolerance = DEFAULT_TOLERANCE,
+                 max_gap = DEFAULT_MAX_GAP,
+                 profile_length = DEFAULT_PROFILE_LENGTH,
+                 min_scans = DEFAULT_MIN_SCANS):
+        """
+        Parameters
+        ----------
+        tolerance : float
+            Tolerance of the m/z match in ppm.
+        max_gap : int
+            Number of consecutive scans a feature may be missing from before
+            it is closed.
+        profile_length : int
+            Number of scans the intensity profiles are kept for.
+        min_scans : int
+            Minimal number of scans of the closed features that are returned.
+            Shorter features, mostly noise, are dropped.
+        """
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.min_scans = min_scans
+        # Arrays of the fields of the open features, sorted by m/z
+        self.__features = {name : np.empty(0, dtype = dtype)
+                           for name, dtype in self.FIELDS.items()}
+        # Retention time, linked feature ids and their intensities of the
+        # last scans
+        self.__profiles = collections.deque(maxlen = profile_length)
+        self.__ids = itertools.count()
+        self.__scan = -1
+
+    def __len__(self):
+        return len(self.__features['feature_id'])
+
+    def add_scan(self, mzs, intensities, rt, charges = None):
+        """Links the centroids of a survey scan to the open features, and
+        closes the features that have been missing for too long.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            m/z values of the centroids to follow, eg. the precursor
+            candidates of the scan.
+        intensities : numpy.ndarray
+            Intensities of the centroids.
+        rt : float
+            Retention time of the scan in minutes.
+        charges : numpy.ndarray
+            Charges of the centroids, 0 if unknown. An unknown charge matches
+            any charge. If None, the charges are unknown.
+
+        Returns
+        -------
+        list
+            The closed features, as Feature tuples.
+        """
+        self.__scan += 1
+        mzs = np.asarray(mzs, dtype = np.float64)
+        intensities = np.asarray(intensities, dtype = np.float64)
+        charges = (np.zeros(len(mzs), dtype = np.int64) if charges is None
+                   else np.asarray(charges, dtype = np.int64))
+        features = self.__features
+        count = len(features['mz'])
+
+        # Closest open feature of each centroid
+        matched = np.full(len(mzs), -1, dtype = np.intp)
+        if count and len(mzs):
+            position = np.searchsorted(features['mz'], mzs)
+            lower = np.maximum(position - 1, 0)
+            upper = np.minimum(position, count - 1)
+            closest = np.where(np.abs(features['mz'][lower] - mzs) <=
+                               np.abs(features['mz'][upper] - mzs), lower, upper)
+            feature_charges = features['charge'][closest]
+            linked = ((np.abs(features['mz'][closest] - mzs) <=
+                       self.tolerance * 1e-6 * mzs) &
+                      ((charges == 0) | (feature_charges == 0) |
+                       (charges == feature_charges)))
+            matched[linked] = closest[linked]
+            # The most intense centroid extends the feature, the others start
+            # new features.
+            by_intensity = np.argsort(-intensities, kind = 'stable')
+            candidates = by_intensity[matched[by_intensity] >= 0]
+            _, first = np.unique(matched[candidates], return_index = True)
+            winners = np.zeros(len(mzs), dtype = bool)
+            winners[candidates[first]] = True
+            matched[~winners] = -1
+
+        # Extend the matched features
+        extending = np.flatnonzero(matched >= 0)
+        extended = matched[extending]
+        extension_intensities = intensities[extending]
+        total = features['total_intensity'][extended] + extension_intensities
+        features['mz'][extended] += ((mzs[extending] - features['mz'][extended]) *
+                                     extension_intensities / np.maximum(total, 1e-12))
+        features['total_intensity'][extended] = total
+        known = charges[extending] != 0
+        features['charge'][extended[known]] = charges[extending][known]
+        features['last_rt'][extended] = rt
+        features['last_scan'][extended] = self.__scan
+        features['last_intensity'][extended] = extension_intensities
+        features['scans'][extended] += 1
+        apex = extension_intensities > features['apex_intensity'][extended]
+        features['apex_rt'][extended[apex]] = rt
+        features['apex_scan'][extended[apex]] = self.__scan
+        features['apex_intensity'][extended[apex]] = extension_intensities[apex]
+
+        # Start new features from the other centroids
+        starting = np.flatnonzero(matched < 0)
+        new_ids = np.fromiter(itertools.islice(self.__ids, len(starting)),
+                              dtype = np.int64, count = len(starting))
+        new = {'feature_id' : new_ids,
+               'mz' : mzs[starting],
+               'charge' : charges[starting],
+               'start_rt' : np.full(len(starting), rt),
+               'start_scan' : np.full(len(starting), self.__scan),
+               'last_rt' : np.full(len(starting), rt),
+               'last_scan' : np.full(len(starting), self.__scan),
+               'last_intensity' : intensities[starting],
+               'apex_rt' : np.full(len(starting), rt),
+               'apex_scan' : np.full(len(starting), self.__scan),
+               'apex_intensity' : intensities[starting],
+               'total_intensity' : intensities[starting],
+               'scans' : np.ones(len(starting), dtype = np.int64),
+               'triggered' : np.zeros(len(starting), dtype = bool)}
+        linked_ids = np.concatenate((features['feature_id'][extended], new_ids))
+        linked_intensities = np.concatenate((extension_intensities,
+                                             intensities[starting]))
+        id_order = np.argsort(linked_ids)
+        self.__profiles.append((rt, linked_ids[id_order],
+                                linked_intensities[id_order]))
+
+        # Close the features missing for too long, and merge the new features
+        # into the open ones. The extended features only move within the
+        # tolerance, so the few that are out of m/z order are taken out and
+        # merged again with the new features, at their binary searched
+        # positions, instead of sorting all the open features again.
+        closing = features['last_scan'] < self.__scan - self.max_gap
+        closed = self.__close(features, np.flatnonzero(closing))
+        mzs = np.concatenate((features['mz'], new['mz']))
+        kept = np.flatnonzero(~closing)
+        in_order = mzs[kept] >= np.maximum.accumulate(mzs[kept])
+        inserting = np.concatenate((kept[~in_order], count + np.arange(len(starting))))
+        inserting = inserting[np.argsort(mzs[inserting], kind = 'stable')]
+        kept = kept[in_order]
+        positions = np.searchsorted(mzs[kept], mzs[inserting], side = 'right')
+        # Indices of the merged features, in the open then new features
+        order = np.empty(len(kept) + len(inserting), dtype = np.intp)
+        inserted = positions + np.arange(len(inserting))
+        order[inserted] = inserting
+        remaining = np.ones(len(order), dtype = bool)
+        remaining[inserted] = False
+        order[remaining] = kept
+        self.__features = {name : np.concatenate((values, new[name]))[order]
+                           for name, values in features.items()}
+        return closed
+
+    def close_all(self):
+        """Closes all open features, eg. at the end of the acquisition.
+
+        Returns
+        -------
+        list
+            The closed features, as Feature tuples.
+        """
+        closed = self.__close(self.__features, np.arange(len(self)))
+        self.__features = {name : values[:0]
+                           for name, values in self.__features.items()}
+        return closed
+
+    def peaked(self, min_scans = None):
+        """Returns the open features that passed their apex in the last scan:
+        they were the most intense in the previous scan, and are less intense
+        in the last one. Triggered features are left out.
+
+        Parameters
+        ----------
+        min_scans : int
+            Minimal number of scans of the features. If None, the min_scans
+            of the tracker.
+
+        Returns
+        -------
+        tuple
+            (feature_ids, mzs, charges) arrays of the features.
+        """
+        if min_scans is None:
+            min_scans = self.min_scans
+        features = self.__features
+        selected = ((features['apex_scan'] == self.__scan - 1) &
+                    (features['last_scan'] == self.__scan) &
+                    (features['scans'] >= min_scans) &
+                    ~features['triggered'])
+        return (features['feature_id'][selected], features['mz'][selected],
+                features['charge'][selected])
+
+    def mark_triggered(self, feature_ids):
+        """Marks open features as triggered, eg. once their MS2 scan was
+        requested, so they are not triggered again.
+
+        Parameters
+        ----------
+        feature_ids : array_like
+            Ids of the features.
+        """
+        features = self.__features
+        features['triggered'] |= np.isin(features['feature_id'], feature_ids)
+
+    def __close(self, features, indices):
+        # Returns the closed features with enough scans, with their profiles.
+        indices = indices[features['scans'][indices] >= self.min_scans]
+        if 0 == len(indices):
+            return []
+        ids = features['feature_id'][indices]
+        # Only the profiles of the scans of the features are searched.
+        first = max(len(self.__profiles) - 1 -
+                    (self.__scan - int(features['start_scan'][indices].min())), 0)
+        scans = list(itertools.islice(self.__profiles, first, None))
+        rts = np.array([rt for rt, _, _ in scans])
+        profiles = np.zeros((len(indices), len(scans)))
+        present = np.zeros((len(indices), len(scans)), dtype = bool)
+        for column, (_, linked_ids, intensities) in enumerate(scans):
+            if 0 == len(linked_ids):
+                continue
+            position = np.minimum(np.searchsorted(linked_ids, ids),
+                                  len(linked_ids) - 1)
+            found = linked_ids[position] == ids
+            present[found, column] = True
+            profiles[found, column] = intensities[position[found]]
+        closed = []
+        for row, index in enumerate(indices.tolist()):
+            closed.append(Feature(int(ids[row]),
+                                  float(features['mz'][index]),
+                                  int(features['charge'][index]),
+                                  float(features['start_rt'][index]),
+                                  float(features['last_rt'][index]),
+                                  float(features['apex_rt'][index]),
+                                  float(features['apex_intensity'][index]),
+                                  rts[present[row]],
+                                  profiles[row, present[row]],
+                                  bool(features['triggered'][index])))
+        return closed
@@ -0,0 +1,366 @@
+import argparse
+import collections
+import logging
+import os
+import re
+import numpy as np
+from utils.isotopes import PROTON_MASS
+
+# Monoisotopic masses of the amino acid residues in Da
+AMINO_ACID_MASSES = {'G' : 57.021464, 'A' : 71.037114, 'S' : 87.032028,
+                     'P' : 97.052764, 'V' : 99.068414, 'T' : 101.047679,
+                     'C' : 103.009185, 'L' : 113.084064, 'I' : 113.084064,
+                     'N' : 114.042927, 'D' : 115.026943, 'Q' : 128.058578,
+                     'K' : 128.094963, 'E' : 129.042593, 'M' : 131.040485,
+                     'H' : 137.058912, 'F' : 147.068414, 'R' : 156.101111,
+                     'Y' : 163.063329, 'W' : 186.079313}
+# Monoisotopic mass of water in Da
+WATER_MASS = 18.010565
+# Default fixed modifications, residue -> mass shift in Da
+# (carbamidomethylation of cysteines)
+DEFAULT_FIXED_MODIFICATIONS = {'C' : 57.021464}
+
+# Default digestion: tryptic peptides with up to one missed cleavage, of 7 to
+# 30 residues
+DEFAULT_MISSED_CLEAVAGES = 1
+DEFAULT_MIN_LENGTH = 7
+DEFAULT_MAX_LENGTH = 30
+# Range of the indexed fragment m/z values
+MIN_FRAGMENT_MZ = 100.0
+MAX_FRAGMENT_MZ = 2000.0
+
+# Files of an index folder
+PEPTIDES_FILE = 'peptides.npy'
+PEPTIDE_MASSES_FILE = 'peptide_masses.npy'
+FRAGMENT_MZS_FILE = 'fragment_mzs.npy'
+FRAGMENT_PEPTIDES_FILE = 'fragment_peptides.npy'
+
+# Trypsin cleaves after lysine and arginine, unless followed by proline.
+TRYPSIN_SITES = re.compile(r'(?<=[KR])(?!P)')
+
+logger = logging.getLogger(__name__)
+
+# Best peptide match of a scan.
+#   peptide - Sequence of the peptide
+#   mass - Neutral monoisotopic mass of the peptide in Da
+#   charge - Precursor charge of the match
+#   matched - Number of scan peaks matching fragments of the peptide
+#   candidates - Number of peptides within the precursor tolerance
+SearchResult = collections.namedtuple('SearchResult',
+                                      ['peptide',
+                                       'mass',
+                                       'charge',
+                                       'matched',
+                                       'candidates'])
+
+def read_fasta(path):
+    """Reads the protein sequences of a FASTA file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the FASTA file.
+
+    Returns
+    -------
+    list
+        Sequences of the proteins.
+    """
+    sequences = []
+    parts = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if parts:
+                    sequences.append(''.join(parts))
+                parts = []
+            elif line:
+                parts.append(line.upper())
+    if parts:
+        sequences.append(''.join(parts))
+    return sequences
+
+def digest(sequence,
+           missed_cleavages = DEFAULT_MISSED_CLEAVAGES,
+           min_length = DEFAULT_MIN_LENGTH,
+           max_length = DEFAULT_MAX_LENGTH):
+    """Returns the tryptic peptides of a protein sequence.
+
+    Parameters
+    ----------
+    sequence : str
+        Sequence of the protein.
+    missed_cleavages : int
+        Maximal number of missed cleavages of the peptides.
+    min_length : int
+        Minimal length of the peptides.
+    max_length : int
+        Maximal length of the peptides.
+
+    Returns
+    -------
+    list
+        Sequences of the peptides.
+    """
+    # A C-terminal K or R leaves an empty last piece.
+    pieces = [piece for piece in TRYPSIN_SITES.split(sequence) if piece]
+    peptides = []
+    for first in range(len(pieces)):
+        for last in range(first, min(first + missed_cleavages + 1, len(pieces))):
+            peptide = ''.join(pieces[first:last + 1])
+            if min_length <= len(peptide) <= max_length:
+                peptides.append(peptide)
+    return peptides
+
+def read_peptides(path):
+    """Reads a peptide list, one sequence per line. Empty lines and lines
+    starting with # are skipped."""
+    with open(path, 'r') as f:
+        return [line.strip().upper() for line in f
+                if line.strip() and not line.startswith('#')]
+
+def build_fragment_index(source,
+                         index_dir,
+                         missed_cleavages = DEFAULT_MISSED_CLEAVAGES,
+                         min_length = DEFAULT_MIN_LENGTH,
+                         max_length = DEFAULT_MAX_LENGTH,
+                         fixed_modifications = DEFAULT_FIXED_MODIFICATIONS):
+    """Builds the fragment ion index of the peptides of a FASTA file or of a
+    peptide list, and saves it as arrays in an index folder.
+
+    The peptides are sorted by mass, and the singly charged b and y ions of
+    all peptides are sorted by m/z with the index of their peptide, so they
+    can be searched with binary searches from memory-mapped files.
+
+    Parameters
+    ----------
+    source : str
+        Path of a FASTA file (.fasta or .fa), or of a peptide list.
+    index_dir : str
+        Folder of the index.
+    missed_cleavages : int
+        Maximal number of missed cleavages of the digested peptides.
+    min_length : int
+        Minimal length of the digested peptides.
+    max_length : int
+        Maximal length of the digested peptides.
+    fixed_modifications : dict
+        Mass shifts of the residues in Da, residue -> mass shift.
+
+    Returns
+    -------
+    tuple
+        Number of peptides and number of fragments of the index.
+    """
+    if os.path.splitext(source)[1].lower() in ['.fasta', '.fa']:
+        peptides = set()
+        for sequence in read_fasta(source):
+            peptides.update(digest(sequence, missed_cleavages,
+                                   min_length, max_length))
+    else:
+        peptides = set(read_peptides(source))
+    # Peptides with ambiguous or unknown residues are not indexed.
+    peptides = sorted(peptide for peptide in peptides
+                      if peptide and set(peptide) <= AMINO_ACID_MASSES.keys())
+
+    # Residue masses of all peptides, concatenated
+    table = np.zeros(256)
+    for residue, mass in AMINO_ACID_MASSES.items():
+        table[ord(residue)] = mass + fixed_modifications.get(residue, 0.0)
+    lengths = np.array([len(peptide) for peptide in peptides], dtype = np.intp)
+    residues = table[np.frombuffer(''.join(peptides).encode('ascii'),
+                                   dtype = np.uint8)]
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    cumulative = np.cumsum(residues)
+    masses = cumulative[ends - 1] - cumulative[starts] + residues[starts] + WATER_MASS
+
+    # Peptides sorted by mass
+    order = np.argsort(masses, kind = 'stable')
+    rank = np.empty(len(order), dtype = np.int32)
+    rank[order] = np.arange(len(order), dtype = np.int32)
+
+    # b and y ions cleaving after each residue but the last one
+    peptide_of = np.repeat(np.arange(len(peptides)), lengths)
+    prefix = cumulative - (cumulative[starts] - residues[starts])[peptide_of]
+    inner = np.ones(len(residues), dtype = bool)
+    inner[ends - 1] = False
+    b_ions = prefix[inner] + PROTON_MASS
+    y_ions = masses[peptide_of[inner]] - prefix[inner] + PROTON_MASS
+    fragment_mzs = np.concatenate((b_ions, y_ions))
+    fragment_peptides = np.tile(rank[peptide_of[inner]], 2)
+    kept = (MIN_FRAGMENT_MZ <= fragment_mzs) & (fragment_mzs <= MAX_FRAGMENT_MZ)
+    fragment_mzs = fragment_mzs[kept]
+    fragment_peptides = fragment_peptides[kept]
+    fragment_order = np.argsort(fragment_mzs, kind = 'stable')
+
+    os.makedirs(index_dir, exist_ok = True)
+    np.save(os.path.join(index_dir, PEPTIDES_FILE),
+            np.array(peptides, dtype = f'S{max(lengths, default = 1)}')[order])
+    np.save(os.path.join(index_dir, PEPTIDE_MASSES_FILE), masses[order])
+    np.save(os.path.join(index_dir, FRAGMENT_MZS_FILE),
+            fragment_mzs[fragment_order].astype(np.float32))
+    np.save(os.path.join(index_dir, FRAGMENT_PEPTIDES_FILE),
+            fragment_peptides[fragment_order])
+    logger.info(f'Fragment index of {len(peptides)} peptides and ' +
+                f'{len(fragment_order)} fragments saved to {index_dir}')
+    return len(peptides), len(fragment_order)
+
+class FragmentIndex:
+    """
+    Searches MS2 scans in a fragment ion index, as they are received.
+
+    The arrays of the index are memory mapped, so only the pages that are
+    searched are read. The peptides within the precursor tolerance of a scan
+    are a contiguous range of the peptides sorted by mass. The most intense
+    peaks of the scan are matched to the fragments with binary searches, and
+    the matched fragments of the candidate peptides are counted at once.
+
+    ...
+
+    Attributes
+    ----------
+    precursor_tolerance : float
+        Tolerance of the precursor mass in ppm.
+    fragment_tolerance : float
+        Tolerance of the fragment m/z in Da.
+    max_peaks : int
+        Number of the most intense peaks of a scan that are matched.
+    min_matched : int
+        Minimal number of matched peaks of an identification.
+    """
+
+    # Default tolerance of the precursor mass in ppm
+    DEFAULT_PRECURSOR_TOLERANCE = 10
+    # Default tolerance of the fragment m/z in Da
+    DEFAULT_FRAGMENT_TOLERANCE = 0.02
+    # Default number of the most intense peaks of a scan that are matched
+    DEFAULT_MAX_PEAKS = 100
+    # Default minimal number of matched peaks of an identification
+    DEFAULT_MIN_MATCHED = 6
+    # Charges tried when the precursor charge is unknown
+    UNKNOWN_CHARGES = (2, 3)
+
+    def __init__(self,
+                 index_dir,
+                 precursor_tolerance = DEFAULT_PRECURSOR_TOLERANCE,
+                 fragment_tolerance = DEFAULT_FRAGMENT_TOLERANCE,
+                 max_peaks = DEFAULT_MAX_PEAKS,
+                 min_matched = DEFAULT_MIN_MATCHED):
+        """
+        Parameters
+        ----------
+        index_dir : str
+            Folder of the index, see :func:`build_fragment_index`.
+        precursor_tolerance : float
+            Tolerance of the precursor mass in ppm.
+        fragment_tolerance : float
+            Tolerance of the fragment m/z in Da.
+        max_peaks : int
+            Number of the most intense peaks of a scan that are matched.
+        min_matched : int
+            Minimal number of matched peaks of an identification.
+        """
+        self.precursor_tolerance = precursor_tolerance
+        self.fragment_tolerance = fragment_tolerance
+        self.max_peaks = max_peaks
+        self.min_matched = min_matched
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode = 'r')
+        self.peptides = load(PEPTIDES_FILE)
+        self.peptide_masses = load(PEPTIDE_MASSES_FILE)
+        self.fragment_mzs = load(FRAGMENT_MZS_FILE)
+        self.fragment_peptides = load(FRAGMENT_PEPTIDES_FILE)
+
+    def search(self, mzs, intensities, precursor_mz, charge = 0):
+        """Searches an MS2 scan.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            m/z values of the centroids of the scan.
+        intensities : numpy.ndarray
+            Intensities of the centroids.
+        precursor_mz : float
+            m/z of the precursor.
+        charge : int
+            Charge of the precursor, 0 if unknown.
+
+        Returns
+        -------
+        SearchResult
+            The best peptide match, or None if no peptide matched at least
+            min_matched peaks.
+        """
+        mzs = np.asarray(mzs, dtype = np.float64)
+        intensities = np.asarray(intensities, dtype = np.float64)
+        if len(mzs) > self.max_peaks:
+            mzs = mzs[np.argpartition(intensities, len(mzs) - self.max_peaks)
+                      [len(mzs) - self.max_peaks:]]
+        mzs = np.sort(mzs)
+
+        # Candidate peptide ranges of the possible charges
+        charges = [charge] if charge else list(self.UNKNOWN_CHARGES)
+        masses = (precursor_mz - PROTON_MASS) * np.array(charges)
+        tolerance = masses * self.precursor_tolerance * 1e-6
+        firsts = np.searchsorted(self.peptide_masses, masses - tolerance, side = 'left')
+        lasts = np.searchsorted(self.peptide_masses, masses + tolerance, side = 'right')
+        if not np.any(lasts > firsts):
+            return None
+
+        # Peptides of all fragments matching the peaks. The bounds have the
+        # type of the fragment m/z values, otherwise the binary search would
+        # convert the whole fragment array.
+        bound_type = self.fragment_mzs.dtype
+        low = np.searchsorted(self.fragment_mzs,
+                              (mzs - self.fragment_tolerance).astype(bound_type),
+                              side = 'left')
+        high = np.searchsorted(self.fragment_mzs,
+                               (mzs + self.fragment_tolerance).astype(bound_type),
+                               side = 'right')
+        spans = high - low
+        positions = (np.repeat(low - (np.cumsum(spans) - spans), spans) +
+                     np.arange(spans.sum()))
+        matches = np.asarray(self.fragment_peptides[positions])
+
+        best = None
+        for peptide_charge, first, last in zip(charges, firsts.tolist(), lasts.tolist()):
+            if last <= first:
+                continue
+            candidates = matches[(matches >= first) & (matches < last)] - first
+            if 0 == len(candidates):
+                continue
+            counts = np.bincount(candidates, minlength = last - first)
+            peptide = int(np.argmax(counts))
+            if (best is None) or (counts[peptide] > best.matched):
+                best = SearchResult(self.peptides[first + peptide].decode('ascii'),
+                                    float(self.peptide_masses[first + peptide]),
+                                    peptide_charge,
+                                    int(counts[peptide]),
+                                    last - first)
+        if (best is None) or (best.matched < self.min_matched):
+            return None
+        return best
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Builds a fragment ion ' +
+                                     'index for the real-time search of MS2 scans.')
+    parser.add_argument('source', help = 'FASTA file (.fasta or .fa) or ' +
+                        'peptide list, one sequence per line')
+    parser.add_argument('index_dir', help = 'folder of the index')
+    parser.add_argument('--missed_cleavages', type = int,
+                        default = DEFAULT_MISSED_CLEAVAGES,
+                        help = 'maximal number of missed cleavages')
+    parser.add_argument('--min_length', type = int, default = DEFAULT_MIN_LENGTH,
+                        help = 'minimal length of the peptides')
+    parser.add_argument('--max_length', type = int, default = DEFAULT_MAX_LENGTH,
+                        help = 'maximal length of the peptides')
+    args = parser.parse_args()
+    peptides, fragments = build_fragment_index(args.source, args.index_dir,
+                                               args.missed_cleavages,
+                                               args.min_length,
+                                               args.max_length)
+    print(f'Indexed {peptides} peptides and {fragments} fragments.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import csv
+import os
+import numpy as np
+
+# Fields of a target, as CSV columns or HOCON keys. The charge and the name
+# are optional.
+MZ = 'mz'
+RT_START = 'rt_start'
+RT_END = 'rt_end'
+CHARGE = 'charge'
+NAME = 'name'
+
+# Key of the list of targets in HOCON configuration files
+TARGETS_KEY = 'targets'
+
+class InclusionList:
+    """
+    Inclusion list of targeted precursors, each with an m/z, a retention time
+    window and optionally a charge, matched against the centroids of the
+    survey scans.
+
+    The targets are indexed by retention time into bins of fixed width, each
+    bin listing the targets whose window overlaps it, sorted by m/z. Only the
+    targets of the bin of the current retention time are considered, and they
+    are matched against the centroids with binary searches, so the cost of a
+    survey scan depends on the number of active targets, not on the length of
+    the inclusion list.
+
+    ...
+
+    Attributes
+    ----------
+    mzs : numpy.ndarray
+        m/z values of the targets.
+    rt_starts : numpy.ndarray
+        Start of the retention time windows of the targets in minutes.
+    rt_ends : numpy.ndarray
+        End of the retention time windows of the targets in minutes.
+    charges : numpy.ndarray
+        Charges of the targets, 0 if any charge matches.
+    names : list
+        Names of the targets.
+    tolerance : float
+        Tolerance of the m/z match in ppm.
+    """
+
+    # Default tolerance of the m/z match in ppm
+    DEFAULT_TOLERANCE = 10
+    # Minimal width of the retention time bins in minutes
+    MIN_BIN_WIDTH = 0.1
+
+    def __init__(self,
+                 mzs,
+                 rt_starts,
+                 rt_ends,
+                 charges = None,
+                 names = None,
+                 tolerance = DEFAULT_TOLERANCE,
+                 bin_width = None):
+        """
+        Parameters
+        ----------
+        mzs : array_like
+            m/z values of the targets.
+        rt_starts : array_like
+            Start of the retention time windows of the targets in minutes.
+        rt_ends : array_like
+            End of the retention time windows of the targets in minutes.
+        charges : array_like
+            Charges of the targets, 0 if any charge matches. If None, any
+            charge matches all targets.
+        names : list
+            Names of the targets. If None, the targets are named by their
+            index.
+        tolerance : float
+            Tolerance of the m/z match in ppm.
+        bin_width : float
+            Width of the retention time bins in minutes. If None, the median
+            width of the windows is used, so that most targets are listed in
+            one or two bins.
+
+        Raises
+        ------
+        ValueError
+            If the targets have different numbers of fields, or a window ends
+            before it starts.
+        """
+        self.mzs = np.asarray(mzs, dtype = np.float64)
+        self.rt_starts = np.asarray(rt_starts, dtype = np.float64)
+        self.rt_ends = np.asarray(rt_ends, dtype = np.float64)
+        self.charges = (np.zeros(len(self.mzs), dtype = np.int64)
+                        if charges is None
+                        else np.asarray(charges, dtype = np.int64))
+        self.names = ([str(i) for i in range(len(self.mzs))] if names is None
+                      else list(names))
+        self.tolerance = tolerance
+        if not (len(self.mzs) == len(self.rt_starts) == len(self.rt_ends) ==
+                len(self.charges) == len(self.names)):
+            raise ValueError('The targets have different numbers of fields.')
+        if np.any(self.rt_ends < self.rt_starts):
+            raise ValueError('Retention time windows of targets end before ' +
+                             'they start: ' +
+                             f'{np.flatnonzero(self.rt_ends < self.rt_starts).tolist()}')
+        self.__build_index(bin_width)
+
+    def __len__(self):
+        return len(self.mzs)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Loads the targets from a CSV file with mz, rt_start, rt_end and
+        optionally charge and name columns, or from a HOCON file with a list
+        of targets with the same keys under the targets key.
+
+        Parameters
+        ----------
+        path : str
+            Path of the CSV (.csv) or HOCON file.
+        kwargs :
+            Further arguments of the inclusion list, eg. the tolerance.
+
+        Returns
+        -------
+        InclusionList
+            The inclusion list of the targets.
+
+        Raises
+        ------
+        ValueError
+            If a mandatory field of a target is missing or invalid.
+        """
+        if '.csv' == os.path.splitext(path)[1].lower():
+            with open(path, 'r', newline = '') as f:
+                targets = list(csv.DictReader(f))
+        else:
+            from algorithms.manager.config_cache import load_configs
+            targets = load_configs([path]).get(TARGETS_KEY, [])
+
+        columns = {MZ : [], RT_START : [], RT_END : [], CHARGE : [], NAME : []}
+        for row, target in enumerate(targets):
+            try:
+                for field in [MZ, RT_START, RT_END]:
+                    columns[field].append(float(target[field]))
+                columns[CHARGE].append(int(target.get(CHARGE) or 0))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f'Invalid target {row} in {path}: {e}')
+            columns[NAME].append(str(target.get(NAME) or row))
+        return cls(columns[MZ], columns[RT_START], columns[RT_END],
+                   columns[CHARGE], columns[NAME], **kwargs)
+
+    def active(self, rt):
+        """Returns the targets whose window contains the retention time.
+
+        Parameters
+        ----------
+        rt : float
+            Retention time in minutes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the active targets, in ascending order of m/z.
+        """
+        targets = self.__bin_targets(rt)
+        return targets[(self.rt_starts[targets] <= rt) &
+                       (rt <= self.rt_ends[targets])]
+
+    def match(self, rt, mzs, charges = None):
+        """Matches the active targets against the centroids of a scan.
+
+        Parameters
+        ----------
+        rt : float
+            Retention time of the scan in minutes.
+        mzs : numpy.ndarray
+            m/z values of the centroids, in ascending order.
+        charges : numpy.ndarray
+            Charges of the centroids, 0 if unknown. If None, the charges of
+            the targets are not checked.
+
+        Returns
+        -------
+        tuple
+            (targets, centroids) arrays of the indices of the matched targets,
+            in ascending order of m/z, and the indices of the centroids
+            closest in m/z to them.
+        """
+        targets = self.active(rt)
+        mzs = np.asarray(mzs, dtype = np.float64)
+        if (0 == len(targets)) or (0 == len(mzs)):
+            empty = np.empty(0, dtype = np.intp)
+            return empty, empty
+        target_mzs = self.mzs[targets]
+        # The closest centroid is one of the two around the target m/z.
+        position = np.searchsorted(mzs, target_mzs)
+        lower = np.maximum(position - 1, 0)
+        upper = np.minimum(position, len(mzs) - 1)
+        closest = np.where(np.abs(mzs[lower] - target_mzs) <=
+                           np.abs(mzs[upper] - target_mzs), lower, upper)
+        matched = (np.abs(mzs[closest] - target_mzs) <=
+                   self.tolerance * 1e-6 * target_mzs)
+        if charges is not None:
+            target_charges = self.charges[targets]
+            centroid_charges = np.asarray(charges)[closest]
+            matched &= ((target_charges == 0) | (centroid_charges == 0) |
+                        (target_charges == centroid_charges))
+        return targets[matched], closest[matched]
+
+    def __build_index(self, bin_width):
+        count = len(self.mzs)
+        if 0 == count:
+            self.__rt_origin = 0.0
+            self.__bin_width = self.MIN_BIN_WIDTH
+            self.__bin_offsets = np.zeros(2, dtype = np.intp)
+            self.__bin_entries = np.empty(0, dtype = np.intp)
+            return
+        if bin_width is None:
+            bin_width = float(np.median(self.rt_ends - self.rt_starts))
+        self.__bin_width = max(bin_width, self.MIN_BIN_WIDTH)
+        self.__rt_origin = float(self.rt_starts.min())
+        first = self.__bin(self.rt_starts)
+        last = self.__bin(self.rt_ends)
+        bin_count = int(last.max()) + 1
+
+        # One entry per target and overlapped bin, sorted by bin, then by the
+        # m/z of the target.
+        spans = last - first + 1
+        targets = np.repeat(np.arange(count), spans)
+        starts = np.cumsum(spans) - spans
+        bins = first[targets] + (np.arange(len(targets)) - starts[targets])
+        order = np.lexsort((self.mzs[targets], bins))
+        self.__bin_entries = targets[order]
+        self.__bin_offsets = np.searchsorted(bins[order], np.arange(bin_count + 1))
+
+    def __bin(self, rt):
+        return np.floor((rt - self.__rt_origin) / self.__bin_width).astype(np.intp)
+
+    def __bin_targets(self, rt):
+        index = int(self.__bin(np.float64(rt)))
+        if (index < 0) or (index >= len(self.__bin_offsets) - 1):
+            return self.__bin_entries[:0]
+        return self.__bin_entries[self.__bin_offsets[index]:
+                                  self.__bin_offsets[index + 1]]
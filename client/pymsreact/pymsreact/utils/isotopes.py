@@ -0,0 +1,166 @@
+import collections
+import numpy as np
+
+# Mass difference between the 13C and 12C isotopes in Da
+ISOTOPE_SPACING = 1.003355
+# Mass of a proton in Da
+PROTON_MASS = 1.007276
+# Approximate ratio of the intensity of the first isotope peak to the
+# monoisotopic peak per Da of peptide mass (averagine)
+ISOTOPE_RATIO_PER_DA = 0.00055
+# Factor by which the intensity of the next isotope peak may exceed the
+# intensity expected from the averagine
+RATIO_TOLERANCE = 3
+
+# Isotope envelopes of the centroids of a scan.
+#   charges - Charge of the envelope of each centroid, 0 if the centroid is
+#             not part of an envelope
+#   monoisotopic - Index of the monoisotopic centroid of the envelope of each
+#                  centroid, the index of the centroid itself if it is not
+#                  part of an envelope
+IsotopeEnvelopes = collections.namedtuple('IsotopeEnvelopes',
+                                          ['charges', 'monoisotopic'])
+
+def detect_envelopes(mzs,
+                     intensities,
+                     max_charge = 4,
+                     tolerance = 10,
+                     max_isotopes = 5):
+    """Finds the isotope envelopes of the centroids of a scan, with their
+    charge and monoisotopic centroid.
+
+    For each charge, the next isotope peak of every centroid is searched at
+    once, in a single pass over the centroids. A centroid is linked to its
+    next isotope peak if that peak is not more intense than the averagine
+    allows. Envelopes start at the centroids that are not linked from a
+    previous peak, and each centroid takes the charge of its longest
+    envelope. Centroids claimed by several envelopes are kept by the longest,
+    and then the most intense envelope, and envelopes that lost their
+    monoisotopic centroid this way are dropped.
+
+    Parameters
+    ----------
+    mzs : numpy.ndarray
+        m/z values of the centroids, in ascending order.
+    intensities : numpy.ndarray
+        Intensities of the centroids.
+    max_charge : int
+        Highest charge to consider.
+    tolerance : float
+        Tolerance of the isotope peak positions in ppm.
+    max_isotopes : int
+        Maximal number of peaks of an envelope.
+
+    Returns
+    -------
+    IsotopeEnvelopes
+        Charge and monoisotopic centroid of each centroid.
+    """
+    mzs = np.asarray(mzs, dtype = np.float64)
+    intensities = np.asarray(intensities, dtype = np.float64)
+    count = len(mzs)
+    charges = np.zeros(count, dtype = np.int64)
+    monoisotopic = np.arange(count)
+    if count < 2:
+        return IsotopeEnvelopes(charges, monoisotopic)
+
+    # np.interp gives the fractional position of each expected m/z within the
+    # centroids. Shifted by half a centroid, its integer part is the index of
+    # the closest centroid. Unlike a binary search per value, np.interp
+    # starts from the previous result, which is cheap since the expected m/z
+    # values are in ascending order.
+    positions = np.arange(count, dtype = np.float64) + 0.5
+    # Expected ratio of the first isotope peak to the monoisotopic peak at
+    # charge 1
+    ratio = (mzs - PROTON_MASS) * ISOTOPE_RATIO_PER_DA
+    # Next isotope peak of each centroid for each charge, -1 if none
+    next_peak = np.full((max_charge, count), -1, dtype = np.intp)
+    # Envelope starts of each charge, as indices into the flattened next_peak
+    starts = []
+    for row in range(max_charge):
+        charge = row + 1
+        expected = mzs + ISOTOPE_SPACING / charge
+        closest = np.interp(expected, mzs, positions).astype(np.intp)
+        linked = np.flatnonzero(np.abs(mzs[closest] - expected) <=
+                                tolerance * 1e-6 * expected)
+        candidate = closest[linked]
+        # The next peak may be more intense than the centroid by the expected
+        # isotope ratio, within the ratio tolerance.
+        max_intensity = (np.maximum(ratio[linked] * charge, 1) * RATIO_TOLERANCE *
+                         intensities[linked])
+        valid = ((candidate > linked) &
+                 (intensities[candidate] <= max_intensity))
+        linked = linked[valid]
+        candidate = candidate[valid]
+        next_peak[row, linked] = candidate
+        # Envelopes start at centroids that have a next peak, and are not the
+        # next peak of another centroid.
+        has_previous = np.zeros(count, dtype = bool)
+        has_previous[candidate] = True
+        starts.append(linked[~has_previous[linked]] + row * count)
+
+    starts = np.concatenate(starts)
+    if 0 == len(starts):
+        return IsotopeEnvelopes(charges, monoisotopic)
+    rows, start_peaks = np.divmod(starts, count)
+    members = np.full((len(starts), max_isotopes), -1, dtype = np.intp)
+    members[:, 0] = start_peaks
+    lengths = np.ones(len(starts), dtype = np.int8)
+    # Envelopes that may continue, with their last peak
+    next_peak = next_peak.ravel()
+    offsets = starts - start_peaks
+    alive = np.arange(len(starts))
+    last = start_peaks
+    for isotope in range(1, max_isotopes):
+        following = next_peak[offsets[alive] + last]
+        continued = following >= 0
+        alive = alive[continued]
+        last = following[continued]
+        if 0 == len(alive):
+            break
+        members[alive, isotope] = last
+        lengths[alive] += 1
+
+    # A centroid starting envelopes of several charges keeps the longest one,
+    # and then the one of the highest charge. With repeated indices the last
+    # assignment is kept, so the envelopes are assigned by ascending score.
+    # The scores are small integers, which the stable argsort sorts in
+    # linear time.
+    score = lengths.astype(np.int16) * max_charge + rows.astype(np.int16)
+    ascending = np.argsort(score, kind = 'stable')
+    best = np.empty(count, dtype = np.intp)
+    best[start_peaks[ascending]] = ascending
+    chosen = np.flatnonzero(best[start_peaks] == np.arange(len(starts)))
+
+    # Each centroid is kept by the longest, and then most intense envelope
+    # claiming it, so the envelopes are assigned from the lowest ranked one.
+    chosen = chosen[np.argsort(intensities[start_peaks[chosen]])]
+    chosen = chosen[np.argsort(lengths[chosen], kind = 'stable')]
+    # The missing peaks of short envelopes (-1) are assigned to an extra
+    # last element.
+    owner = np.full(count + 1, -1, dtype = np.intp)
+    owner[members[chosen].ravel()] = np.repeat(chosen, max_isotopes)
+    owner = owner[:count]
+    # Envelopes that lost their monoisotopic centroid are dropped.
+    assigned = np.flatnonzero(owner >= 0)
+    envelope = owner[assigned]
+    kept = owner[start_peaks[envelope]] == envelope
+    assigned = assigned[kept]
+    envelope = envelope[kept]
+
+    charges[assigned] = rows[envelope] + 1
+    monoisotopic[assigned] = start_peaks[envelope]
+    return IsotopeEnvelopes(charges, monoisotopic)
+
+def precursor_candidates(envelopes):
+    """Returns the indices of the centroids that can be selected as
+    precursors: the monoisotopic centroids of the envelopes, and the
+    centroids that are not part of an envelope.
+
+    Parameters
+    ----------
+    envelopes : IsotopeEnvelopes
+        Isotope envelopes of the centroids, see :func:`detect_envelopes`.
+    """
+    return np.flatnonzero(envelopes.monoisotopic ==
+                          np.arange(len(envelopes.monoisotopic)))
@@ -0,0 +1,100 @@
+import numpy as np
+from algorithms.manager.acquisition import CentroidFields as cf
+
+# Factor by which the number of candidates grows when too many of the most
+# intense centroids are excluded
+CANDIDATE_GROWTH = 4
+
+def centroid_arrays(centroids):
+    """Returns the m/z and intensity values of centroids as arrays.
+
+    Parameters
+    ----------
+    centroids : list
+        Centroids of a scan, see ScanFields.CENTROIDS.
+
+    Returns
+    -------
+    tuple
+        (mzs, intensities) float64 arrays.
+    """
+    mzs = np.array([centroid[cf.MZ] for centroid in centroids],
+                   dtype = np.float64)
+    intensities = np.array([centroid[cf.INTENSITY] for centroid in centroids],
+                           dtype = np.float64)
+    return mzs, intensities
+
+def tolerance_mask(mzs, reference_mzs, tolerance, ppm = False):
+    """Returns which m/z values are closer than the tolerance to any of the
+    reference m/z values.
+
+    Parameters
+    ----------
+    mzs : numpy.ndarray
+        m/z values to check.
+    reference_mzs : numpy.ndarray
+        Reference m/z values, sorted in ascending order.
+    tolerance : float
+        Tolerance in m/z, or in ppm of the checked m/z values.
+    ppm : bool
+        True if the tolerance is given in ppm.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask, True where the m/z value is within the tolerance.
+    """
+    mzs = np.asarray(mzs, dtype = np.float64)
+    if 0 == len(reference_mzs):
+        return np.zeros(len(mzs), dtype = bool)
+    # Only the two reference values around each m/z can be the closest ones.
+    position = np.searchsorted(reference_mzs, mzs)
+    lower = reference_mzs[np.maximum(position - 1, 0)]
+    upper = reference_mzs[np.minimum(position, len(reference_mzs) - 1)]
+    if ppm:
+        tolerance = tolerance * 1e-6 * mzs
+    return ((np.abs(mzs - lower) < tolerance) |
+            (np.abs(upper - mzs) < tolerance))
+
+def select_top_n(mzs, intensities, n, excluded = None):
+    """Selects the most intense centroids that are not excluded.
+
+    Only the most intense centroids are sorted and checked against the
+    exclusion, found by partial selection. The number of candidates grows
+    only when too many of them are excluded.
+
+    Parameters
+    ----------
+    mzs : numpy.ndarray
+        m/z values of the centroids.
+    intensities : numpy.ndarray
+        Intensities of the centroids.
+    n : int
+        Number of centroids to select.
+    excluded : callable
+        Called with the m/z values of the candidates, returns a boolean mask
+        that is True for the excluded ones, eg. a partial application of
+        :func:`tolerance_mask`. If None, no centroid is excluded.
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the selected centroids, from the most intense one. Less
+        than n if there are not enough centroids that are not excluded.
+    """
+    intensities = np.asarray(intensities)
+    count = len(intensities)
+    if (n <= 0) or (0 == count):
+        return np.empty(0, dtype = np.intp)
+    candidates = min(n, count)
+    while True:
+        if candidates < count:
+            top = np.argpartition(intensities, count - candidates)[count - candidates:]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-intensities[top], kind = 'stable')]
+        if excluded is not None:
+            top = top[~excluded(np.asarray(mzs)[top])]
+        if (len(top) >= n) or (candidates == count):
+            return top[:n]
+        candidates = min(count, candidates * CANDIDATE_GROWTH)
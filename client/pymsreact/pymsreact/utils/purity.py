@@ -0,0 +1,75 @@
+import numpy as np
+
+def isolation_purity(mzs,
+                     intensities,
+                     precursors,
+                     isolation_width,
+                     envelopes = None,
+                     isolation_offset = 0):
+    """Computes the purity of the isolation windows of candidate precursors:
+    the fraction of the intensity in the window that comes from the isotope
+    envelope of the precursor.
+
+    The intensity in the windows is summed from prefix sums of the
+    intensities, bounded by binary searches, and the intensity of the
+    envelopes from their centroids grouped by monoisotopic centroid, so all
+    candidates of a scan are scored at once.
+
+    Parameters
+    ----------
+    mzs : numpy.ndarray
+        m/z values of the centroids, in ascending order.
+    intensities : numpy.ndarray
+        Intensities of the centroids.
+    precursors : numpy.ndarray
+        Indices of the centroids of the candidate precursors.
+    isolation_width : float
+        Width of the isolation window in m/z.
+    envelopes : IsotopeEnvelopes
+        Isotope envelopes of the centroids, see
+        :func:`~utils.isotopes.detect_envelopes`. The envelope of a precursor
+        is the envelope of its monoisotopic centroid. If None, only the
+        precursor centroid counts as the precursor.
+    isolation_offset : float
+        Offset of the center of the isolation window from the precursor m/z.
+
+    Returns
+    -------
+    numpy.ndarray
+        Purity of the isolation window of each precursor, between 0 and 1.
+    """
+    mzs = np.asarray(mzs, dtype = np.float64)
+    intensities = np.asarray(intensities, dtype = np.float64)
+    precursors = np.asarray(precursors, dtype = np.intp)
+    if 0 == len(precursors):
+        return np.empty(0, dtype = np.float64)
+
+    centers = mzs[precursors] + isolation_offset
+    lows = centers - isolation_width / 2
+    highs = centers + isolation_width / 2
+    cumulative = np.concatenate(([0.0], np.cumsum(intensities)))
+    total = (cumulative[np.searchsorted(mzs, highs, side = 'right')] -
+             cumulative[np.searchsorted(mzs, lows, side = 'left')])
+
+    if envelopes is None:
+        target = np.where((lows <= mzs[precursors]) & (mzs[precursors] <= highs),
+                          intensities[precursors], 0.0)
+    else:
+        # The centroids of an envelope are contiguous and in ascending order
+        # of m/z once ordered by monoisotopic centroid.
+        monoisotopic = envelopes.monoisotopic
+        order = np.argsort(monoisotopic, kind = 'stable')
+        grouped = monoisotopic[order]
+        envelope = monoisotopic[precursors]
+        first = np.searchsorted(grouped, envelope, side = 'left')
+        end = np.searchsorted(grouped, envelope, side = 'right')
+        target = np.zeros(len(precursors), dtype = np.float64)
+        for isotope in range(int((end - first).max())):
+            member = order[np.minimum(first + isotope, len(order) - 1)]
+            counted = ((first + isotope < end) &
+                       (lows <= mzs[member]) & (mzs[member] <= highs))
+            target += np.where(counted, intensities[member], 0.0)
+
+    purity = np.zeros(len(precursors), dtype = np.float64)
+    np.divide(target, total, out = purity, where = total > 0)
+    return np.minimum(purity, 1.0)
@@ -0,0 +1,452 @@
+import collections
+import math
+import numpy as np
+from algorithms.manager.acquisition import ScanFields as sf, CentroidFields as cf
+
+# Quantiles reported in the snapshots
+SNAPSHOT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Quality control metrics of an acquisition at a point in time.
+#   rt - Retention time of the last scan in minutes
+#   ms1_count - Number of MS1 scans received
+#   ms2_count - Number of MS2 scans received
+#   ms1_rate - Decayed rate of the MS1 scans in Hz
+#   ms2_rate - Decayed rate of the MS2 scans in Hz
+#   cycle_times - Quantiles of the time between MS1 scans in seconds, as a
+#                 dictionary quantile -> value
+#   ms1_centroid_counts - Quantiles of the centroid counts of the MS1 scans
+#   ms2_centroid_counts - Quantiles of the centroid counts of the MS2 scans
+#   tic - Total ion current of the last MS1 scan
+#   base_peak - Base peak intensity of the last MS1 scan
+#   precursor_coverage - Fraction of the precursor m/z bins with at least one
+#                        MS2 scan
+QCSnapshot = collections.namedtuple('QCSnapshot',
+                                    ['rt',
+                                     'ms1_count',
+                                     'ms2_count',
+                                     'ms1_rate',
+                                     'ms2_rate',
+                                     'cycle_times',
+                                     'ms1_centroid_counts',
+                                     'ms2_centroid_counts',
+                                     'tic',
+                                     'base_peak',
+                                     'precursor_coverage'])
+
+class QuantileSketch:
+    """
+    Streaming estimator of the quantiles of a distribution, in the manner of
+    the merging t-digest.
+
+    The values are summarized by at most about compression centroids, the
+    means and weights of groups of neighboring values. The groups are small
+    in the tails and large around the median, so the extreme quantiles stay
+    accurate. The added values are buffered, and merged into the centroids
+    when the buffer is full, so adding a value costs O(1) amortized and the
+    memory is constant.
+
+    ...
+
+    Attributes
+    ----------
+    compression : float
+        Compression of the sketch, the higher the more accurate.
+    count : int
+        Number of values added.
+    """
+
+    # Default compression of the sketch
+    DEFAULT_COMPRESSION = 100
+    # Default number of values buffered before they are merged
+    DEFAULT_BUFFER_SIZE = 500
+
+    def __init__(self,
+                 compression = DEFAULT_COMPRESSION,
+                 buffer_size = DEFAULT_BUFFER_SIZE):
+        """
+        Parameters
+        ----------
+        compression : float
+            Compression of the sketch, the higher the more accurate.
+        buffer_size : int
+            Number of values buffered before they are merged.
+        """
+        self.compression = compression
+        self.count = 0
+        self.__means = np.empty(0)
+        self.__weights = np.empty(0)
+        self.__buffer = np.empty(buffer_size)
+        self.__buffered = 0
+        self.__min = math.inf
+        self.__max = -math.inf
+
+    def add(self, value):
+        """Adds a value to the sketch.
+
+        Parameters
+        ----------
+        value : float
+            The value.
+        """
+        self.__buffer[self.__buffered] = value
+        self.__buffered += 1
+        self.count += 1
+        if value < self.__min:
+            self.__min = value
+        if value > self.__max:
+            self.__max = value
+        if self.__buffered == len(self.__buffer):
+            self.__merge()
+
+    def quantiles(self, qs):
+        """Estimates quantiles of the added values.
+
+        Parameters
+        ----------
+        qs : array_like
+            Quantiles to estimate, between 0 and 1.
+
+        Returns
+        -------
+        numpy.ndarray
+            Estimates of the quantiles, NaN if no value was added.
+        """
+        qs = np.asarray(qs, dtype = np.float64)
+        if 0 == self.count:
+            return np.full(qs.shape, np.nan)
+        self.__merge()
+        # Each centroid is at the middle of its weight, between the minimal
+        # and maximal values at the ends of the distribution.
+        cumulative = np.cumsum(self.__weights)
+        positions = np.concatenate(([0.0], cumulative - self.__weights / 2,
+                                    [cumulative[-1]]))
+        values = np.concatenate(([self.__min], self.__means, [self.__max]))
+        return np.interp(qs * cumulative[-1], positions, values)
+
+    def __merge(self):
+        # Merges the buffer into the centroids. The sorted centroids are
+        # grouped by unit intervals of the scale function
+        # k(q) = compression / pi * asin(2q - 1) of the quantile before them,
+        # which makes about compression groups.
+        if 0 == self.__buffered:
+            return
+        means = np.concatenate((self.__means, self.__buffer[:self.__buffered]))
+        weights = np.concatenate((self.__weights, np.ones(self.__buffered)))
+        self.__buffered = 0
+        order = np.argsort(means, kind = 'stable')
+        means = means[order]
+        weights = weights[order]
+        before = (np.cumsum(weights) - weights) / weights.sum()
+        groups = np.floor(self.compression / math.pi *
+                          np.arcsin(2 * before - 1)).astype(np.int64)
+        starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+        self.__weights = np.add.reduceat(weights, starts)
+        self.__means = np.add.reduceat(means * weights, starts) / self.__weights
+
+class DecayedRate:
+    """
+    Rate of events decayed exponentially over time: the events of the last
+    half_life count the most, so the rate follows the recent changes with
+    constant memory.
+
+    ...
+
+    Attributes
+    ----------
+    half_life : float
+        Half life of the events, in the unit of the times.
+    """
+
+    def __init__(self, half_life):
+        """
+        Parameters
+        ----------
+        half_life : float
+            Half life of the events, in the unit of the times.
+        """
+        self.half_life = half_life
+        self.__time_constant = half_life / math.log(2)
+        self.__rate = 0.0
+        self.__time = None
+
+    def add(self, time, count = 1):
+        """Adds events.
+
+        Parameters
+        ----------
+        time : float
+            Time of the events.
+        count : float
+            Number of events.
+        """
+        self.__rate = self.rate(time) + count / self.__time_constant
+        self.__time = time
+
+    def rate(self, time):
+        """Returns the rate at a time, in events per unit of time.
+
+        Parameters
+        ----------
+        time : float
+            Time of the rate, not before the last events.
+        """
+        if self.__time is None:
+            return 0.0
+        return self.__rate * math.exp(-(time - self.__time) / self.__time_constant)
+
+class Trace:
+    """
+    Trace of a value over time, eg. the total ion current, kept in at most
+    max_points bins. The bins start at bin_width, and their width doubles,
+    merging pairs of bins, each time the trace reaches max_points bins, so
+    the memory is constant for acquisitions of any length.
+
+    ...
+
+    Attributes
+    ----------
+    reduction : str
+        'mean' to keep the mean value of each bin, 'max' to keep its maximal
+        value.
+    bin_width : float
+        Current width of the bins, in the unit of the times.
+    """
+
+    # Default number of bins of the traces
+    DEFAULT_MAX_POINTS = 1000
+
+    def __init__(self,
+                 bin_width,
+                 reduction = 'mean',
+                 max_points = DEFAULT_MAX_POINTS):
+        """
+        Parameters
+        ----------
+        bin_width : float
+            Initial width of the bins, in the unit of the times.
+        reduction : str
+            'mean' to keep the mean value of each bin, 'max' to keep its
+            maximal value.
+        max_points : int
+            Maximal number of bins, an even number.
+        """
+        if reduction not in ('mean', 'max'):
+            raise ValueError(f'Unknown reduction of the trace: {reduction}')
+        self.reduction = reduction
+        self.bin_width = bin_width
+        self.__values = np.zeros(max_points)
+        self.__counts = np.zeros(max_points, dtype = np.int64)
+        self.__start = None
+
+    def add(self, time, value):
+        """Adds a value to the trace.
+
+        Parameters
+        ----------
+        time : float
+            Time of the value. Values before the first value, eg. of scans
+            received out of order, are added to the first bin.
+        value : float
+            The value.
+        """
+        if self.__start is None:
+            self.__start = time
+        index = max(int((time - self.__start) / self.bin_width), 0)
+        while index >= len(self.__values):
+            self.__halve()
+            index = int((time - self.__start) / self.bin_width)
+        if 'mean' == self.reduction:
+            self.__values[index] += value
+        elif 0 == self.__counts[index] or value > self.__values[index]:
+            self.__values[index] = value
+        self.__counts[index] += 1
+
+    def points(self):
+        """Returns the trace.
+
+        Returns
+        -------
+        tuple
+            (times, values) of the bins with values, where the times are the
+            starts of the bins.
+        """
+        filled = np.flatnonzero(self.__counts)
+        if self.__start is None:
+            return np.empty(0), np.empty(0)
+        values = self.__values[filled]
+        if 'mean' == self.reduction:
+            values = values / self.__counts[filled]
+        return self.__start + filled * self.bin_width, values
+
+    def __halve(self):
+        # Merges the pairs of bins, doubling their width.
+        half = len(self.__values) // 2
+        if 'mean' == self.reduction:
+            merged = self.__values.reshape(half, 2).sum(axis = 1)
+        else:
+            merged = self.__values.reshape(half, 2).max(axis = 1)
+        counts = self.__counts.reshape(half, 2).sum(axis = 1)
+        self.__values[:half] = merged
+        self.__values[half:] = 0
+        self.__counts[:half] = counts
+        self.__counts[half:] = 0
+        self.bin_width *= 2
+
+class QCMetrics:
+    """
+    Quality control metrics of an acquisition, updated as the scans are
+    received: total ion current and base peak traces, MS1 and MS2 scan
+    rates, cycle time and centroid count distributions, and the coverage of
+    the precursor m/z range by the MS2 scans.
+
+    All metrics use streaming estimators of constant memory, and a scan
+    updates them in constant time, besides summing its centroids.
+
+    ...
+
+    Attributes
+    ----------
+    snapshot_interval : float
+        Retention time between two snapshots in minutes.
+    snapshots : collections.deque
+        Last snapshots, QCSnapshot tuples.
+    """
+
+    # Default half life of the scan rates in seconds
+    DEFAULT_HALF_LIFE = 10.0
+    # Default retention time between two snapshots in minutes
+    DEFAULT_SNAPSHOT_INTERVAL = 1.0
+    # Default number of snapshots kept
+    DEFAULT_MAX_SNAPSHOTS = 1000
+    # Default initial width of the bins of the traces in minutes
+    DEFAULT_TRACE_BIN_WIDTH = 0.01
+    # Default m/z range of the precursors, and width of its bins
+    DEFAULT_MZ_RANGE = (350.0, 1500.0)
+    DEFAULT_MZ_BIN_WIDTH = 10.0
+
+    def __init__(self,
+                 half_life = DEFAULT_HALF_LIFE,
+                 snapshot_interval = DEFAULT_SNAPSHOT_INTERVAL,
+                 max_snapshots = DEFAULT_MAX_SNAPSHOTS,
+                 trace_bin_width = DEFAULT_TRACE_BIN_WIDTH,
+                 mz_range = DEFAULT_MZ_RANGE,
+                 mz_bin_width = DEFAULT_MZ_BIN_WIDTH):
+        """
+        Parameters
+        ----------
+        half_life : float
+            Half life of the scan rates in seconds.
+        snapshot_interval : float
+            Retention time between two snapshots in minutes.
+        max_snapshots : int
+            Number of snapshots kept.
+        trace_bin_width : float
+            Initial width of the bins of the traces in minutes.
+        mz_range : tuple
+            (min, max) m/z range of the precursors.
+        mz_bin_width : float
+            Width of the bins of the precursor m/z range.
+        """
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = collections.deque(maxlen = max_snapshots)
+        self.__rates = {1 : DecayedRate(half_life), 2 : DecayedRate(half_life)}
+        self.__counts = {1 : 0, 2 : 0}
+        self.__centroid_counts = {1 : QuantileSketch(), 2 : QuantileSketch()}
+        self.__cycle_times = QuantileSketch()
+        self.__tic = Trace(trace_bin_width, 'mean')
+        self.__base_peak = Trace(trace_bin_width, 'max')
+        self.__mz_range = mz_range
+        self.__mz_bin_width = mz_bin_width
+        self.__precursors = np.zeros(int(math.ceil((mz_range[1] - mz_range[0]) /
+                                                   mz_bin_width)), dtype = np.int64)
+        self.__last_ms1 = None
+        self.__last_tic = 0.0
+        self.__last_base_peak = 0.0
+        self.__rt = 0.0
+        self.__next_snapshot = None
+
+    def add_scan(self, scan):
+        """Updates the metrics with a received scan.
+
+        Parameters
+        ----------
+        scan : list
+            The scan, see ScanFields.
+
+        Returns
+        -------
+        QCSnapshot
+            A snapshot if one is due, otherwise None.
+        """
+        rt = scan[sf.RETENTION_TIME]
+        seconds = rt * 60
+        level = 1 if 1 == scan[sf.MS_SCAN_LEVEL] else 2
+        self.__rt = rt
+        self.__counts[level] += 1
+        self.__rates[level].add(seconds)
+        self.__centroid_counts[level].add(scan[sf.CENTROID_COUNT])
+        if 1 == level:
+            intensities = [centroid[cf.INTENSITY] for centroid in scan[sf.CENTROIDS]]
+            self.__last_tic = sum(intensities)
+            self.__last_base_peak = float(max(intensities, default = 0.0))
+            self.__tic.add(rt, self.__last_tic)
+            self.__base_peak.add(rt, self.__last_base_peak)
+            if self.__last_ms1 is not None:
+                self.__cycle_times.add(seconds - self.__last_ms1)
+            self.__last_ms1 = seconds
+        else:
+            index = int((scan[sf.PRECURSOR_MASS] - self.__mz_range[0]) //
+                        self.__mz_bin_width)
+            if 0 <= index < len(self.__precursors):
+                self.__precursors[index] += 1
+
+        if self.__next_snapshot is None:
+            self.__next_snapshot = rt + self.snapshot_interval
+        elif rt >= self.__next_snapshot:
+            self.__next_snapshot += self.snapshot_interval * math.floor(
+                (rt - self.__next_snapshot) / self.snapshot_interval + 1)
+            snapshot = self.snapshot()
+            self.snapshots.append(snapshot)
+            return snapshot
+        return None
+
+    def snapshot(self):
+        """Returns the current metrics.
+
+        Returns
+        -------
+        QCSnapshot
+            The metrics at the last scan.
+        """
+        seconds = self.__rt * 60
+        quantiles = lambda sketch: dict(zip(SNAPSHOT_QUANTILES,
+                                            sketch.quantiles(SNAPSHOT_QUANTILES).tolist()))
+        return QCSnapshot(self.__rt,
+                          self.__counts[1],
+                          self.__counts[2],
+                          self.__rates[1].rate(seconds),
+                          self.__rates[2].rate(seconds),
+                          quantiles(self.__cycle_times),
+                          quantiles(self.__centroid_counts[1]),
+                          quantiles(self.__centroid_counts[2]),
+                          self.__last_tic,
+                          self.__last_base_peak,
+                          float(np.count_nonzero(self.__precursors)) /
+                          len(self.__precursors))
+
+    def tic_trace(self):
+        """Returns the (rts, values) trace of the mean total ion current of
+        the MS1 scans."""
+        return self.__tic.points()
+
+    def base_peak_trace(self):
+        """Returns the (rts, values) trace of the maximal base peak intensity
+        of the MS1 scans."""
+        return self.__base_peak.points()
+
+    def precursor_histogram(self):
+        """Returns the (bin_starts, counts) histogram of the precursor m/z of
+        the MS2 scans."""
+        return (self.__mz_range[0] +
+                np.arange(len(self.__precursors)) * self.__mz_bin_width,
+                self.__precursors.copy())
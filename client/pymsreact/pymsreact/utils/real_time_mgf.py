@@ -32,14 +32,16 @@ class RealTimeMGFWriter:
         self._file_object.flush()
         self._file_object.close()
     
-    def write_scan(self, scan):
+    def write_scan(self, scan, mzs = None):
+        # mzs replaces the m/z values of the centroids in the file, eg. after
+        # their recalibration, without modifying the scan.
         try:
-            self._scan_buffer.put(scan, block=False)
+            self._scan_buffer.put((scan, mzs), block=False)
         except queue.Full:
             self._logger.info("MGFWriter buffer is full, rate of receiving "
                               + "scans is higher than rate of processing.")
         
-    def _convert_scan(self, scan):
+    def _convert_scan(self, scan, mzs = None):
         scan_head = "BEGIN IONS\n" + \
                     f"TITLE=controllerType={0} " + \
                     f"controllerNumber={1} " + \
@@ -48,8 +50,12 @@ class RealTimeMGFWriter:
                     f"RTINSECONDS={60 * scan[sf.RETENTION_TIME]}\n" + \
                     f"PEPMASS={scan[sf.PRECURSOR_MASS]}\n"
                     
-        spectra = "".join(f"{round(c[cf.MZ], 5)} {round(c[cf.INTENSITY], 3)}\n"
-                          for c in scan[sf.CENTROIDS])
+        if mzs is None:
+            spectra = "".join(f"{round(c[cf.MZ], 5)} {round(c[cf.INTENSITY], 3)}\n"
+                              for c in scan[sf.CENTROIDS])
+        else:
+            spectra = "".join(f"{round(mz, 5)} {round(c[cf.INTENSITY], 3)}\n"
+                              for mz, c in zip(mzs.tolist(), scan[sf.CENTROIDS]))
                     
         scan_tail = "END IONS\n\n"
         
@@ -65,8 +71,8 @@ class RealTimeMGFWriter:
         self._logger.info("MGF writer starting...")
         while True:
             try:
-                scan = self._scan_buffer.get_nowait()
-                self._mgf_string = self._mgf_string + self._convert_scan(scan)
+                scan, mzs = self._scan_buffer.get_nowait()
+                self._mgf_string = self._mgf_string + self._convert_scan(scan, mzs)
                 self._scan_count = self._scan_count + 1
                 if self._scan_count >= self.BUF_LEN:
                     self._write_to_file()
@@ -0,0 +1,208 @@
+import numpy as np
+
+class MassRecalibration:
+    """
+    Recalibrates the m/z values of the scans from the mass errors of known
+    ions, tracked over a sliding window of retention time.
+
+    The mass errors are measured on lock masses found in the survey scans,
+    and on references added by the algorithm, eg. the precursors of
+    high-confidence identifications. They are kept in a ring of
+    max_observations preallocated slots. After each update, the errors in ppm
+    measured within the last window minutes are fitted by least squares, as
+    a constant or a linear function of m/z, plus a linear trend in time
+    evaluated at the latest scan, so the correction follows the drift
+    instead of lagging half a window behind it. The correction is applied to
+    the m/z arrays in place, with a reused scratch buffer, so correcting a
+    scan allocates no memory.
+
+    The observed m/z values must be the measured ones, before the correction.
+
+    ...
+
+    Attributes
+    ----------
+    lock_mzs : numpy.ndarray
+        m/z values of the lock masses, in ascending order.
+    tolerance : float
+        Tolerance in ppm of the search of the lock masses.
+    window : float
+        Length of the sliding window in minutes.
+    degree : int
+        Degree of the correction, 0 for a constant error, 1 for an error
+        linear in m/z.
+    min_observations : int
+        Minimal number of observations in the window to correct the scans.
+    """
+
+    # Polysiloxane ion commonly used as lock mass
+    POLYSILOXANE_MZ = 445.120025
+    # Default tolerance of the search of the lock masses in ppm
+    DEFAULT_TOLERANCE = 20
+    # Default length of the sliding window in minutes
+    DEFAULT_WINDOW = 1.0
+    # Default minimal number of observations to correct the scans
+    DEFAULT_MIN_OBSERVATIONS = 3
+    # Default number of observations kept
+    DEFAULT_MAX_OBSERVATIONS = 10000
+
+    def __init__(self,
+                 lock_mzs = (POLYSILOXANE_MZ,),
+                 tolerance = DEFAULT_TOLERANCE,
+                 window = DEFAULT_WINDOW,
+                 degree = 0,
+                 min_intensity = 0,
+                 min_observations = DEFAULT_MIN_OBSERVATIONS,
+                 max_observations = DEFAULT_MAX_OBSERVATIONS):
+        """
+        Parameters
+        ----------
+        lock_mzs : array_like
+            m/z values of the lock masses.
+        tolerance : float
+            Tolerance in ppm of the search of the lock masses.
+        window : float
+            Length of the sliding window in minutes.
+        degree : int
+            Degree of the correction, 0 for a constant error, 1 for an error
+            linear in m/z. A linear correction needs observations spread over
+            the m/z range, eg. several lock masses.
+        min_intensity : float
+            Minimal intensity of the centroids of the lock masses.
+        min_observations : int
+            Minimal number of observations in the window to correct the
+            scans.
+        max_observations : int
+            Number of observations kept.
+        """
+        if degree not in (0, 1):
+            raise ValueError(f'Unsupported degree of the correction: {degree}')
+        self.lock_mzs = np.sort(np.asarray(lock_mzs, dtype = np.float64))
+        self.tolerance = tolerance
+        self.window = window
+        self.degree = degree
+        self.min_intensity = min_intensity
+        self.min_observations = min_observations
+        self.__rts = np.full(max_observations, -np.inf)
+        self.__mzs = np.zeros(max_observations)
+        self.__errors = np.zeros(max_observations)
+        self.__added = 0
+        # Coefficients of the error in ppm, offset + slope * m/z
+        self.__offset = 0.0
+        self.__slope = 0.0
+        self.__scratch = np.empty(0)
+
+    @property
+    def correction(self):
+        """(offset, slope) of the current mass error in ppm, offset + slope *
+        m/z."""
+        return self.__offset, self.__slope
+
+    def observe(self, mzs, intensities, rt):
+        """Measures the mass errors of the lock masses in a scan, and updates
+        the correction.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            Measured m/z values of the centroids, in ascending order.
+        intensities : numpy.ndarray
+            Intensities of the centroids.
+        rt : float
+            Retention time of the scan in minutes.
+
+        Returns
+        -------
+        int
+            Number of lock masses found in the scan.
+        """
+        if 0 == len(mzs) or 0 == len(self.lock_mzs):
+            self.__fit(rt)
+            return 0
+        # Closest centroid of each lock mass
+        position = np.searchsorted(mzs, self.lock_mzs)
+        lower = np.maximum(position - 1, 0)
+        upper = np.minimum(position, len(mzs) - 1)
+        closest = np.where(np.abs(mzs[lower] - self.lock_mzs) <=
+                           np.abs(mzs[upper] - self.lock_mzs), lower, upper)
+        found = ((np.abs(mzs[closest] - self.lock_mzs) <=
+                  self.tolerance * 1e-6 * self.lock_mzs) &
+                 (intensities[closest] >= self.min_intensity))
+        self.add_references(mzs[closest[found]], self.lock_mzs[found], rt)
+        return int(np.count_nonzero(found))
+
+    def add_references(self, measured_mzs, theoretical_mzs, rt):
+        """Adds the mass errors of known ions, and updates the correction.
+
+        Parameters
+        ----------
+        measured_mzs : array_like
+            Measured m/z values of the ions, before the correction.
+        theoretical_mzs : array_like
+            Theoretical m/z values of the ions.
+        rt : float
+            Retention time of the measurement in minutes.
+        """
+        measured_mzs = np.atleast_1d(np.asarray(measured_mzs, dtype = np.float64))
+        theoretical_mzs = np.atleast_1d(np.asarray(theoretical_mzs, dtype = np.float64))
+        # Only the last observations are kept if there are more than slots.
+        count = min(len(measured_mzs), len(self.__rts))
+        if count:
+            measured_mzs = measured_mzs[-count:]
+            theoretical_mzs = theoretical_mzs[-count:]
+            slots = (self.__added + np.arange(count)) % len(self.__rts)
+            self.__rts[slots] = rt
+            self.__mzs[slots] = theoretical_mzs
+            self.__errors[slots] = (measured_mzs - theoretical_mzs) / theoretical_mzs * 1e6
+            self.__added += count
+        self.__fit(rt)
+
+    def correct(self, mzs):
+        """Corrects m/z values in place.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            Measured m/z values, a float64 array that is overwritten with the
+            corrected values.
+
+        Returns
+        -------
+        numpy.ndarray
+            The corrected array, mzs itself.
+        """
+        if 0 == self.__slope:
+            mzs /= 1 + self.__offset * 1e-6
+            return mzs
+        if len(self.__scratch) < len(mzs):
+            self.__scratch = np.empty(len(mzs))
+        factor = self.__scratch[:len(mzs)]
+        # measured = true * (1 + error * 1e-6), with the error computed at
+        # the measured m/z, which differs from the true one by a few ppm.
+        np.multiply(mzs, self.__slope * 1e-6, out = factor)
+        factor += 1 + self.__offset * 1e-6
+        np.divide(mzs, factor, out = mzs)
+        return mzs
+
+    def __fit(self, rt):
+        # Fits the correction to the errors of the window ending at rt, with
+        # a linear trend in time so the correction does not lag behind the
+        # drift, and evaluates it at rt.
+        recent = self.__rts >= rt - self.window
+        if np.count_nonzero(recent) < self.min_observations:
+            self.__offset = 0.0
+            self.__slope = 0.0
+            return
+        errors = self.__errors[recent]
+        columns = [np.ones(len(errors))]
+        times = self.__rts[recent] - rt
+        if np.ptp(times) > 0:
+            columns.append(times)
+        mzs = self.__mzs[recent]
+        linear = (1 == self.degree) and (np.ptp(mzs) > 0)
+        if linear:
+            columns.append(mzs)
+        coefficients = np.linalg.lstsq(np.column_stack(columns), errors,
+                                       rcond = None)[0]
+        self.__offset = float(coefficients[0])
+        self.__slope = float(coefficients[-1]) if linear else 0.0
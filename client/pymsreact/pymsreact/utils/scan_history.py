@@ -0,0 +1,196 @@
+import numpy as np
+
+class ScanHistory:
+    """
+    History of the last survey scans, kept in preallocated arrays, from which
+    extracted ion chromatograms (XIC) of many m/z values are extracted at
+    once.
+
+    Each scan takes a row of the arrays, and the rows are reused as a ring,
+    evicting the oldest scan. A row holds search keys, the m/z values of the
+    centroids offset by the row index times KEY_SPACING, and the prefix sums
+    of their intensities. Since the keys of all rows are sorted as one flat
+    array, the m/z windows of all queried m/z values in all scans are found
+    with a single binary search, and their intensities are differences of
+    prefix sums. Adding a scan writes into its row, without allocating new
+    arrays. Scans with more centroids than a row holds keep their most
+    intense centroids.
+
+    The memory of the history is max_scans * (2 * max_centroids + 1) * 8
+    bytes.
+
+    ...
+
+    Attributes
+    ----------
+    max_scans : int
+        Number of scans kept.
+    max_centroids : int
+        Number of centroids kept per scan.
+    """
+
+    # Default number of scans kept
+    DEFAULT_MAX_SCANS = 100
+    # Default number of centroids kept per scan
+    DEFAULT_MAX_CENTROIDS = 10000
+    # Offset of the m/z values between two rows of the history, above any m/z
+    KEY_SPACING = 100000.0
+    # Default tolerance of the chromatograms in ppm
+    DEFAULT_TOLERANCE = 10
+
+    def __init__(self,
+                 max_scans = DEFAULT_MAX_SCANS,
+                 max_centroids = DEFAULT_MAX_CENTROIDS):
+        """
+        Parameters
+        ----------
+        max_scans : int
+            Number of scans kept.
+        max_centroids : int
+            Number of centroids kept per scan.
+        """
+        self.max_scans = max_scans
+        self.max_centroids = max_centroids
+        self.__offsets = np.arange(max_scans, dtype = np.float64) * self.KEY_SPACING
+        # Unused columns are padded with the largest key of the row.
+        self.__keys = np.repeat((self.__offsets + self.KEY_SPACING / 2)[:, None],
+                                max_centroids, axis = 1)
+        self.__cumulative = np.zeros((max_scans, max_centroids + 1))
+        self.__counts = np.zeros(max_scans, dtype = np.intp)
+        self.__rts = np.full(max_scans, np.nan)
+        self.__scan_numbers = np.full(max_scans, -1, dtype = np.int64)
+        # Number of scans added so far
+        self.__added = 0
+
+    def __len__(self):
+        return min(self.__added, self.max_scans)
+
+    def add(self, mzs, intensities, rt, scan_number = -1):
+        """Adds a scan to the history, evicting the oldest one if the history
+        is full.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            m/z values of the centroids, in ascending order.
+        intensities : numpy.ndarray
+            Intensities of the centroids.
+        rt : float
+            Retention time of the scan in minutes.
+        scan_number : int
+            Scan number of the scan.
+        """
+        mzs = np.asarray(mzs, dtype = np.float64)
+        intensities = np.asarray(intensities, dtype = np.float64)
+        if len(mzs) > self.max_centroids:
+            kept = np.sort(np.argpartition(intensities, len(mzs) - self.max_centroids)
+                           [len(mzs) - self.max_centroids:])
+            mzs = mzs[kept]
+            intensities = intensities[kept]
+        row = self.__added % self.max_scans
+        count = len(mzs)
+        keys = self.__keys[row]
+        np.add(mzs, self.__offsets[row], out = keys[:count])
+        keys[count:] = self.__offsets[row] + self.KEY_SPACING / 2
+        cumulative = self.__cumulative[row]
+        np.cumsum(intensities, out = cumulative[1:count + 1])
+        cumulative[count + 1:] = cumulative[count]
+        self.__counts[row] = count
+        self.__rts[row] = rt
+        self.__scan_numbers[row] = scan_number
+        self.__added += 1
+
+    def rows(self):
+        """Returns the rows of the scans of the history, from the oldest
+        scan."""
+        if self.__added <= self.max_scans:
+            return np.arange(self.__added)
+        first = self.__added % self.max_scans
+        return np.concatenate((np.arange(first, self.max_scans),
+                               np.arange(first)))
+
+    @property
+    def rts(self):
+        """Retention times of the scans of the history, from the oldest
+        scan."""
+        return self.__rts[self.rows()]
+
+    @property
+    def scan_numbers(self):
+        """Scan numbers of the scans of the history, from the oldest scan."""
+        return self.__scan_numbers[self.rows()]
+
+    def scan(self, index):
+        """Returns a scan of the history.
+
+        Parameters
+        ----------
+        index : int
+            Index of the scan, from the oldest scan. Negative indices count
+            from the latest scan.
+
+        Returns
+        -------
+        tuple
+            (mzs, intensities, rt, scan_number) of the scan.
+        """
+        row = self.rows()[index]
+        count = self.__counts[row]
+        return (self.__keys[row, :count] - self.__offsets[row],
+                np.diff(self.__cumulative[row, :count + 1]),
+                self.__rts[row],
+                self.__scan_numbers[row])
+
+    def xic(self,
+            mzs,
+            tolerance = DEFAULT_TOLERANCE,
+            ppm = True,
+            rt_range = None):
+        """Extracts the ion chromatograms of m/z values: the summed intensity
+        of the centroids within the tolerance of each m/z in each scan.
+
+        Parameters
+        ----------
+        mzs : array_like
+            m/z values of the chromatograms.
+        tolerance : float
+            Tolerance in m/z, or in ppm if ppm is True.
+        ppm : bool
+            True if the tolerance is given in ppm.
+        rt_range : tuple
+            (start, end) retention times in minutes of the scans to extract,
+            or None to extract all scans of the history.
+
+        Returns
+        -------
+        tuple
+            (rts, intensities) where rts are the retention times of the
+            extracted scans from the oldest one, and intensities is an array
+            with a row of intensities per m/z and a column per scan.
+        """
+        mzs = np.atleast_1d(np.asarray(mzs, dtype = np.float64))
+        # The binary search is faster for sorted values.
+        order = np.argsort(mzs)
+        mzs = mzs[order]
+        rows = self.rows()
+        if rt_range is not None:
+            rts = self.__rts[rows]
+            rows = rows[(rt_range[0] <= rts) & (rts <= rt_range[1])]
+        if ppm:
+            tolerance = tolerance * 1e-6 * mzs
+        # Windows of all m/z values in all rows, as (row, m/z) arrays
+        offsets = self.__offsets[rows][:, None]
+        flat_keys = self.__keys.reshape(-1)
+        low = np.searchsorted(flat_keys, (offsets + (mzs - tolerance)).ravel(),
+                              side = 'left')
+        high = np.searchsorted(flat_keys, (offsets + (mzs + tolerance)).ravel(),
+                               side = 'right')
+        # Positions in the flat keys are converted to positions in the flat
+        # prefix sums, that have one more column per row.
+        row_index = np.repeat(rows, len(mzs))
+        flat_cumulative = self.__cumulative.reshape(-1)
+        intensities = (flat_cumulative[high + row_index] -
+                       flat_cumulative[low + row_index])
+        chromatograms = np.empty((len(mzs), len(rows)))
+        chromatograms[order] = intensities.reshape(len(rows), len(mzs)).T
+        return self.__rts[rows], chromatograms
@@ -0,0 +1,252 @@
+import itertools
+import numpy as np
+from utils.precursor_selection import tolerance_mask
+
+class SpectrumClusters:
+    """
+    Clusters the MS2 spectra of an acquisition as they are received, so the
+    precursors whose spectra were already acquired several times can be left
+    out of the next selections.
+
+    A spectrum is binned into a vector of the square roots of the
+    intensities of its most intense peaks, normalized to unit length. The
+    vector is hashed by random projections into n_tables keys of n_bits
+    bits: similar vectors share the key of at least one table with a high
+    probability. A new spectrum is compared, by cosine similarity, only to
+    the clusters with a close precursor m/z and a shared key, and joins the
+    most similar one above min_similarity, or starts a new cluster.
+
+    The clusters are kept in preallocated arrays of max_clusters slots, each
+    holding the precursor, size, hash keys and vector of the first spectrum
+    of a cluster. When the slots are full, the cluster updated the longest
+    ago is evicted, so the memory stays bounded over any acquisition length:
+    max_clusters * (8 * max_peaks + 8 * n_tables + 40) bytes.
+
+    ...
+
+    Attributes
+    ----------
+    tolerance : float
+        Tolerance of the precursor m/z in ppm.
+    min_similarity : float
+        Minimal cosine similarity of a spectrum to the cluster it joins.
+    min_size : int
+        Default minimal number of spectra of the clusters whose precursors
+        are redundant.
+    max_clusters : int
+        Number of clusters kept.
+    max_peaks : int
+        Number of the most intense peaks of the binned spectra.
+    """
+
+    # Default tolerance of the precursor m/z in ppm
+    DEFAULT_TOLERANCE = 20
+    # Default minimal cosine similarity of a spectrum to its cluster
+    DEFAULT_MIN_SIMILARITY = 0.7
+    # Default minimal number of spectra of the redundant clusters
+    DEFAULT_MIN_SIZE = 3
+    # Default number of clusters kept
+    DEFAULT_MAX_CLUSTERS = 10000
+    # Default number of peaks of the binned spectra
+    DEFAULT_MAX_PEAKS = 50
+    # Default number of hash tables and bits per table
+    DEFAULT_TABLES = 8
+    DEFAULT_BITS = 6
+    # Width of the m/z bins, close to the mass difference of 1 Da between
+    # peptide fragments, and m/z range of the binned peaks
+    BIN_WIDTH = 1.0005079
+    MIN_MZ = 100.0
+    MAX_MZ = 2000.0
+
+    def __init__(self,
+                 tolerance = DEFAULT_TOLERANCE,
+                 min_similarity = DEFAULT_MIN_SIMILARITY,
+                 min_size = DEFAULT_MIN_SIZE,
+                 max_clusters = DEFAULT_MAX_CLUSTERS,
+                 max_peaks = DEFAULT_MAX_PEAKS,
+                 n_tables = DEFAULT_TABLES,
+                 n_bits = DEFAULT_BITS,
+                 seed = 0):
+        """
+        Parameters
+        ----------
+        tolerance : float
+            Tolerance of the precursor m/z in ppm.
+        min_similarity : float
+            Minimal cosine similarity of a spectrum to the cluster it joins.
+        min_size : int
+            Default minimal number of spectra of the clusters whose
+            precursors are redundant.
+        max_clusters : int
+            Number of clusters kept.
+        max_peaks : int
+            Number of the most intense peaks of the binned spectra.
+        n_tables : int
+            Number of hash tables. More tables find more similar clusters.
+        n_bits : int
+            Number of bits of the hash keys. More bits compare a spectrum to
+            fewer clusters.
+        seed : int
+            Seed of the random projections.
+        """
+        self.tolerance = tolerance
+        self.min_similarity = min_similarity
+        self.min_size = min_size
+        self.max_clusters = max_clusters
+        self.max_peaks = max_peaks
+        self.__bin_count = int(np.ceil((self.MAX_MZ - self.MIN_MZ) / self.BIN_WIDTH))
+        rng = np.random.default_rng(seed)
+        self.__projections = rng.standard_normal(
+            (self.__bin_count, n_tables * n_bits)).astype(np.float32)
+        self.__bit_values = (1 << np.arange(n_bits, dtype = np.int64))
+        self.__n_tables = n_tables
+        self.__n_bits = n_bits
+
+        # Slots of the clusters. Unused slots have an id of -1.
+        self.__ids = np.full(max_clusters, -1, dtype = np.int64)
+        self.__precursor_mzs = np.zeros(max_clusters, dtype = np.float64)
+        self.__charges = np.zeros(max_clusters, dtype = np.int64)
+        self.__sizes = np.zeros(max_clusters, dtype = np.int64)
+        self.__last_rts = np.zeros(max_clusters, dtype = np.float64)
+        self.__keys = np.zeros((max_clusters, n_tables), dtype = np.int64)
+        self.__bins = np.zeros((max_clusters, max_peaks), dtype = np.int32)
+        self.__weights = np.zeros((max_clusters, max_peaks), dtype = np.float32)
+        self.__id_counter = itertools.count()
+        self.__used = 0
+
+    def __len__(self):
+        return self.__used
+
+    def add(self, mzs, intensities, precursor_mz, rt, charge = 0):
+        """Adds an MS2 spectrum to the most similar cluster, or to a new
+        cluster.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            m/z values of the centroids of the spectrum.
+        intensities : numpy.ndarray
+            Intensities of the centroids.
+        precursor_mz : float
+            m/z of the precursor.
+        rt : float
+            Retention time of the spectrum in minutes.
+        charge : int
+            Charge of the precursor, 0 if unknown. An unknown charge matches
+            any charge.
+
+        Returns
+        -------
+        tuple
+            (cluster_id, size) of the cluster of the spectrum.
+        """
+        bins, weights = self.__vector(mzs, intensities)
+        keys = self.__hash(bins, weights)
+        used = slice(0, self.__used)
+
+        # Clusters of the same precursor sharing a hash key, scored by the
+        # dot product of their vector with the vector of the spectrum.
+        candidates = np.flatnonzero(
+            (np.abs(self.__precursor_mzs[used] - precursor_mz) <=
+             self.tolerance * 1e-6 * precursor_mz) &
+            ((charge == 0) | (self.__charges[used] == 0) |
+             (self.__charges[used] == charge)) &
+            (self.__keys[used] == keys).any(axis = 1))
+        if len(candidates):
+            dense = np.zeros(self.__bin_count, dtype = np.float32)
+            dense[bins] = weights
+            similarities = (dense[self.__bins[candidates]] *
+                            self.__weights[candidates]).sum(axis = 1)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.min_similarity:
+                slot = candidates[best]
+                self.__sizes[slot] += 1
+                self.__last_rts[slot] = rt
+                if 0 == self.__charges[slot]:
+                    self.__charges[slot] = charge
+                return int(self.__ids[slot]), int(self.__sizes[slot])
+
+        # New cluster, in a free slot or replacing the cluster updated the
+        # longest ago
+        if self.__used < self.max_clusters:
+            slot = self.__used
+            self.__used += 1
+        else:
+            slot = int(np.argmin(self.__last_rts))
+        self.__ids[slot] = next(self.__id_counter)
+        self.__precursor_mzs[slot] = precursor_mz
+        self.__charges[slot] = charge
+        self.__sizes[slot] = 1
+        self.__last_rts[slot] = rt
+        self.__keys[slot] = keys
+        self.__bins[slot] = 0
+        self.__weights[slot] = 0
+        self.__bins[slot, :len(bins)] = bins
+        self.__weights[slot, :len(weights)] = weights
+        return int(self.__ids[slot]), 1
+
+    def redundant(self, precursor_mzs, charges = None, min_size = None):
+        """Returns which precursors already have a cluster of at least
+        min_size spectra, eg. as the excluded callable of
+        :func:`~utils.precursor_selection.select_top_n`.
+
+        Parameters
+        ----------
+        precursor_mzs : numpy.ndarray
+            m/z values of the precursors.
+        charges : numpy.ndarray
+            Charges of the precursors, 0 if unknown. If None, the charges are
+            unknown and the clusters of any charge match.
+        min_size : int
+            Minimal number of spectra of the clusters. If None, the min_size
+            attribute is used.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, True for the redundant precursors.
+        """
+        min_size = self.min_size if min_size is None else min_size
+        precursor_mzs = np.asarray(precursor_mzs, dtype = np.float64)
+        large = np.flatnonzero(self.__sizes[:self.__used] >= min_size)
+        if charges is None:
+            return tolerance_mask(precursor_mzs, np.sort(self.__precursor_mzs[large]),
+                                  self.tolerance, ppm = True)
+        charges = np.asarray(charges, dtype = np.int64)
+        redundant = np.zeros(len(precursor_mzs), dtype = bool)
+        cluster_charges = self.__charges[large]
+        for charge in np.unique(charges).tolist():
+            checked = charges == charge
+            matching = (large if charge == 0 else
+                        large[(cluster_charges == 0) | (cluster_charges == charge)])
+            redundant[checked] = tolerance_mask(precursor_mzs[checked],
+                                                np.sort(self.__precursor_mzs[matching]),
+                                                self.tolerance, ppm = True)
+        return redundant
+
+    def __vector(self, mzs, intensities):
+        # Returns the bins and weights of the unit vector of a spectrum.
+        mzs = np.asarray(mzs, dtype = np.float64)
+        intensities = np.asarray(intensities, dtype = np.float64)
+        inside = (self.MIN_MZ <= mzs) & (mzs < self.MAX_MZ)
+        mzs = mzs[inside]
+        intensities = intensities[inside]
+        if len(mzs) > self.max_peaks:
+            top = np.argpartition(intensities, len(mzs) - self.max_peaks)[len(mzs) - self.max_peaks:]
+            mzs = mzs[top]
+            intensities = intensities[top]
+        bins = ((mzs - self.MIN_MZ) / self.BIN_WIDTH).astype(np.int32)
+        # Peaks falling in the same bin are summed.
+        bins, inverse = np.unique(bins, return_inverse = True)
+        weights = np.bincount(inverse, weights = np.sqrt(intensities),
+                              minlength = len(bins)).astype(np.float32)
+        norm = np.linalg.norm(weights)
+        if norm > 0:
+            weights /= norm
+        return bins, weights
+
+    def __hash(self, bins, weights):
+        # Returns the hash key of each table: the signs of the random
+        # projections of the vector, packed as bits.
+        signs = (weights @ self.__projections[bins]) > 0
+        return signs.reshape(self.__n_tables, self.__n_bits) @ self.__bit_values
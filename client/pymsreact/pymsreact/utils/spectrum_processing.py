@@ -0,0 +1,417 @@
+import collections
+import numpy as np
+from algorithms.manager.acquisition import ScanFields as sf, CentroidFields as cf
+from utils.isotopes import (ISOTOPE_SPACING, PROTON_MASS, ISOTOPE_RATIO_PER_DA,
+                            RATIO_TOLERANCE)
+
+# Offset of the m/z values between two spectra of a batch, above any m/z,
+# so the peaks of all spectra are sorted as one array
+KEY_SPACING = 100000.0
+
+# Batch of spectra, as the concatenated arrays of their peaks. The peaks of
+# each spectrum are in ascending order of m/z.
+#   mzs - m/z values of the peaks
+#   intensities - Intensities of the peaks
+#   charges - Charges of the peaks, 0 if unknown
+#   offsets - Index of the first peak of each spectrum, followed by the
+#             number of peaks, so spectrum i is offsets[i]:offsets[i + 1]
+Spectra = collections.namedtuple('Spectra',
+                                 ['mzs',
+                                  'intensities',
+                                  'charges',
+                                  'offsets'])
+
+def spectra_from_arrays(spectra):
+    """Creates a batch from the arrays of several spectra.
+
+    Parameters
+    ----------
+    spectra : list
+        (mzs, intensities) or (mzs, intensities, charges) arrays of each
+        spectrum, with the m/z values in ascending order.
+
+    Returns
+    -------
+    Spectra
+        The batch of the spectra.
+    """
+    counts = [len(spectrum[0]) for spectrum in spectra]
+    offsets = np.zeros(len(spectra) + 1, dtype = np.intp)
+    np.cumsum(counts, out = offsets[1:])
+    if 0 == len(spectra):
+        return Spectra(np.empty(0), np.empty(0), np.empty(0, dtype = np.int64), offsets)
+    mzs = np.concatenate([np.asarray(spectrum[0], dtype = np.float64)
+                          for spectrum in spectra])
+    intensities = np.concatenate([np.asarray(spectrum[1], dtype = np.float64)
+                                  for spectrum in spectra])
+    charges = np.concatenate([np.asarray(spectrum[2], dtype = np.int64)
+                              if len(spectrum) > 2 else
+                              np.zeros(len(spectrum[0]), dtype = np.int64)
+                              for spectrum in spectra])
+    return Spectra(mzs, intensities, charges, offsets)
+
+def spectra_from_scans(scans):
+    """Creates a batch from received scans.
+
+    Parameters
+    ----------
+    scans : list
+        Scans, whose centroids are in ScanFields.CENTROIDS.
+
+    Returns
+    -------
+    Spectra
+        The batch of the centroids of the scans.
+    """
+    # One list of all centroids is faster to convert than one per scan.
+    centroids = [centroid for scan in scans for centroid in scan[sf.CENTROIDS]]
+    offsets = np.zeros(len(scans) + 1, dtype = np.intp)
+    np.cumsum([len(scan[sf.CENTROIDS]) for scan in scans], out = offsets[1:])
+    return Spectra(np.array([centroid[cf.MZ] for centroid in centroids],
+                            dtype = np.float64),
+                   np.array([centroid[cf.INTENSITY] for centroid in centroids],
+                            dtype = np.float64),
+                   np.array([centroid[cf.CHARGE] for centroid in centroids],
+                            dtype = np.int64),
+                   offsets)
+
+def split_spectra(spectra):
+    """Splits a batch into the arrays of its spectra.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+
+    Returns
+    -------
+    list
+        (mzs, intensities, charges) arrays of each spectrum, views of the
+        arrays of the batch.
+    """
+    if 1 == len(spectra.offsets):
+        return []
+    bounds = spectra.offsets[1:-1]
+    return list(zip(np.split(spectra.mzs, bounds),
+                    np.split(spectra.intensities, bounds),
+                    np.split(spectra.charges, bounds)))
+
+def spectrum_indices(spectra):
+    """Returns the index of the spectrum of each peak of a batch."""
+    return np.repeat(np.arange(len(spectra.offsets) - 1), np.diff(spectra.offsets))
+
+def spectrum_max(values, offsets):
+    """Returns the maximum of the values of each spectrum, 0 for empty
+    spectra.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values of the peaks of a batch.
+    offsets : numpy.ndarray
+        Offsets of the spectra of the batch.
+
+    Returns
+    -------
+    numpy.ndarray
+        The maximum of each spectrum.
+    """
+    maxima = np.zeros(len(offsets) - 1, dtype = values.dtype)
+    # Empty spectra are left out of the reduction, the end of each spectrum
+    # being the start of the next non empty one.
+    filled = np.flatnonzero(np.diff(offsets) > 0)
+    if len(filled):
+        maxima[filled] = np.maximum.reduceat(values, offsets[filled])
+    return maxima
+
+def keep_peaks(spectra, kept):
+    """Returns the batch of the peaks of a mask.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    kept : numpy.ndarray
+        Boolean mask of the kept peaks.
+
+    Returns
+    -------
+    Spectra
+        The batch of the kept peaks.
+    """
+    # The new offsets are the numbers of kept peaks before the old ones.
+    kept_before = np.zeros(len(kept) + 1, dtype = np.intp)
+    np.cumsum(kept, out = kept_before[1:])
+    offsets = kept_before[spectra.offsets]
+    return Spectra(spectra.mzs[kept], spectra.intensities[kept],
+                   spectra.charges[kept], offsets)
+
+def filter_relative_intensity(spectra, min_relative = 0.01):
+    """Removes the peaks less intense than a fraction of the base peak of
+    their spectrum.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    min_relative : float
+        Minimal intensity relative to the base peak.
+
+    Returns
+    -------
+    Spectra
+        The filtered batch.
+    """
+    base = spectrum_max(spectra.intensities, spectra.offsets)
+    return keep_peaks(spectra, spectra.intensities >=
+                      min_relative * base[spectrum_indices(spectra)])
+
+def remove_noise(spectra, signal_to_noise = 3):
+    """Removes the peaks below a signal to noise ratio, the noise level of
+    a spectrum being the median intensity of its peaks.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    signal_to_noise : float
+        Minimal ratio of the intensity to the noise level.
+
+    Returns
+    -------
+    Spectra
+        The filtered batch.
+    """
+    indices = spectrum_indices(spectra)
+    counts = np.diff(spectra.offsets)
+    if 0 == len(indices):
+        return spectra
+    # Intensities sorted within each spectrum, with a single sort key: the
+    # index of the spectrum plus the intensity scaled below 1
+    scale = 2 * spectra.intensities.max() + 1
+    ordered = spectra.intensities[np.argsort(indices + spectra.intensities / scale)]
+    medians = ordered[np.minimum(spectra.offsets[:-1] + (counts - 1) // 2,
+                                 len(ordered) - 1)]
+    return keep_peaks(spectra, spectra.intensities >=
+                      signal_to_noise * medians[indices])
+
+def top_k_per_window(spectra, k = 6, window = 100.0):
+    """Keeps the k most intense peaks of each m/z window of each spectrum.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    k : int
+        Number of peaks kept per window.
+    window : float
+        Width of the m/z windows, starting at m/z 0.
+
+    Returns
+    -------
+    Spectra
+        The filtered batch.
+    """
+    if 0 == len(spectra.mzs):
+        return spectra
+    windows = (spectrum_indices(spectra) * np.ceil(KEY_SPACING / window) +
+               np.floor(spectra.mzs / window)).astype(np.int64)
+    # Peaks ordered by window, then by decreasing intensity scaled below 1.
+    # The rank of a peak in its window is its distance to the first peak of
+    # the window.
+    scale = 2 * spectra.intensities.max() + 1
+    order = np.argsort(windows + (1 - spectra.intensities / scale))
+    ordered = windows[order]
+    starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+    lengths = np.diff(np.append(starts, len(order)))
+    ranks = np.arange(len(order)) - np.repeat(starts, lengths)
+    kept = np.zeros(len(order), dtype = bool)
+    kept[order[ranks < k]] = True
+    return keep_peaks(spectra, kept)
+
+def deisotope(spectra, max_charge = 3, tolerance = 0.01):
+    """Removes the isotope peaks, and sets the charge of the monoisotopic
+    peaks of the envelopes.
+
+    A peak is an isotope peak if a peak of the same spectrum precedes it by
+    the isotope spacing of a charge up to max_charge, with an intensity
+    ratio possible for an averagine-like envelope. A peak followed by
+    isotope peaks gets the highest charge of its successors, unless its
+    charge is already known.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    max_charge : int
+        Highest charge of the fragments.
+    tolerance : float
+        Tolerance of the isotope spacing in m/z.
+
+    Returns
+    -------
+    Spectra
+        The deisotoped batch.
+    """
+    if 0 == len(spectra.mzs):
+        return spectra
+    mzs = spectra.mzs
+    intensities = spectra.intensities
+    # Keys of all peaks of the batch, in ascending order
+    keys = mzs + spectrum_indices(spectra) * KEY_SPACING
+    is_isotope = np.zeros(len(mzs), dtype = bool)
+    charges = spectra.charges.copy()
+    unknown = charges == 0
+    for charge in range(1, max_charge + 1):
+        spacing = ISOTOPE_SPACING / charge
+        # Closest peak at the spacing below each peak
+        targets = keys - spacing
+        position = np.searchsorted(keys, targets)
+        lower = np.maximum(position - 1, 0)
+        upper = np.minimum(position, len(keys) - 1)
+        previous = np.where(np.abs(keys[lower] - targets) <=
+                            np.abs(keys[upper] - targets), lower, upper)
+        mass = (mzs - PROTON_MASS) * charge
+        linked = ((np.abs(keys[previous] - targets) <= tolerance) &
+                  (intensities <= intensities[previous] * np.maximum(
+                      mass * ISOTOPE_RATIO_PER_DA * RATIO_TOLERANCE, 1.0)))
+        is_isotope |= linked
+        # Increasing charges overwrite the lower ones.
+        charges[previous[linked & unknown[previous]]] = charge
+    kept = ~is_isotope
+    return keep_peaks(Spectra(mzs, intensities, charges, spectra.offsets), kept)
+
+def reduce_charges(spectra):
+    """Converts the peaks of known charge above 1 to their singly charged m/z,
+    keeping the peaks of each spectrum in ascending order of m/z.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+
+    Returns
+    -------
+    Spectra
+        The batch of singly charged or unknown charge peaks.
+    """
+    multiple = spectra.charges > 1
+    if not np.any(multiple):
+        return spectra
+    mzs = np.where(multiple,
+                   (spectra.mzs - PROTON_MASS) * spectra.charges + PROTON_MASS,
+                   spectra.mzs)
+    charges = np.where(multiple, 1, spectra.charges)
+    order = np.argsort(mzs + spectrum_indices(spectra) * KEY_SPACING)
+    return Spectra(mzs[order], spectra.intensities[order], charges[order],
+                   spectra.offsets)
+
+def normalize_intensities(spectra, norm = 'max', transform = None):
+    """Normalizes the intensities of each spectrum.
+
+    Parameters
+    ----------
+    spectra : Spectra
+        The batch.
+    norm : str
+        'max' to scale the base peak to 1, 'sum' to scale the total intensity
+        to 1, 'l2' to scale the intensities to a unit vector.
+    transform : str
+        'sqrt' or 'log' to transform the intensities before the
+        normalization, None to keep them.
+
+    Returns
+    -------
+    Spectra
+        The normalized batch.
+    """
+    if transform is None:
+        intensities = spectra.intensities
+    elif 'sqrt' == transform:
+        intensities = np.sqrt(spectra.intensities)
+    elif 'log' == transform:
+        intensities = np.log1p(spectra.intensities)
+    else:
+        raise ValueError(f'Unknown intensity transform: {transform}')
+    if 0 == len(intensities):
+        return spectra
+    filled = np.diff(spectra.offsets) > 0
+    starts = spectra.offsets[:-1]
+    scales = np.zeros(len(starts))
+    if 'max' == norm:
+        scales = spectrum_max(intensities, spectra.offsets)
+    elif 'sum' == norm:
+        scales[filled] = np.add.reduceat(intensities, starts[filled])
+    elif 'l2' == norm:
+        scales[filled] = np.sqrt(np.add.reduceat(intensities ** 2, starts[filled]))
+    else:
+        raise ValueError(f'Unknown norm: {norm}')
+    scales = scales[spectrum_indices(spectra)]
+    normalized = np.zeros(len(intensities))
+    np.divide(intensities, scales, out = normalized, where = scales > 0)
+    return Spectra(spectra.mzs, normalized, spectra.charges, spectra.offsets)
+
+class SpectrumPipeline:
+    """
+    Sequence of preprocessing steps applied to batches of spectra.
+
+    A step is a function taking a batch and returning a batch, eg. one of the
+    functions of this module, with its parameters bound by
+    functools.partial.
+
+    ...
+
+    Attributes
+    ----------
+    steps : list
+        The steps, applied in order.
+    """
+
+    def __init__(self, steps):
+        """
+        Parameters
+        ----------
+        steps : list
+            The steps, applied in order.
+        """
+        self.steps = list(steps)
+
+    def __call__(self, spectra):
+        """Applies the steps to a batch.
+
+        Parameters
+        ----------
+        spectra : Spectra
+            The batch.
+
+        Returns
+        -------
+        Spectra
+            The processed batch.
+        """
+        for step in self.steps:
+            spectra = step(spectra)
+        return spectra
+
+    def process(self, mzs, intensities, charges = None):
+        """Applies the steps to a single spectrum.
+
+        Parameters
+        ----------
+        mzs : numpy.ndarray
+            m/z values of the peaks, in ascending order.
+        intensities : numpy.ndarray
+            Intensities of the peaks.
+        charges : numpy.ndarray
+            Charges of the peaks, 0 if unknown. If None, the charges are
+            unknown.
+
+        Returns
+        -------
+        tuple
+            (mzs, intensities, charges) arrays of the processed spectrum.
+        """
+        spectrum = ((mzs, intensities) if charges is None
+                    else (mzs, intensities, charges))
+        processed = self(spectra_from_arrays([spectrum]))
+        return processed.mzs, processed.intensities, processed.charges
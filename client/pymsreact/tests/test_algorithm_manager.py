@@ -0,0 +1,48 @@
+# Tests of the algorithm manager of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.algorithm_runner import AlgorithmManager
+from utils import discovery
+
+class TestAlgorithmManager(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(discovery, 'CACHE_DIR', cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = AlgorithmManager(None)
+
+    def test_instrument_events_before_selection_are_ignored(self):
+        self.manager.acquisition_started()
+        self.manager.deliver_scan({})
+        self.manager.received_recent_raw_file_names(['file'])
+        self.manager.acquisition_file_download_finished('file')
+        self.manager.scan_request_dropped(1)
+        self.manager.acquisition_ended()
+        self.assertIsNone(self.manager.acq_in_channel)
+
+    def test_errors_before_selection_are_kept(self):
+        self.manager.instrument_error()
+        self.assertTrue(self.manager.error.is_set())
+
+    def test_unknown_algorithms_are_not_selected(self):
+        self.assertFalse(self.manager.select_algorithm('unknown', None, 'Mock'))
+        self.manager.acquisition_started()
+        self.assertIsNone(self.manager.acq_in_channel)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Tests of the local scan broker of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import asyncio
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from com.broker import ScanBroker
+from com.protocol.msrp import MSReactProtocol
+from com.transport.local import FRAME_HEADER
+
+class Transport:
+    # Delivers the frames put in the received queue.
+    def __init__(self):
+        self.received = asyncio.Queue()
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+    async def receive(self):
+        return await self.received.get()
+
+class Protocol:
+    # Answers every command with the given response.
+    MessageIDs = MSReactProtocol.MessageIDs
+
+    def __init__(self, response):
+        self.tl = Transport()
+        self.response = response
+        self.connected = False
+
+    async def connect(self, address = None):
+        self.connected = True
+        return True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def send_message(self, msg, payload = None):
+        self.tl.received.put_nowait(self.response.to_bytes(1, 'big'))
+
+class Writer:
+    # Records the frames written to a subscriber.
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def frames(self):
+        frames = []
+        data = self.data
+        while data:
+            length, = FRAME_HEADER.unpack(data[:FRAME_HEADER.size])
+            data = data[FRAME_HEADER.size:]
+            frames.append(data[:length])
+            data = data[length:]
+        return frames
+
+class TestScanBroker(unittest.IsolatedAsyncioTestCase):
+
+    async def test_failed_start_releases_the_upstream_connection(self):
+        proto = Protocol(MSReactProtocol.MessageIDs.ERROR_RSP)
+        broker = ScanBroker(proto, '127.0.0.1:0')
+        self.assertFalse(await broker.start('server'))
+        self.assertIsNone(broker.upstream_task)
+        self.assertFalse(proto.connected)
+
+    async def test_malformed_commands_are_answered_with_an_error(self):
+        ids = MSReactProtocol.MessageIDs
+        broker = ScanBroker(Protocol(ids.OK_RSP), '127.0.0.1:0')
+        writer = Writer()
+        for frame in [b'', bytes([255]), ids.SELECT_INSTR_CMD.to_bytes(1, 'big')]:
+            await broker._ScanBroker__handle_command(writer, frame)
+        self.assertEqual(writer.frames(), [ids.ERROR_RSP.to_bytes(1, 'big'),
+                                           ids.ERROR_RSP.to_bytes(1, 'big'),
+                                           ids.OK_RSP.to_bytes(1, 'big')])
+
+    async def test_default_updates_of_non_owners_are_refused(self):
+        ids = MSReactProtocol.MessageIDs
+        proto = Protocol(ids.OK_RSP)
+        broker = ScanBroker(proto, '127.0.0.1:0')
+        self.assertTrue(await broker.start('server'))
+        async def send(frame):
+            proto.tl.sent.append(frame)
+            proto.tl.received.put_nowait(ids.OK_RSP.to_bytes(1, 'big'))
+        proto.tl.send = send
+        owner, other = Writer(), Writer()
+        update = ids.UPDATE_DEF_SCAN_PARAMS_CMD.to_bytes(1, 'big')
+        for writer in [owner, other, owner]:
+            await broker._ScanBroker__handle_command(writer, update)
+        await broker.stop()
+        self.assertEqual(proto.tl.sent, [update, update])
+        self.assertEqual(owner.frames(), [ids.OK_RSP.to_bytes(1, 'big')] * 2)
+        self.assertEqual(other.frames(), [ids.ERROR_RSP.to_bytes(1, 'big')])
+
+if __name__ == '__main__':
+    unittest.main()
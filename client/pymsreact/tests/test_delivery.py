@@ -0,0 +1,63 @@
+# Tests of the delivery channels of the acquisitions of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import queue
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.acquisition import AcqMsgIDs
+from algorithms.manager.delivery import DeliveryChannel, DropPolicies
+
+class TestDeliveryChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = queue.Queue()
+        self.channel = DeliveryChannel(self.queue, DropPolicies.DROP_OLDEST,
+                                       max_pending = 2)
+
+    def received(self):
+        messages = []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        return messages
+
+    def test_buffers_and_drops_when_behind(self):
+        for scan in range(6):
+            self.channel.deliver_scan(scan)
+        self.assertEqual(self.received(),
+                         [(AcqMsgIDs.SCAN, 0), (AcqMsgIDs.SCAN, 1)])
+        self.assertEqual(self.channel.pending, 2)
+        self.assertEqual(self.channel.dropped, 2)
+
+    def test_pump_forwards_once_caught_up(self):
+        for scan in range(4):
+            self.channel.deliver_scan(scan)
+        self.assertEqual(len(self.received()), 2)
+        self.channel.pump()
+        self.assertEqual(self.received(),
+                         [(AcqMsgIDs.SCAN, 2), (AcqMsgIDs.SCAN, 3)])
+        self.assertEqual(self.channel.pending, 0)
+
+    def test_control_messages_flush_the_buffered_scans(self):
+        for scan in range(4):
+            self.channel.deliver_scan(scan)
+        self.channel.put(AcqMsgIDs.ACQUISITION_ENDED)
+        self.assertEqual([msg for msg, _ in self.received()],
+                         [AcqMsgIDs.SCAN] * 4 + [AcqMsgIDs.ACQUISITION_ENDED])
+
+    def test_keep_all_forwards_every_scan(self):
+        channel = DeliveryChannel(self.queue)
+        for scan in range(4):
+            channel.deliver_scan(scan)
+        self.assertEqual(len(self.received()), 4)
+        self.assertEqual(channel.pending, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# Tests of the feature tracking of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.feature_tracker import FeatureTracker
+
+class TestFeatureTracker(unittest.TestCase):
+
+    def open_features(self, tracker):
+        return tracker._FeatureTracker__features
+
+    def test_open_features_stay_sorted_by_mz(self):
+        tracker = FeatureTracker(tolerance = 20, max_gap = 1, min_scans = 1)
+        rng = np.random.default_rng(0)
+        # Pairs of peaks closer than the tolerance, whose features swap
+        # centroids as their intensities change
+        peaks = np.sort(rng.uniform(400, 1200, 100))
+        peaks = np.sort(np.concatenate((peaks, peaks * (1 + 8e-6))))
+        for scan in range(30):
+            mzs = peaks * (1 + rng.normal(0, 4e-6, len(peaks)))
+            present = rng.random(len(peaks)) > 0.2
+            mzs = np.sort(np.concatenate((mzs[present],
+                                          rng.uniform(400, 1200, 20))))
+            tracker.add_scan(mzs, rng.uniform(1e3, 1e6, len(mzs)), scan * 0.01)
+            features = self.open_features(tracker)
+            self.assertTrue(np.all(np.diff(features['mz']) >= 0))
+            self.assertEqual(len(np.unique(features['feature_id'])),
+                             len(tracker))
+            # The fields of a feature are moved together.
+            self.assertTrue(np.all(features['last_scan'] >=
+                                   features['start_scan']))
+
+    def test_out_of_order_features_are_merged_again(self):
+        tracker = FeatureTracker(tolerance = 10, min_scans = 1)
+        tracker.add_scan([500.0, 600.0, 700.0], [1.0, 2.0, 3.0], 0.0)
+        # A feature extended past its neighbour, set directly since the
+        # extensions of a single scan stay between the neighbouring features.
+        self.open_features(tracker)['mz'][0] = 650.0
+        tracker.add_scan([800.0], [4.0], 0.1)
+        features = self.open_features(tracker)
+        self.assertEqual(features['mz'].tolist(), [600.0, 650.0, 700.0, 800.0])
+        self.assertEqual(features['last_intensity'].tolist(),
+                         [2.0, 1.0, 3.0, 4.0])
+        self.assertEqual(features['feature_id'].tolist(), [1, 0, 2, 3])
+
+    def test_extended_features_follow_their_centroids(self):
+        tracker = FeatureTracker(tolerance = 10, min_scans = 1)
+        tracker.add_scan([500.0, 500.004], [100.0, 100.0], 0.0)
+        ids = self.open_features(tracker)['feature_id'].copy()
+        # Each centroid extends its closest feature, by intensity weight.
+        tracker.add_scan([500.0015, 500.0025], [1e6, 1e6], 0.1)
+        features = self.open_features(tracker)
+        self.assertEqual(features['feature_id'].tolist(), ids.tolist())
+        self.assertTrue(np.all(np.diff(features['mz']) >= 0))
+        self.assertEqual(features['scans'].tolist(), [2, 2])
+
+    def test_features_close_after_max_gap_missing_scans(self):
+        tracker = FeatureTracker(max_gap = 2, min_scans = 2)
+        for scan in range(2):
+            self.assertEqual(tracker.add_scan([500.0, 600.0], [10.0, 20.0],
+                                              scan * 0.1), [])
+        # The feature at 500 may be missing from two scans.
+        for scan in range(2, 4):
+            self.assertEqual(tracker.add_scan([600.0], [20.0], scan * 0.1), [])
+        closed = tracker.add_scan([600.0], [20.0], 0.4)
+        self.assertEqual(len(closed), 1)
+        self.assertAlmostEqual(closed[0].mz, 500.0)
+        self.assertEqual(closed[0].start_rt, 0.0)
+        self.assertEqual(closed[0].end_rt, 0.1)
+        self.assertEqual(closed[0].rts.tolist(), [0.0, 0.1])
+        self.assertEqual(closed[0].intensities.tolist(), [10.0, 10.0])
+        self.assertEqual(len(tracker), 1)
+
+    def test_short_features_are_not_returned(self):
+        tracker = FeatureTracker(max_gap = 0, min_scans = 2)
+        tracker.add_scan([500.0], [10.0], 0.0)
+        self.assertEqual(tracker.add_scan([], [], 0.1), [])
+        self.assertEqual(len(tracker), 0)
+
+    def test_peaked_features_are_triggered_once(self):
+        tracker = FeatureTracker(min_scans = 2)
+        for rt, intensity in [(0.0, 10.0), (0.1, 30.0), (0.2, 20.0)]:
+            tracker.add_scan([500.0], [intensity], rt)
+        ids, mzs, charges = tracker.peaked()
+        self.assertEqual(len(ids), 1)
+        self.assertAlmostEqual(mzs[0], 500.0)
+        tracker.mark_triggered(ids)
+        self.assertEqual(len(tracker.peaked()[0]), 0)
+        self.assertTrue(tracker.close_all()[0].triggered)
+
+if __name__ == '__main__':
+    unittest.main()
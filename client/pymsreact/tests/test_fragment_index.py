@@ -0,0 +1,92 @@
+# Tests of the fragment ion index of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.fragment_index import (digest, build_fragment_index, FragmentIndex,
+                                  AMINO_ACID_MASSES, DEFAULT_FIXED_MODIFICATIONS,
+                                  WATER_MASS)
+from utils.isotopes import PROTON_MASS
+
+PEPTIDES = ['PEPTIDECK', 'SAMPLERGHK', 'ELVISLIVESK', 'LLLLLLLK']
+
+def residue_masses(peptide):
+    return np.array([AMINO_ACID_MASSES[residue] +
+                     DEFAULT_FIXED_MODIFICATIONS.get(residue, 0.0)
+                     for residue in peptide])
+
+def peptide_mass(peptide):
+    return residue_masses(peptide).sum() + WATER_MASS
+
+def fragment_ions(peptide):
+    # Singly charged b and y ions of a peptide
+    prefixes = np.cumsum(residue_masses(peptide))[:-1]
+    return np.sort(np.concatenate((prefixes + PROTON_MASS,
+                                   peptide_mass(peptide) - prefixes + PROTON_MASS)))
+
+class TestDigest(unittest.TestCase):
+
+    def test_cleaves_after_k_and_r_but_not_before_p(self):
+        sequence = 'AAAAAAKPGGGGGGGRLLLLLLLK'
+        self.assertEqual(digest(sequence, missed_cleavages = 0),
+                         ['AAAAAAKPGGGGGGGR', 'LLLLLLLK'])
+        self.assertEqual(digest(sequence, missed_cleavages = 1),
+                         ['AAAAAAKPGGGGGGGR', sequence, 'LLLLLLLK'])
+
+    def test_length_limits(self):
+        self.assertEqual(digest('AAKGGGGGGGGR', missed_cleavages = 0), ['GGGGGGGGR'])
+        self.assertEqual(digest('AAKGGGGGGGGR', missed_cleavages = 0,
+                                min_length = 1, max_length = 3), ['AAK'])
+
+class TestFragmentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        source = os.path.join(self.folder.name, 'peptides.txt')
+        with open(source, 'w') as f:
+            # Peptides with unknown residues are not indexed.
+            f.write('# Test peptides\n' + '\n'.join(PEPTIDES) + '\nPEPTIDEXK\n')
+        index_dir = os.path.join(self.folder.name, 'index')
+        self.counts = build_fragment_index(source, index_dir)
+        self.index = FragmentIndex(index_dir, min_matched = 6)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_peptides_are_sorted_by_mass(self):
+        self.assertEqual(self.counts[0], len(PEPTIDES))
+        self.assertTrue(np.all(np.diff(self.index.peptide_masses) >= 0))
+        self.assertTrue(np.all(np.diff(self.index.fragment_mzs) >= 0))
+        np.testing.assert_allclose(sorted(self.index.peptide_masses),
+                                   sorted(peptide_mass(peptide)
+                                          for peptide in PEPTIDES))
+
+    def test_finds_the_peptide_of_its_fragments(self):
+        for peptide in PEPTIDES:
+            mzs = fragment_ions(peptide)
+            precursor_mz = peptide_mass(peptide) / 2 + PROTON_MASS
+            result = self.index.search(mzs, np.ones(len(mzs)), precursor_mz)
+            self.assertEqual(result.peptide, peptide)
+            self.assertEqual(result.charge, 2)
+            self.assertEqual(result.candidates, 1)
+            self.assertGreaterEqual(result.matched, 6)
+            self.assertAlmostEqual(result.mass, peptide_mass(peptide), places = 6)
+
+    def test_no_match_without_candidates_or_fragments(self):
+        mzs = fragment_ions('PEPTIDECK')
+        self.assertIsNone(self.index.search(mzs, np.ones(len(mzs)), 2000.0))
+        precursor_mz = peptide_mass('PEPTIDECK') / 2 + PROTON_MASS
+        self.assertIsNone(self.index.search(mzs[:3], np.ones(3), precursor_mz))
+
+if __name__ == '__main__':
+    unittest.main()
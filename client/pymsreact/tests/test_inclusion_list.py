@@ -0,0 +1,70 @@
+# Tests of the inclusion list of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.inclusion_list import InclusionList
+
+class TestInclusionList(unittest.TestCase):
+
+    def setUp(self):
+        self.targets = InclusionList([600.0, 500.0, 700.0],
+                                     [1.0, 1.0, 5.0],
+                                     [2.0, 3.5, 6.0],
+                                     charges = [2, 0, 3],
+                                     names = ['a', 'b', 'c'])
+
+    def test_active_targets_by_retention_time(self):
+        self.assertEqual(self.targets.active(1.5).tolist(), [1, 0])
+        self.assertEqual(self.targets.active(3.0).tolist(), [1])
+        self.assertEqual(self.targets.active(5.5).tolist(), [2])
+        self.assertEqual(self.targets.active(0.5).tolist(), [])
+        self.assertEqual(self.targets.active(10.0).tolist(), [])
+
+    def test_matches_the_closest_centroid_within_the_tolerance(self):
+        mzs = np.array([499.99, 500.002, 600.1])
+        targets, centroids = self.targets.match(1.5, mzs)
+        self.assertEqual(targets.tolist(), [1])
+        self.assertEqual(centroids.tolist(), [1])
+
+    def test_matches_the_charges(self):
+        mzs = np.array([500.0, 600.0])
+        targets, _ = self.targets.match(1.5, mzs, charges = np.array([3, 3]))
+        self.assertEqual(targets.tolist(), [1])
+        targets, _ = self.targets.match(1.5, mzs, charges = np.array([0, 0]))
+        self.assertEqual(targets.tolist(), [1, 0])
+
+    def test_invalid_windows_are_rejected(self):
+        with self.assertRaises(ValueError):
+            InclusionList([500.0], [2.0], [1.0])
+        with self.assertRaises(ValueError):
+            InclusionList([500.0], [1.0, 2.0], [3.0, 4.0])
+
+    def test_loads_the_targets_from_csv(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'targets.csv')
+            with open(path, 'w') as f:
+                f.write('mz,rt_start,rt_end,charge,name\n' +
+                        '500.0,1.0,2.0,2,first\n' +
+                        '600.0,1.5,2.5,,\n')
+            targets = InclusionList.from_file(path, tolerance = 5)
+            self.assertEqual(targets.names, ['first', '1'])
+            self.assertEqual(targets.charges.tolist(), [2, 0])
+            self.assertEqual(targets.tolerance, 5)
+            with open(path, 'a') as f:
+                f.write('700.0,,3.0,,\n')
+            with self.assertRaises(ValueError):
+                InclusionList.from_file(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# Tests of the isotope envelope detection of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.isotopes import (detect_envelopes, precursor_candidates,
+                            ISOTOPE_SPACING)
+
+# Doubly charged envelope at 500, with a peak in between, and a lone peak at
+# 700
+MZS = np.array([500.0, 500.3, 500.0 + ISOTOPE_SPACING / 2,
+                500.0 + ISOTOPE_SPACING, 700.0])
+INTENSITIES = np.array([100.0, 20.0, 80.0, 40.0, 50.0])
+
+class TestIsotopes(unittest.TestCase):
+
+    def test_detects_the_charge_and_monoisotopic_peak(self):
+        envelopes = detect_envelopes(MZS, INTENSITIES)
+        self.assertEqual(envelopes.charges.tolist(), [2, 0, 2, 2, 0])
+        self.assertEqual(envelopes.monoisotopic.tolist(), [0, 1, 0, 0, 4])
+        self.assertEqual(precursor_candidates(envelopes).tolist(), [0, 1, 4])
+
+    def test_too_intense_next_peak_is_not_an_isotope(self):
+        envelopes = detect_envelopes([500.0, 500.0 + ISOTOPE_SPACING],
+                                     [10.0, 1000.0])
+        self.assertEqual(envelopes.charges.tolist(), [0, 0])
+        self.assertEqual(precursor_candidates(envelopes).tolist(), [0, 1])
+
+    def test_single_centroid_has_no_envelope(self):
+        envelopes = detect_envelopes([500.0], [10.0])
+        self.assertEqual(envelopes.charges.tolist(), [0])
+        self.assertEqual(envelopes.monoisotopic.tolist(), [0])
+
+if __name__ == '__main__':
+    unittest.main()
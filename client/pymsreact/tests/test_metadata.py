@@ -0,0 +1,117 @@
+# Tests of the instrument metadata and of the response matching of the
+# instrument client of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from com import metadata
+from com.instrument import InstrumentClient
+from com.protocol.msrp import MSReactProtocol
+
+POSSIBLE_PARAMS = [{'Name' : 'Resolution', 'DefaultValue' : 15000}]
+
+class TestMetadataRevalidation(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(metadata, 'CACHE_DIR', cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = InstrumentClient(MSReactProtocol(None),
+                                       lambda msg, args = None : None)
+        self.client.get_possible_params = \
+            mock.AsyncMock(return_value = POSSIBLE_PARAMS)
+        self.client.get_instrument_type = \
+            mock.AsyncMock(return_value = 'Orbitrap')
+        self.key = metadata.snapshot_key(None, 1, '1.0', '1.0')
+        self.snapshot = {'protocol_version' : None,
+                         'server_version' : None,
+                         'instrument_type' : 'Orbitrap',
+                         'possible_params' : POSSIBLE_PARAMS}
+        metadata.save_snapshot(self.key, self.snapshot)
+
+    async def validate(self):
+        self.client.revalidation_task = asyncio.create_task(
+            self.client._InstrumentClient__revalidate_metadata(self.key,
+                                                               self.snapshot))
+        return await self.client.validate_metadata()
+
+    async def test_collected_metadata_is_valid(self):
+        self.assertTrue(await self.client.validate_metadata())
+
+    async def test_unchanged_metadata_is_valid(self):
+        self.assertTrue(await self.validate())
+        self.assertEqual(metadata.load_snapshot(self.key), self.snapshot)
+
+    async def test_changed_metadata_is_not_valid(self):
+        self.client.get_instrument_type.return_value = 'Astral'
+        self.assertFalse(await self.validate())
+        self.assertEqual(self.client.instrument_type, 'Astral')
+        self.assertEqual(metadata.load_snapshot(self.key)['instrument_type'],
+                         'Astral')
+
+    async def test_unchecked_snapshot_is_invalidated(self):
+        self.client.get_possible_params.side_effect = ConnectionError()
+        self.assertFalse(await self.validate())
+        self.assertIsNone(metadata.load_snapshot(self.key))
+
+class Protocol:
+    # Answers the commands with the responses queued for them, and records
+    # the commands.
+    MessageIDs = MSReactProtocol.MessageIDs
+
+    def __init__(self):
+        self.client = None
+        self.sent = []
+
+    async def send_message(self, msg, payload = None):
+        self.sent.append(msg)
+
+    async def answer(self, msg, payload = None):
+        await self.client._InstrumentClient__dispatch_message(msg, payload)
+
+class TestResponseMatching(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.proto = Protocol()
+        self.client = InstrumentClient(self.proto, lambda msg, args = None : None)
+        self.proto.client = self.client
+        self.ids = self.proto.MessageIDs
+
+    async def test_responses_are_matched_by_type(self):
+        version = asyncio.create_task(self.client.get_server_version())
+        select = asyncio.create_task(self.client.select_instrument(1))
+        await asyncio.sleep(0)
+        await self.proto.answer(self.ids.OK_RSP)
+        await self.proto.answer(self.ids.SERVER_SW_VER_RSP, '2.0')
+        self.assertEqual(await version, '2.0')
+        await select
+
+    async def test_late_error_of_a_probe_is_not_paired_with_a_request(self):
+        self.client.READY_RETRY_INTERVAL = 0.01
+        ready = asyncio.create_task(self.client.wait_until_ready())
+        # The second probe is answered first.
+        await asyncio.sleep(0.015)
+        await self.proto.answer(self.ids.SERVER_PROTO_VER_RSP, 'v0.1')
+        self.assertEqual(await ready, 'v0.1')
+        version = asyncio.create_task(self.client.get_server_version())
+        await asyncio.sleep(0)
+        await self.proto.answer(self.ids.ERROR_RSP)
+        await self.proto.answer(self.ids.SERVER_SW_VER_RSP, '2.0')
+        self.assertEqual(await version, '2.0')
+        self.assertFalse(self.client.pending_responses)
+
+if __name__ == '__main__':
+    unittest.main()
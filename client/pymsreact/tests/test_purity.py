@@ -0,0 +1,44 @@
+# Tests of the isolation purity of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.isotopes import detect_envelopes, ISOTOPE_SPACING
+from utils.purity import isolation_purity
+
+# Doubly charged envelope at 500, an interfering peak inside its isolation
+# window and a lone peak at 700
+MZS = np.array([500.0, 500.3, 500.0 + ISOTOPE_SPACING / 2,
+                500.0 + ISOTOPE_SPACING, 700.0])
+INTENSITIES = np.array([100.0, 20.0, 80.0, 40.0, 50.0])
+
+class TestIsolationPurity(unittest.TestCase):
+
+    def test_envelope_counts_as_the_precursor(self):
+        envelopes = detect_envelopes(MZS, INTENSITIES)
+        # The last isotope peak is outside of the window.
+        purity = isolation_purity(MZS, INTENSITIES, [0, 4], 2.0, envelopes)
+        self.assertAlmostEqual(purity[0], 180.0 / 200.0)
+        self.assertAlmostEqual(purity[1], 1.0)
+
+    def test_without_envelopes_only_the_precursor_counts(self):
+        purity = isolation_purity(MZS, INTENSITIES, [0], 2.0)
+        self.assertAlmostEqual(purity[0], 100.0 / 200.0)
+
+    def test_precursor_outside_of_the_window(self):
+        purity = isolation_purity(MZS, INTENSITIES, [0], 1.0,
+                                  isolation_offset = 100.0)
+        self.assertEqual(purity.tolist(), [0.0])
+        self.assertEqual(len(isolation_purity(MZS, INTENSITIES, [], 1.0)), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+# Tests of the quality control traces of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.qc_metrics import Trace
+
+class TestTrace(unittest.TestCase):
+
+    def test_bins_the_values(self):
+        trace = Trace(1.0, max_points = 4)
+        for time, value in [(10.0, 1.0), (10.5, 3.0), (12.0, 5.0)]:
+            trace.add(time, value)
+        times, values = trace.points()
+        self.assertEqual(times.tolist(), [10.0, 12.0])
+        self.assertEqual(values.tolist(), [2.0, 5.0])
+
+    def test_early_values_go_to_the_first_bin(self):
+        trace = Trace(1.0, 'max', max_points = 4)
+        trace.add(10.0, 1.0)
+        trace.add(13.0, 2.0)
+        trace.add(5.0, 7.0)
+        times, values = trace.points()
+        self.assertEqual(times.tolist(), [10.0, 13.0])
+        self.assertEqual(values.tolist(), [7.0, 2.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Tests of the mass recalibration of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.recalibration import MassRecalibration
+
+LOCK_MZ = MassRecalibration.POLYSILOXANE_MZ
+
+class TestMassRecalibration(unittest.TestCase):
+
+    def observe(self, recalibration, error, rts):
+        # Observes the lock mass measured with an error in ppm in a scan at
+        # each retention time.
+        for rt in rts:
+            recalibration.observe(np.array([300.0, LOCK_MZ * (1 + error * 1e-6)]),
+                                  np.array([10.0, 10.0]), rt)
+
+    def test_corrects_the_lock_mass_error(self):
+        recalibration = MassRecalibration()
+        self.observe(recalibration, 5.0, [0.0, 0.1])
+        # Not enough observations yet
+        self.assertEqual(recalibration.correction, (0.0, 0.0))
+        self.observe(recalibration, 5.0, [0.2])
+        self.assertAlmostEqual(recalibration.correction[0], 5.0)
+        measured = np.array([LOCK_MZ, 800.0]) * (1 + 5e-6)
+        corrected = recalibration.correct(measured)
+        self.assertIs(corrected, measured)
+        np.testing.assert_allclose(corrected, [LOCK_MZ, 800.0], rtol = 1e-9)
+
+    def test_lock_masses_outside_of_the_tolerance_are_ignored(self):
+        recalibration = MassRecalibration(tolerance = 20)
+        self.assertEqual(recalibration.observe(np.array([LOCK_MZ * (1 + 50e-6)]),
+                                               np.array([10.0]), 0.0), 0)
+        self.assertEqual(recalibration.observe(np.array([]), np.array([]), 0.1), 0)
+
+    def test_old_observations_leave_the_window(self):
+        recalibration = MassRecalibration(window = 1.0)
+        self.observe(recalibration, 5.0, [0.0, 0.1, 0.2])
+        self.observe(recalibration, 5.0, [])
+        recalibration.observe(np.array([]), np.array([]), 2.0)
+        self.assertEqual(recalibration.correction, (0.0, 0.0))
+
+    def test_linear_correction_of_references(self):
+        recalibration = MassRecalibration(lock_mzs = [], degree = 1)
+        theoretical = np.array([300.0, 600.0, 900.0, 1200.0])
+        errors = 2.0 + 0.005 * theoretical
+        recalibration.add_references(theoretical * (1 + errors * 1e-6),
+                                     theoretical, 0.0)
+        offset, slope = recalibration.correction
+        self.assertAlmostEqual(offset, 2.0, places = 6)
+        self.assertAlmostEqual(slope, 0.005, places = 9)
+        corrected = recalibration.correct(theoretical * (1 + errors * 1e-6))
+        np.testing.assert_allclose(corrected, theoretical, rtol = 1e-8)
+
+    def test_unsupported_degree(self):
+        with self.assertRaises(ValueError):
+            MassRecalibration(degree = 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Tests of the repeating scan manager of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import asyncio
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.scan_request import RepeatingScanRequest
+from com.repeating_scans import RepeatingScanManager
+
+class Instrument:
+    # Keeps the repeating scans issued on the instrument, and fails the
+    # given number of next set and clear calls.
+    def __init__(self):
+        self.repeating = []
+        self.set_failures = 0
+        self.clear_failures = 0
+
+    async def set(self, params):
+        if self.set_failures:
+            self.set_failures -= 1
+            raise ConnectionError(f'Failed to set {params}')
+        self.repeating.append(params)
+
+    async def clear(self):
+        if self.clear_failures:
+            self.clear_failures -= 1
+            raise ConnectionError('Failed to clear')
+        self.repeating = []
+
+class TestRepeatingScanManager(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.instrument = Instrument()
+        self.manager = RepeatingScanManager(self.instrument.set,
+                                            self.instrument.clear,
+                                            retry_interval = 0.01)
+        self.task = asyncio.create_task(self.manager.run())
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions = True)
+
+    async def test_issues_the_highest_priority_scan(self):
+        self.manager.add(RepeatingScanRequest('low', 1, priority = 1))
+        self.manager.add(RepeatingScanRequest('high', 2, priority = 2))
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.instrument.repeating, ['high'])
+        self.manager.remove(2)
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.instrument.repeating, ['low'])
+
+    async def test_replacing_an_active_scan_clears_the_old_one(self):
+        self.manager.add(RepeatingScanRequest(500, 1))
+        await asyncio.sleep(0.02)
+        self.manager.add(RepeatingScanRequest(600, 1))
+        await asyncio.sleep(0.02)
+        self.assertEqual(self.instrument.repeating, [600])
+
+    async def test_retries_a_failed_update(self):
+        self.instrument.set_failures = 1
+        self.manager.add(RepeatingScanRequest('scan', 1))
+        await asyncio.sleep(0.05)
+        self.assertFalse(self.task.done())
+        self.assertEqual(self.instrument.repeating, ['scan'])
+        self.assertEqual(self.manager.stats['failed'], 1)
+
+    async def test_raises_after_consecutive_failures(self):
+        self.manager.max_failures = 3
+        self.instrument.set_failures = 3
+        self.manager.add(RepeatingScanRequest('scan', 1))
+        await asyncio.sleep(0.1)
+        self.assertTrue(self.task.done())
+        self.assertIsInstance(self.task.exception(), ConnectionError)
+
+    async def test_clears_the_scans_on_shutdown(self):
+        self.manager.add(RepeatingScanRequest('scan', 1))
+        await asyncio.sleep(0.02)
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions = True)
+        self.assertEqual(self.instrument.repeating, [])
+
+    async def test_clears_the_scans_on_shutdown_after_a_failure(self):
+        self.instrument.set_failures = 1
+        self.instrument.repeating = ['left over']
+        self.manager.add(RepeatingScanRequest('scan', 1))
+        await asyncio.sleep(0.001)
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions = True)
+        self.assertEqual(self.instrument.repeating, [])
+
+    async def test_shutdown_survives_a_failed_clear(self):
+        self.manager.add(RepeatingScanRequest('scan', 1))
+        await asyncio.sleep(0.02)
+        self.instrument.clear_failures = 1
+        self.task.cancel()
+        results = await asyncio.gather(self.task, return_exceptions = True)
+        self.assertIsNone(results[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Tests of the custom scan request tracking of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import logging
+import os
+import queue
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.acquisition import Acquisition, AcqMsgIDs, ScanFields
+from algorithms.manager.request_tracker import RequestTracker
+
+class TestRequestTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = RequestTracker(timeout = 60)
+
+    def test_matches_scans_to_requests(self):
+        self.tracker.request_sent(1)
+        self.tracker.request_sent('2')
+        self.assertTrue(self.tracker.scan_received('1'))
+        self.assertFalse(self.tracker.scan_received(3))
+        stats = self.tracker.stats()
+        self.assertEqual(stats['fulfilled'], 1)
+        self.assertEqual(stats['unmatched'], 1)
+        self.assertEqual(stats['queue_depth'], 1)
+        self.assertIsNotNone(stats['latency_median'])
+
+    def test_expired_requests_are_lost(self):
+        self.tracker.request_sent(1)
+        self.tracker.request_sent(2)
+        self.tracker.scan_received(1)
+        self.tracker.timeout = 0
+        stats = self.tracker.stats()
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['loss_rate'], 0.5)
+
+    def test_dropped_requests_are_not_lost(self):
+        self.tracker.request_sent(1)
+        self.tracker.request_sent(2)
+        self.tracker.scan_received(1)
+        self.tracker.request_dropped(2)
+        # Dropped twice, or dropped after it expired
+        self.tracker.request_dropped(2)
+        self.tracker.timeout = 0
+        stats = self.tracker.stats()
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['expired'], 0)
+        self.assertEqual(stats['loss_rate'], 0.0)
+        self.assertEqual(stats['queue_depth'], 0)
+
+class TestTemplateRequestTracking(unittest.TestCase):
+
+    def setUp(self):
+        # The acquisition redirects the root logger to its output queue.
+        root = logging.getLogger()
+        self.handlers, self.level = list(root.handlers), root.level
+        self.acquisition = Acquisition(queue.Queue(), queue.Queue())
+
+    def tearDown(self):
+        root = logging.getLogger()
+        root.handlers, root.level = self.handlers, self.level
+
+    def test_template_requests_are_tracked(self):
+        template = self.acquisition.create_scan_template({'ScanType' : 'MSn'})
+        for rn, mz in enumerate([500.0, 600.0], 1):
+            self.acquisition.request_custom_scan(template.render(mz, f'7_{rn}'))
+        # The output queue holds the log records as well.
+        requests = [item[1] for item in self.acquisition.queue_out.queue
+                    if isinstance(item, tuple) and
+                    AcqMsgIDs.REQUEST_SCAN == item[0]]
+        self.assertEqual([request.request_id for request in requests],
+                         ['7_1', '7_2'])
+        for message in [(AcqMsgIDs.SCAN, {ScanFields.MS_SCAN_LEVEL : 2,
+                                          ScanFields.ACCESS_ID : '7_1'}),
+                        (AcqMsgIDs.REQUEST_DROPPED, '7_2'),
+                        (AcqMsgIDs.ERROR, None)]:
+            self.acquisition.queue_in.put(message)
+        self.acquisition.listen_for_messages()
+        stats = self.acquisition.get_request_stats()
+        self.assertEqual(stats['requested'], 2)
+        self.assertEqual(stats['fulfilled'], 1)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['unmatched'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
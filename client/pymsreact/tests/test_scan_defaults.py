@@ -0,0 +1,185 @@
+# Tests of the delta encoding of the custom scan requests of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import msgpack
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.scan_request import ScanRequestTemplate
+from com.instrument import InstrumentClient
+from com.protocol.msrp import MSReactProtocol
+from com.scan_defaults import ScanDefaults
+
+POSSIBLE_PARAMS = [{'Name' : 'Resolution', 'DefaultValue' : 15000},
+                   {'Name' : 'IsolationWidth', 'DefaultValue' : 1.6},
+                   {'Name' : 'PrecursorMass', 'DefaultValue' : None}]
+
+class TestScanDefaults(unittest.TestCase):
+
+    def setUp(self):
+        self.defaults = ScanDefaults(POSSIBLE_PARAMS, promotion_threshold = 3)
+
+    def promote(self, request, count):
+        # Tracks the request count times, registering the promotions.
+        for _ in range(count):
+            promotion = self.defaults.track(request)
+            if promotion is not None:
+                self.defaults.promoted(promotion)
+
+    def test_promotes_repeated_values(self):
+        request = {'Resolution' : '30000', 'PrecursorMass' : '500.0'}
+        self.assertIsNone(self.defaults.track(request))
+        self.assertIsNone(self.defaults.track(request))
+        self.assertEqual(self.defaults.track(request), {'Resolution' : '30000'})
+
+    def test_changed_value_restarts_the_streak(self):
+        self.promote({'Resolution' : '30000'}, 2)
+        self.assertIsNone(self.defaults.track({'Resolution' : '60000'}))
+        self.assertIsNone(self.defaults.track({'Resolution' : '30000'}))
+
+    def test_never_promotes_excluded_or_unknown_params(self):
+        self.promote({'PrecursorMass' : '500.0', 'Unknown' : '1'}, 5)
+        self.assertEqual(self.defaults.current,
+                         {'Resolution' : '15000', 'IsolationWidth' : '1.6'})
+
+    def test_encode_leaves_out_defaults(self):
+        request = {'Resolution' : '30000', 'IsolationWidth' : '1.6',
+                   'PrecursorMass' : '500.0'}
+        self.assertEqual(self.defaults.encode(request),
+                         {'Resolution' : '30000', 'PrecursorMass' : '500.0'})
+        self.promote(request, 3)
+        self.assertEqual(self.defaults.encode(request),
+                         {'PrecursorMass' : '500.0'})
+
+    def test_encode_sends_the_original_default_of_left_out_params(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.assertEqual(self.defaults.encode({'PrecursorMass' : '500.0'}),
+                         {'PrecursorMass' : '500.0', 'Resolution' : '15000'})
+
+    def test_left_out_params_are_restored_after_repeats(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.promote({}, 3)
+        self.assertEqual(self.defaults.current['Resolution'], '15000')
+        self.assertFalse(self.defaults.promoted_names)
+        self.assertEqual(self.defaults.encode({}), {})
+
+    def test_complete_adds_the_original_defaults(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.assertEqual(self.defaults.complete({'PrecursorMass' : '500.0'}),
+                         {'PrecursorMass' : '500.0', 'Resolution' : '15000'})
+        self.assertEqual(self.defaults.complete({'Resolution' : '60000'}),
+                         {'Resolution' : '60000'})
+
+    def test_activate_restores_the_other_promoted_params(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.assertEqual(self.defaults.activate({'IsolationWidth' : '2.0'}),
+                         {'IsolationWidth' : '2.0', 'Resolution' : '15000'})
+        self.defaults.promoted({'IsolationWidth' : '2.0',
+                                'Resolution' : '15000'})
+        self.assertIsNone(self.defaults.activate({'IsolationWidth' : '2.0'}))
+
+    def test_disowned_defaults_are_not_relied_on(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.defaults.disown()
+        self.assertIsNone(self.defaults.track({'Resolution' : '60000'}))
+        self.assertIsNone(self.defaults.activate({'Resolution' : '60000'}))
+        self.assertEqual(self.defaults.encode({'PrecursorMass' : '500.0'}),
+                         {'PrecursorMass' : '500.0', 'Resolution' : '15000',
+                          'IsolationWidth' : '1.6'})
+
+    def test_explicit_defaults_reset_the_promotions(self):
+        self.promote({'Resolution' : '30000'}, 3)
+        self.defaults.set_defaults({'Resolution' : 60000})
+        self.assertEqual(self.defaults.base['Resolution'], '60000')
+        self.assertFalse(self.defaults.promoted_names)
+        self.assertEqual(self.defaults.encode({}), {})
+
+class Protocol:
+    # Records the sent messages, and answers the default parameter updates
+    # with the given response.
+    MessageIDs = MSReactProtocol.MessageIDs
+
+    def __init__(self, response = MessageIDs.OK_RSP):
+        self.client = None
+        self.response = response
+        self.sent = []
+
+    async def send_message(self, msg, payload = None):
+        self.sent.append((msg, payload))
+        if self.MessageIDs.UPDATE_DEF_SCAN_PARAMS_CMD == msg:
+            await self.client._InstrumentClient__dispatch_message(
+                self.response, None)
+
+    async def send_packed(self, msg, packed_payload):
+        self.sent.append((msg, msgpack.unpackb(packed_payload)))
+
+class TestInstrumentClientRequests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        await self.connect(Protocol())
+
+    async def connect(self, proto):
+        self.proto = proto
+        self.client = InstrumentClient(self.proto, lambda msg, args : None)
+        self.proto.client = self.client
+        self.client.scan_defaults = ScanDefaults(POSSIBLE_PARAMS,
+                                                 promotion_threshold = 2)
+        self.template = ScanRequestTemplate({'Resolution' : '30000',
+                                             'ScanType' : 'MSn'},
+                                            POSSIBLE_PARAMS + [{'Name' : 'ScanType'}])
+        await self.client.register_scan_template(self.template.template_id,
+                                                 self.template.defaults)
+        self.ids = self.proto.MessageIDs
+
+    async def test_template_defaults_are_set_once(self):
+        for mz in [500.0, 600.0]:
+            await self.client.request_scan(self.template.render(mz, 'id'))
+        self.assertEqual(self.proto.sent, [
+            (self.ids.UPDATE_DEF_SCAN_PARAMS_CMD, {'Resolution' : '30000'}),
+            (self.ids.REQ_CUSTOM_SCAN_CMD,
+             {'ScanType' : 'MSn', 'PrecursorMass' : '500.0',
+              'REQUEST_ID' : 'id'}),
+            (self.ids.REQ_CUSTOM_SCAN_CMD,
+             {'ScanType' : 'MSn', 'PrecursorMass' : '600.0',
+              'REQUEST_ID' : 'id'})])
+
+    async def test_template_and_dictionary_requests_share_the_defaults(self):
+        await self.client.request_scan({'PrecursorMass' : '500.0'})
+        await self.client.request_scan({'Resolution' : '60000'})
+        await self.client.request_scan({'Resolution' : '60000'})
+        await self.client.request_scan(self.template.render(700.0, 'id'))
+        self.assertEqual(self.proto.sent[1],
+                         (self.ids.REQ_CUSTOM_SCAN_CMD,
+                          {'PrecursorMass' : '500.0', 'Resolution' : '15000'}))
+        # The defaults of the template are set again after the promotion.
+        updates = [payload for msg, payload in self.proto.sent
+                   if self.ids.UPDATE_DEF_SCAN_PARAMS_CMD == msg]
+        self.assertEqual(updates, [{'Resolution' : '30000'},
+                                   {'Resolution' : '60000'},
+                                   {'Resolution' : '30000'}])
+
+    async def test_refused_defaults_are_not_relied_on(self):
+        await self.connect(Protocol(MSReactProtocol.MessageIDs.ERROR_RSP))
+        await self.client.request_scan(self.template.render(500.0, 'id'))
+        self.assertEqual(self.proto.sent[-1],
+                         (self.ids.REQ_CUSTOM_SCAN_CMD,
+                          {'Resolution' : '30000', 'IsolationWidth' : '1.6',
+                           'ScanType' : 'MSn', 'PrecursorMass' : '500.0',
+                           'REQUEST_ID' : 'id'}))
+
+    async def test_repeating_scans_do_not_rely_on_promoted_defaults(self):
+        await self.client.request_scan(self.template.render(500.0, 'id'))
+        await self.client.request_repeating_scan({'PrecursorMass' : '800.0'})
+        self.assertEqual(self.proto.sent[-1],
+                         (self.ids.SET_REPEATING_SCAN_CMD,
+                          {'PrecursorMass' : '800.0', 'Resolution' : '15000'}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# Tests of the survey scan history of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.scan_history import ScanHistory
+
+class TestScanHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = ScanHistory(max_scans = 3, max_centroids = 4)
+        for scan in range(4):
+            self.history.add([500.0, 500.002, 600.0],
+                             [1.0 + scan, 10.0, 100.0], scan * 0.1, scan)
+
+    def test_oldest_scans_are_evicted(self):
+        self.assertEqual(len(self.history), 3)
+        self.assertEqual(self.history.scan_numbers.tolist(), [1, 2, 3])
+        np.testing.assert_allclose(self.history.rts, [0.1, 0.2, 0.3])
+        mzs, intensities, rt, scan_number = self.history.scan(-1)
+        np.testing.assert_allclose(mzs, [500.0, 500.002, 600.0])
+        np.testing.assert_allclose(intensities, [4.0, 10.0, 100.0])
+        self.assertEqual(scan_number, 3)
+
+    def test_xic_sums_the_centroids_within_the_tolerance(self):
+        rts, xic = self.history.xic([600.0, 500.0, 800.0], tolerance = 10)
+        np.testing.assert_allclose(rts, [0.1, 0.2, 0.3])
+        np.testing.assert_allclose(xic, [[100.0, 100.0, 100.0],
+                                         [12.0, 13.0, 14.0],
+                                         [0.0, 0.0, 0.0]])
+        _, xic = self.history.xic([500.0], tolerance = 0.001, ppm = False)
+        np.testing.assert_allclose(xic, [[2.0, 3.0, 4.0]])
+
+    def test_xic_of_a_retention_time_range(self):
+        rts, xic = self.history.xic([600.0], rt_range = (0.15, 0.35))
+        np.testing.assert_allclose(rts, [0.2, 0.3])
+        self.assertEqual(xic.shape, (1, 2))
+
+    def test_keeps_the_most_intense_centroids(self):
+        history = ScanHistory(max_scans = 2, max_centroids = 2)
+        history.add([100.0, 200.0, 300.0, 400.0], [5.0, 1.0, 7.0, 2.0], 0.0)
+        mzs, intensities, _, _ = history.scan(0)
+        np.testing.assert_allclose(mzs, [100.0, 300.0])
+        np.testing.assert_allclose(intensities, [5.0, 7.0])
+
+if __name__ == '__main__':
+    unittest.main()
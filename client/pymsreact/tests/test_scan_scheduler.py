@@ -0,0 +1,149 @@
+# Tests of the scan request scheduler of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import asyncio
+import os
+import sys
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from algorithms.manager.scan_request import ScanRequest
+from com.scan_scheduler import ScanRequestScheduler
+
+class Instrument:
+    # Records the requests sent to the scheduler callbacks, and fails the
+    # sends of the parameters in fail_params.
+    def __init__(self, fail_params = ()):
+        self.sent = []
+        self.cancels = 0
+        self.fail_params = fail_params
+
+    async def send(self, params):
+        if params in self.fail_params:
+            raise ConnectionError(f'Failed to send {params}')
+        self.sent.append(params)
+
+    async def cancel(self):
+        self.cancels += 1
+
+class TestScanRequestScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.instrument = Instrument()
+        self.dropped = []
+        self.scheduler = ScanRequestScheduler(self.instrument.send,
+                                              self.instrument.cancel,
+                                              self.dropped.append)
+
+    def dropped_params(self):
+        return [request.params for request in self.dropped]
+
+    async def run_scheduler(self, duration = 0.05):
+        # Runs the scheduler for a while, and returns the error it raised.
+        task = asyncio.create_task(self.scheduler.run())
+        await asyncio.sleep(duration)
+        if task.done():
+            return task.exception()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions = True)
+        return None
+
+    async def test_sends_by_priority(self):
+        self.scheduler.submit(ScanRequest('low', priority = 1))
+        self.scheduler.submit(ScanRequest('high', priority = 2))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['high', 'low'])
+        self.assertEqual(self.scheduler.stats['sent'], 2)
+
+    async def test_drops_duplicate_requests(self):
+        self.scheduler.submit(ScanRequest('first', precursor_mz = 500.0))
+        self.scheduler.submit(ScanRequest('duplicate', precursor_mz = 500.005))
+        self.scheduler.submit(ScanRequest('other', precursor_mz = 600.0))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['first', 'other'])
+        self.assertEqual(self.scheduler.stats['duplicate'], 1)
+        self.assertEqual(self.dropped_params(), ['duplicate'])
+
+    async def test_higher_priority_duplicate_replaces_pending(self):
+        self.scheduler.submit(ScanRequest('low', priority = 1,
+                                          precursor_mz = 500.0))
+        self.scheduler.submit(ScanRequest('high', priority = 2,
+                                          precursor_mz = 500.0))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['high'])
+        self.assertEqual(self.dropped_params(), ['low'])
+
+    async def test_drops_duplicates_of_queued_requests(self):
+        self.scheduler.submit(ScanRequest('first', precursor_mz = 500.0))
+        await self.run_scheduler(0.001)
+        self.scheduler.submit(ScanRequest('again', precursor_mz = 500.0))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['first'])
+
+    async def test_drops_superseded_pending_requests(self):
+        self.scheduler.submit(ScanRequest('old', survey_scan = 1))
+        self.scheduler.survey_scan_received(2)
+        self.scheduler.submit(ScanRequest('older', survey_scan = 1))
+        self.scheduler.submit(ScanRequest('new', survey_scan = 2))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['new'])
+        self.assertEqual(self.scheduler.stats['superseded'], 2)
+        self.assertEqual(self.instrument.cancels, 0)
+        self.assertEqual(self.dropped_params(), ['old', 'older'])
+
+    async def test_cancels_superseded_queued_requests(self):
+        self.scheduler.scan_time = 1
+        self.scheduler.submit(ScanRequest('old', survey_scan = 1))
+        await self.run_scheduler(0.001)
+        self.scheduler.survey_scan_received(2)
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['old'])
+        self.assertEqual(self.instrument.cancels, 1)
+        self.assertEqual(self.scheduler.stats['cancelled'], 1)
+        self.assertFalse(self.scheduler.queued)
+        self.assertEqual(self.dropped_params(), ['old'])
+
+    async def test_drops_expired_requests(self):
+        self.scheduler.submit(ScanRequest('expired', deadline = 0))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, [])
+        self.assertEqual(self.dropped_params(), ['expired'])
+
+    async def test_keeps_running_after_a_failed_send(self):
+        self.instrument.fail_params = ['broken']
+        self.scheduler.submit(ScanRequest('broken', priority = 2,
+                                          precursor_mz = 500.0))
+        self.scheduler.submit(ScanRequest('next', priority = 1))
+        self.assertIsNone(await self.run_scheduler())
+        self.assertEqual(self.instrument.sent, ['next'])
+        self.assertEqual(self.scheduler.stats['failed'], 1)
+        self.assertEqual(self.scheduler.stats['sent'], 1)
+        self.assertEqual(self.dropped_params(), ['broken'])
+        # The failed request is not considered queued on the instrument.
+        self.scheduler.submit(ScanRequest('retry', precursor_mz = 500.0))
+        await self.run_scheduler()
+        self.assertEqual(self.instrument.sent, ['next', 'retry'])
+
+    async def test_raises_after_consecutive_failures(self):
+        self.scheduler.max_failures = 3
+        self.instrument.fail_params = [f'broken {i}' for i in range(3)]
+        for params in self.instrument.fail_params:
+            self.scheduler.submit(ScanRequest(params))
+        self.assertIsInstance(await self.run_scheduler(), ConnectionError)
+        self.assertEqual(self.scheduler.stats['failed'], 3)
+
+    async def test_success_resets_the_failures(self):
+        self.scheduler.max_failures = 2
+        self.instrument.fail_params = ['broken 0', 'broken 1']
+        for priority, params in enumerate(['broken 1', 'ok', 'broken 0']):
+            self.scheduler.submit(ScanRequest(params, priority = priority))
+        self.assertIsNone(await self.run_scheduler())
+        self.assertEqual(self.instrument.sent, ['ok'])
+
+if __name__ == '__main__':
+    unittest.main()
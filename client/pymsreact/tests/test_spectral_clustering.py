@@ -0,0 +1,77 @@
+# Tests of the MS2 spectrum clustering of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.spectral_clustering import SpectrumClusters
+
+def random_spectrum(seed):
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.uniform(150, 1500, 40)), rng.uniform(1e3, 1e5, 40)
+
+class TestSpectrumClusters(unittest.TestCase):
+
+    def test_repeated_spectra_join_one_cluster(self):
+        clusters = SpectrumClusters()
+        mzs, intensities = random_spectrum(0)
+        results = [clusters.add(mzs, intensities, 500.0, rt * 0.1, charge = 2)
+                   for rt in range(3)]
+        self.assertEqual(results, [(0, 1), (0, 2), (0, 3)])
+        self.assertEqual(len(clusters), 1)
+        # A slightly different spectrum of the same precursor joins it too.
+        noisy = intensities * np.random.default_rng(1).uniform(0.9, 1.1, len(mzs))
+        self.assertEqual(clusters.add(mzs, noisy, 500.004, 0.3), (0, 4))
+
+    def test_different_spectra_or_precursors_start_new_clusters(self):
+        clusters = SpectrumClusters()
+        mzs, intensities = random_spectrum(0)
+        clusters.add(mzs, intensities, 500.0, 0.0, charge = 2)
+        self.assertEqual(clusters.add(*random_spectrum(1), 500.0, 0.1), (1, 1))
+        self.assertEqual(clusters.add(mzs, intensities, 510.0, 0.2), (2, 1))
+        self.assertEqual(clusters.add(mzs, intensities, 500.0, 0.3,
+                                      charge = 3), (3, 1))
+        self.assertEqual(len(clusters), 4)
+
+    def test_redundant_precursors(self):
+        clusters = SpectrumClusters(min_size = 2)
+        mzs, intensities = random_spectrum(0)
+        clusters.add(mzs, intensities, 500.0, 0.0, charge = 2)
+        clusters.add(*random_spectrum(1), 600.0, 0.0)
+        precursors = [500.001, 600.0, 700.0]
+        self.assertEqual(clusters.redundant(precursors).tolist(),
+                         [False, False, False])
+        self.assertEqual(clusters.redundant(precursors, min_size = 1).tolist(),
+                         [True, True, False])
+        clusters.add(mzs, intensities, 500.0, 0.1, charge = 2)
+        self.assertEqual(clusters.redundant(precursors).tolist(),
+                         [True, False, False])
+        self.assertEqual(clusters.redundant(precursors, charges = [3, 0, 0]).tolist(),
+                         [False, False, False])
+        self.assertEqual(clusters.redundant(precursors, charges = [0, 0, 0]).tolist(),
+                         [True, False, False])
+
+    def test_least_recently_updated_cluster_is_evicted(self):
+        clusters = SpectrumClusters(max_clusters = 2)
+        first = random_spectrum(0)
+        clusters.add(*first, 500.0, 0.0)
+        clusters.add(*random_spectrum(1), 600.0, 0.1)
+        # The first cluster is updated after the second one.
+        clusters.add(*first, 500.0, 0.2)
+        self.assertEqual(clusters.add(*random_spectrum(2), 700.0, 0.3), (2, 1))
+        self.assertEqual(len(clusters), 2)
+        self.assertEqual(clusters.redundant([500.0, 600.0, 700.0],
+                                            min_size = 1).tolist(),
+                         [True, False, True])
+        self.assertEqual(clusters.add(*first, 500.0, 0.4), (0, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Tests of the batched MS2 spectrum preprocessing of pymsreact
+#
+# Usage (from the client/pymsreact folder):
+#   python -m unittest discover tests
+
+import os
+import sys
+import functools
+import unittest
+import numpy as np
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'pymsreact')
+sys.path.insert(0, PACKAGE_DIR)
+
+from utils.isotopes import ISOTOPE_SPACING, PROTON_MASS
+from utils.spectrum_processing import (spectra_from_arrays, split_spectra,
+                                       spectrum_max, filter_relative_intensity,
+                                       remove_noise, top_k_per_window, deisotope,
+                                       reduce_charges, normalize_intensities,
+                                       SpectrumPipeline)
+
+class TestSpectrumProcessing(unittest.TestCase):
+
+    def setUp(self):
+        # Two spectra around an empty one
+        self.spectra = spectra_from_arrays([
+            ([100.0, 150.0, 250.0, 260.0], [1.0, 50.0, 100.0, 10.0]),
+            ([], []),
+            ([300.0, 400.0], [8.0, 2.0], [0, 2])])
+
+    def assertSpectra(self, spectra, expected):
+        split = split_spectra(spectra)
+        self.assertEqual(len(split), len(expected))
+        for (mzs, intensities, _), (expected_mzs, expected_intensities) in \
+                zip(split, expected):
+            np.testing.assert_allclose(mzs, expected_mzs)
+            np.testing.assert_allclose(intensities, expected_intensities)
+
+    def test_batch_round_trip(self):
+        self.assertEqual(self.spectra.offsets.tolist(), [0, 4, 4, 6])
+        self.assertEqual(self.spectra.charges.tolist(), [0, 0, 0, 0, 0, 2])
+        self.assertSpectra(self.spectra, [([100.0, 150.0, 250.0, 260.0],
+                                           [1.0, 50.0, 100.0, 10.0]),
+                                          ([], []),
+                                          ([300.0, 400.0], [8.0, 2.0])])
+        self.assertEqual(split_spectra(spectra_from_arrays([])), [])
+
+    def test_spectrum_max(self):
+        self.assertEqual(spectrum_max(self.spectra.intensities,
+                                      self.spectra.offsets).tolist(),
+                         [100.0, 0.0, 8.0])
+
+    def test_filter_relative_intensity(self):
+        filtered = filter_relative_intensity(self.spectra, min_relative = 0.2)
+        self.assertSpectra(filtered, [([150.0, 250.0], [50.0, 100.0]),
+                                      ([], []),
+                                      ([300.0, 400.0], [8.0, 2.0])])
+        self.assertEqual(filtered.charges.tolist(), [0, 0, 0, 2])
+
+    def test_remove_noise(self):
+        # The noise levels are the lower medians, 10 and 2.
+        filtered = remove_noise(self.spectra, signal_to_noise = 3)
+        self.assertSpectra(filtered, [([150.0, 250.0], [50.0, 100.0]),
+                                      ([], []),
+                                      ([300.0], [8.0])])
+
+    def test_top_k_per_window(self):
+        filtered = top_k_per_window(self.spectra, k = 1, window = 100.0)
+        self.assertSpectra(filtered, [([150.0, 250.0], [50.0, 100.0]),
+                                      ([], []),
+                                      ([300.0, 400.0], [8.0, 2.0])])
+
+    def test_deisotope(self):
+        spectra = spectra_from_arrays([
+            ([500.0, 500.0 + ISOTOPE_SPACING / 2, 500.0 + ISOTOPE_SPACING, 700.0],
+             [100.0, 60.0, 30.0, 20.0]),
+            ([500.0 + ISOTOPE_SPACING], [30.0])])
+        deisotoped = deisotope(spectra)
+        # The isotope peaks of the doubly charged envelope are removed, the
+        # lone peak of the second spectrum is not an isotope of the first.
+        self.assertSpectra(deisotoped, [([500.0, 700.0], [100.0, 20.0]),
+                                        ([500.0 + ISOTOPE_SPACING], [30.0])])
+        self.assertEqual(deisotoped.charges.tolist(), [2, 0, 0])
+
+    def test_reduce_charges(self):
+        reduced = reduce_charges(self.spectra)
+        self.assertSpectra(reduced, [([100.0, 150.0, 250.0, 260.0],
+                                      [1.0, 50.0, 100.0, 10.0]),
+                                     ([], []),
+                                     ([300.0, 2 * 400.0 - PROTON_MASS],
+                                      [8.0, 2.0])])
+        self.assertEqual(reduced.charges.tolist(), [0, 0, 0, 0, 0, 1])
+
+    def test_normalize_intensities(self):
+        maxima = normalize_intensities(self.spectra)
+        np.testing.assert_allclose(maxima.intensities,
+                                   [0.01, 0.5, 1.0, 0.1, 1.0, 0.25])
+        sums = normalize_intensities(self.spectra, norm = 'sum')
+        np.testing.assert_allclose(sums.intensities[4:], [0.8, 0.2])
+        l2 = normalize_intensities(self.spectra, norm = 'l2', transform = 'sqrt')
+        np.testing.assert_allclose(l2.intensities[4:],
+                                   np.sqrt([8.0, 2.0]) / np.sqrt(10.0))
+        with self.assertRaises(ValueError):
+            normalize_intensities(self.spectra, norm = 'l1')
+        with self.assertRaises(ValueError):
+            normalize_intensities(self.spectra, transform = 'exp')
+
+    def test_pipeline(self):
+        pipeline = SpectrumPipeline([
+            functools.partial(filter_relative_intensity, min_relative = 0.05),
+            normalize_intensities])
+        mzs, intensities, charges = pipeline.process([100.0, 150.0, 250.0],
+                                                     [1.0, 50.0, 100.0])
+        np.testing.assert_allclose(mzs, [150.0, 250.0])
+        np.testing.assert_allclose(intensities, [0.5, 1.0])
+        self.assertEqual(charges.tolist(), [0, 0])
+
+if __name__ == '__main__':
+    unittest.main()